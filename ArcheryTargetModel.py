@@ -1,21 +1,22 @@
 import numpy as np
 import cv2
 from game import TargetType
-from enum import Enum
 from math import sqrt
 
 from targetDetection import targetDetection
 from imageProcessing import getTransformationParameters, reduceImageOfEllipseAndGetNewCenter, getBoundriesAndMask,\
-    reduceImageOfEllipse, reduceImageAndRemoveBackground, getTransformedImage, detectHit
-from hitPlacement import getHitDetectionMask, getBinDiff, getLines, getCoordinates
+    reduceImageAndRemoveBackground, getFusedTransformation, applyFusedTransformation, detectHitInHistory, getEllipseCropBounds
+from hitPlacement import getHitDetectionMask, updateHitDetectionMask, getBinDiffThreshold, getBinDiff, getMotionRoi, getLines,\
+    getCoordinates
 from hiDetectionDataPrepFunctions import prepareDataSet
-
-class ConnectionStatus(Enum):
-    OK = 0
-    ERROR = 1
+from cameraConnection import ConnectionStatus, CameraReader
+from frameHistory import FrameHistory
+from metrics import timed, defaultRegistry
+from driftTracker import DriftTracker, DriftStatus
 
 class ArcheryTargetModel():
-    def __init__(self, targetType: TargetType):
+    def __init__(self, targetType: TargetType, pyramid: bool = False, warpBufferCount: int = 4, maskHitArrows: bool = True,\
+                 motionRoi: bool = False, driftInterval: int = 10, redetectBackoff: int = 3):
         self.__ellipse = None
         self.__newEllipse = None
         self.__rotationMatrix = None
@@ -25,35 +26,87 @@ class ArcheryTargetModel():
         self.__reducingMask = None
         self.__hitDetectionMask = None
         self.__knn = None
+        self.__fusedMatrix = None
+        self.__fusedMask = None
+        self.__transformedShape = None
+
+        # transformed images are written to a ring of preallocated buffers,
+        # returned image stays valid for the next warpBufferCount-1 calls
+        self.__warpBufferCount = warpBufferCount
+        self.__warpBuffers = []
+        self.__warpBufferIdx = 0
         
         self.__targetType = targetType
+        self.__pyramid = pyramid
+
+        # arrows already in target are added to hit detection mask, so they don't show in later differences
+        self.__maskHitArrows = maskHitArrows
+
+        # arrow is localised only in the changed region of the difference, off by default: arrow ends are the same
+        # as on the whole image only without camera noise, noise outside of the region votes in line search
+        self.__motionRoi = motionRoi
+
+        # drift of the target against calibration frame is checked every driftInterval tracked frames,
+        # failed redetection is retried after redetectBackoff further checks
+        self.__driftInterval = driftInterval
+        self.__redetectBackoff = redetectBackoff
+        self.__redetectWait = 0
+        self.__driftTracker = None
+        self.__calibEllipse = None
+        self.__calibFusedMatrix = None
+
+        # history of getHit, a call sliding the previous frames by one reuses their grays and difference
+        self.__hitHistory = FrameHistory(3)
+        self.__hitFrames = (None, None, None)
 
     def detectTarget(self, image: np.ndarray):
         if image is not None:
-            self.__ellipse = targetDetection(image, self.__targetType)
+            with timed('model_detect_target_seconds', 'target ellipse detection'):
+                self.__ellipse = targetDetection(image, self.__targetType, self.__pyramid)
             if self.__ellipse is not None:
-                imReduced, self.__newEllipse = reduceImageOfEllipseAndGetNewCenter(image, self.__ellipse)
-                imTrans, self.__rotationMatrix, self.__scalingMaitrix, self.__targetCenter = getTransformationParameters(imReduced, self.__newEllipse)
-                self.__bnds, self.__reducingMask = getBoundriesAndMask(imTrans, self.__targetCenter, self.__newEllipse[1][1])
-                self.__hitDetectionMask = getHitDetectionMask(imTrans, self.__newEllipse)
-                self.__knn = prepareDataSet()
+                self.__calibrate(image)
             return self.__ellipse
         return None
     
     def prepareTransformation(self, image: np.ndarray):
         if self.__ellipse is not None and image is not None and self.__newEllipse is None:
+            self.__calibrate(image)
+
+    def __calibrate(self, image: np.ndarray):
+        with timed('model_calibrate_seconds', 'transformation and hit detection mask preparation'):
             imReduced, self.__newEllipse = reduceImageOfEllipseAndGetNewCenter(image, self.__ellipse)
             imTrans, self.__rotationMatrix, self.__scalingMaitrix, self.__targetCenter = getTransformationParameters(imReduced, self.__newEllipse)
             self.__bnds, self.__reducingMask = getBoundriesAndMask(imTrans, self.__targetCenter, self.__newEllipse[1][1])
             imTransReduced = reduceImageAndRemoveBackground(imTrans, self.__bnds, self.__reducingMask)
             self.__hitDetectionMask = getHitDetectionMask(imTransReduced, self.__newEllipse)
             self.__knn = prepareDataSet()
-            
+
+            # per frame warp is precomputed as one affine matrix straight into the final target image
+            self.__fusedMatrix = getFusedTransformation(self.__rotationMatrix, self.__scalingMaitrix, self.__bnds)
+            self.__transformedShape = imTransReduced.shape[:2]
+            mask = self.__reducingMask[:self.__transformedShape[0], :self.__transformedShape[1]]
+            self.__fusedMask = None if mask.all() else mask.astype(np.uint8)
+            self.__warpBuffers = []
+            self.__warpBufferIdx = 0
+
+            # drift corrections are composed with the transformation of calibration frame
+            self.__driftTracker = None
+            self.__calibEllipse = self.__ellipse
+            self.__calibFusedMatrix = self.__fusedMatrix
 
     def drawEllipse(self, image: np.ndarray):
         if self.__ellipse is not None and image is not None:
             return cv2.ellipse(image, self.__ellipse, (0,255,0), 2)
         
+    def setEllipse(self, ell):
+        # known target ellipse, transformation is prepared on the next prepareTransformation call
+        self.resetEllipse()
+        self.__ellipse = ell
+        return self.__ellipse
+
+    def getEllipse(self):
+        return self.__ellipse
+
     def createEllipse(self, points):
         if len(points) == 5:
             self.__ellipse = cv2.fitEllipse(np.array(points))
@@ -74,25 +127,121 @@ class ArcheryTargetModel():
         self.__bnds = None
         self.__reducingMask = None
         self.__hitDetectionMask = None
+        self.__driftTracker = None
+
+    def detectTargetFromReader(self, reader: CameraReader):
+        # target detection on the newest frame of a running camera reader
+        frame, status = reader.getLatestFrame()
+        if status == ConnectionStatus.ERROR:
+            return None
+        return self.detectTarget(cv2.cvtColor(frame, cv2.COLOR_BGR2RGB))
+
+    def trackDrift(self, frame: np.ndarray) -> DriftStatus:
+        # camera (BGR) frame, small shift of the target is compensated in the transformation,
+        # large one runs target detection again, first frame after calibration becomes the reference
+        if self.__calibFusedMatrix is None or self.__newEllipse is None or frame is None:
+            return DriftStatus.STABLE
+        if self.__driftTracker is None:
+            self.__driftTracker = DriftTracker(frame, self.__calibEllipse, self.__driftInterval)
+            return DriftStatus.STABLE
+
+        with timed('model_drift_seconds', 'target drift estimation'):
+            status, shift = self.__driftTracker.update(frame)
+        if status == DriftStatus.CORRECTED:
+            self.__applyDrift(frame.shape, shift)
+            defaultRegistry.inc('model_drift_corrections_total', help='small target drift corrections')
+        elif status == DriftStatus.LOST:
+            status = self.__redetect(frame)
+        return status
+
+    def __applyDrift(self, shape, shift):
+        # ellipse follows the target, crop origin moves with it, so the translation compensates
+        # both the shift and the change of crop origin
+        (x, y), axes, angle = self.__calibEllipse
+        self.__ellipse = ((x+shift[0], y+shift[1]), axes, angle)
+        ytopCalib, _, xleftCalib, _ = getEllipseCropBounds(shape, self.__calibEllipse)
+        ytop, _, xleft, _ = getEllipseCropBounds(shape, self.__ellipse)
+        translation = np.array([[1, 0, xleft-xleftCalib-shift[0]], [0, 1, ytop-ytopCalib-shift[1]], [0, 0, 1]])
+        self.__fusedMatrix = self.__calibFusedMatrix @ translation
+
+    def __redetect(self, frame: np.ndarray) -> DriftStatus:
+        if self.__redetectWait > 0:
+            self.__redetectWait -= 1
+            return DriftStatus.LOST
+
+        image = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+        with timed('model_detect_target_seconds', 'target ellipse detection'):
+            ell = targetDetection(image, self.__targetType, self.__pyramid)
+        if ell is None:
+            # calibration is kept until target is found again
+            self.__redetectWait = self.__redetectBackoff
+            defaultRegistry.inc('model_drift_lost_total', help='failed redetections after large drift')
+            return DriftStatus.LOST
+
+        self.__ellipse = ell
+        self.__calibrate(image)
+        defaultRegistry.inc('model_drift_redetections_total', help='redetections after large drift')
+        return DriftStatus.REDETECTED
 
     def getTransformedImage(self, image: np.ndarray):
-        imReduced = reduceImageOfEllipse(image.copy(), self.__ellipse)
-        imTrans = getTransformedImage(imReduced.astype(np.float32), self.__rotationMatrix, self.__scalingMaitrix)
-        return reduceImageAndRemoveBackground(imTrans, self.__bnds, self.__reducingMask)
+        shape = self.__transformedShape+image.shape[2:]
+        if len(self.__warpBuffers) == 0 or self.__warpBuffers[0].shape != shape:
+            self.__warpBuffers = [np.empty(shape, dtype=np.uint8) for _ in range(self.__warpBufferCount)]
+        dst = self.__warpBuffers[self.__warpBufferIdx]
+        self.__warpBufferIdx = (self.__warpBufferIdx+1) % self.__warpBufferCount
+
+        with timed('model_warp_seconds', 'camera frame to target image transformation'):
+            return applyFusedTransformation(image, self.__ellipse, self.__fusedMatrix, self.__transformedShape, dst, self.__fusedMask)
     
+    def addStaticSegment(self, start, end):
+        # (y, x) points in target image, as returned by getCoordinates
+        if self.__hitDetectionMask is not None and not np.array_equal(start, end):
+            updateHitDetectionMask(self.__hitDetectionMask, (start[1], start[0]), (end[1], end[0]))
+
     def getHit(self, ppframe: np.ndarray, pframe: np.ndarray, frame: np.ndarray):
-        if detectHit(ppframe.copy(), pframe.copy(), frame.copy(), self.__knn):
-            framecpy = cv2.cvtColor(frame.copy(), cv2.COLOR_RGB2GRAY)
-            pframecpy = cv2.cvtColor(pframe.copy(), cv2.COLOR_RGB2GRAY)
-
-            diff = np.abs(framecpy.astype(np.int16)-pframecpy.astype(np.int16)).astype(np.uint8)
-            diffBinary = getBinDiff(diff, self.__hitDetectionMask)
-            lines = getLines(diffBinary, self.__newEllipse)
-            _, rightEnd = getCoordinates(diffBinary, self.__newEllipse, lines)
-            print("diffBinary shape: " + str(diffBinary.shape)+"\nright point: "+str(rightEnd))
-            distance = (((rightEnd[0]-diffBinary.shape[0]/2)**2+(rightEnd[1]-diffBinary.shape[1]/2)**2)**0.5)
-            print("\ndistance: "+str(distance))
-            return sqrt((rightEnd[0]-diffBinary.shape[0]//2)**2+(rightEnd[1]-diffBinary.shape[1]//2)**2)/(max(self.__newEllipse[1])/2)
-        return None
+        # ppframe and pframe being pframe and frame of the previous call (same arrays, not changed in place)
+        # only frame is pushed, otherwise history starts again from the three frames
+        if self.__hitHistory.isFull() and ppframe is self.__hitFrames[1] and pframe is self.__hitFrames[2]\
+                and frame is not pframe:
+            self.__hitHistory.push(frame)
+        else:
+            self.__hitHistory.clear()
+            for im in (ppframe, pframe, frame):
+                self.__hitHistory.push(im)
+        self.__hitFrames = (ppframe, pframe, frame)
+        return self.getHitInHistory(self.__hitHistory)
 
-    
\ No newline at end of file
+    def getHitInHistory(self, history: FrameHistory):
+        with timed('model_hit_classify_seconds', 'hit classification of frame differences'):
+            hit = detectHitInHistory(history, self.__knn)
+        if hit:
+            defaultRegistry.inc('model_hits_total', help='detected hits')
+            diff = history.getDiff(0, 1)
+            with timed('model_bin_diff_seconds', 'binary difference of hit frames'):
+                threshold = getBinDiffThreshold(diff)
+                diffBinary = getBinDiff(diff, self.__hitDetectionMask, threshold)
+            if self.__motionRoi:
+                with timed('model_motion_roi_seconds', 'changed region search'):
+                    roi = getMotionRoi(diff, diffBinary, threshold)
+                if roi is not None:
+                    # pixels outside of the region are cleared instead of cropping the image,
+                    # so line parameters and traces are sampled on the same grid as without the region
+                    ytop, ybottom, xleft, xright = roi
+                    regionBinary = np.zeros_like(diffBinary)
+                    regionBinary[ytop:ybottom, xleft:xright] = diffBinary[ytop:ybottom, xleft:xright]
+                    diffBinary = regionBinary
+            with timed('model_lines_seconds', 'arrow line search'):
+                lines = getLines(diffBinary, self.__newEllipse)
+            if lines is None:
+                # hit classified but no arrow line found in the difference
+                defaultRegistry.inc('model_hits_without_line_total', help='hits without arrow line')
+                return None
+            with timed('model_coordinates_seconds', 'arrow end localisation'):
+                leftEnd, rightEnd = getCoordinates(diffBinary, self.__newEllipse, lines)
+            # int16 line samples would overflow in distance
+            leftEnd = np.asarray(leftEnd, dtype=np.int64)
+            rightEnd = np.asarray(rightEnd, dtype=np.int64)
+            if self.__maskHitArrows:
+                self.addStaticSegment(leftEnd, rightEnd)
+            return sqrt((rightEnd[0]-diff.shape[0]//2)**2+(rightEnd[1]-diff.shape[1]//2)**2)/(max(self.__newEllipse[1])/2)
+        return None
\ No newline at end of file
@@ -0,0 +1,168 @@
+import cv2
+import json
+import argparse
+from time import perf_counter
+from typing import Tuple, List
+from concurrent.futures import ProcessPoolExecutor
+
+from game import TargetType, scoreDistance
+from ArcheryTargetModel import ArcheryTargetModel
+from frameHistory import FrameHistory
+from targetDetection import targetDetection
+
+# headless re-scoring of recorded sessions, every video is split into chunks of frames
+# scored in a process pool, chunk layout depends only on chunk size so output does not depend on worker count
+
+
+def readFrame(videoPath: str, frameIdx: int):
+    cap = cv2.VideoCapture(videoPath)
+    cap.set(cv2.CAP_PROP_POS_FRAMES, frameIdx)
+    ret, frame = cap.read()
+    cap.release()
+    return frame if ret else None
+
+
+def getVideoInfo(videoPath: str) -> Tuple[int, float]:
+    cap = cv2.VideoCapture(videoPath)
+    if not cap.isOpened():
+        raise IOError("Cannot open video file "+videoPath)
+    frameCount = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+    fps = cap.get(cv2.CAP_PROP_FPS) or 30.0
+    cap.release()
+    return frameCount, fps
+
+
+def getChunks(frameCount: int, chunkSize: int) -> List[Tuple[int, int]]:
+    return [(start, min(start+chunkSize, frameCount)) for start in range(0, frameCount, chunkSize)]
+
+
+def detectEllipse(videoPath: str, targetType: TargetType, calibrationFrame: int = 0):
+    frame = readFrame(videoPath, calibrationFrame)
+    if frame is None:
+        return None
+    return targetDetection(cv2.cvtColor(frame, cv2.COLOR_BGR2RGB), targetType, pyramid=True)
+
+
+def scoreChunk(job: dict) -> dict:
+    # frames before chunk start only warm up frame window, hits are reported for [start, end)
+    start, end, stride, frameWindow = job['start'], job['end'], job['stride'], job['frameWindow']
+    targetType = TargetType[job['targetType']]
+
+    # transformation can't be prepared without calibration frame (seek past the end, unreadable frame)
+    calibration = readFrame(job['video'], job['calibrationFrame'])
+    if calibration is None:
+        return {'start': start, 'end': end, 'processed': 0, 'hits': [],
+                'error': 'calibration frame '+str(job['calibrationFrame'])+' can\'t be read'}
+
+    model = ArcheryTargetModel(targetType)
+    model.setEllipse(job['ellipse'])
+    model.prepareTransformation(calibration)
+    history = FrameHistory(frameWindow)
+
+    # first sampled frame which fills the window before chunk start, sampling is aligned to absolute frame index
+    firstSampled = ((start+stride-1)//stride)*stride
+    warmup = max(firstSampled-(frameWindow-1)*stride, 0)
+
+    cap = cv2.VideoCapture(job['video'])
+    cap.set(cv2.CAP_PROP_POS_FRAMES, warmup)
+
+    hits = []
+    processed = 0
+    for frameIdx in range(warmup, end):
+        if frameIdx % stride != 0:
+            if not cap.grab():
+                break
+            continue
+        ret, frame = cap.read()
+        if not ret:
+            break
+
+        history.push(model.getTransformedImage(frame))
+        if frameIdx < start:
+            continue
+        processed += 1
+
+        dist = model.getHitInHistory(history)
+        if dist is not None:
+            hits.append({'frame': frameIdx, 'time': frameIdx/job['fps'], 'distance': float(dist),
+                         'score': int(scoreDistance(targetType, dist))})
+    cap.release()
+
+    return {'start': start, 'end': end, 'processed': processed, 'hits': hits}
+
+
+def scoreVideo(videoPath: str, targetType: TargetType, ellipse=None, workers: int = 4, chunkSize: int = 600,\
+               stride: int = 1, frameWindow: int = 3, calibrationFrame: int = 0) -> dict:
+    timeStart = perf_counter()
+    frameCount, fps = getVideoInfo(videoPath)
+
+    if ellipse is None:
+        ellipse = detectEllipse(videoPath, targetType, calibrationFrame)
+        if ellipse is None:
+            return {'video': videoPath, 'error': 'target not found'}
+
+    jobs = [{'video': videoPath, 'start': start, 'end': end, 'stride': stride, 'frameWindow': frameWindow,
+             'targetType': targetType.name, 'ellipse': ellipse, 'calibrationFrame': calibrationFrame, 'fps': fps}
+            for start, end in getChunks(frameCount, chunkSize)]
+
+    if workers > 1:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            results = list(executor.map(scoreChunk, jobs))
+    else:
+        results = [scoreChunk(job) for job in jobs]
+
+    elapsed = perf_counter()-timeStart
+    errors = [result['error'] for result in results if 'error' in result]
+    if errors and len(errors) == len(results):
+        return {'video': videoPath, 'error': errors[0]}
+    processed = sum(result['processed'] for result in results)
+    hits = [hit for result in results for hit in result['hits']]
+
+    (xc, yc), (axmajor, axminor), angle = ellipse
+    return {'video': videoPath,
+            'targetType': targetType.name,
+            'ellipse': [[float(xc), float(yc)], [float(axmajor), float(axminor)], float(angle)],
+            'frames': frameCount,
+            'videoFps': fps,
+            'processedFrames': processed,
+            'seconds': elapsed,
+            'throughputFps': processed/elapsed if elapsed > 0 else 0.0,
+            'hits': hits,
+            'errors': errors}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Headless scoring of recorded sessions')
+    parser.add_argument('videos', nargs='+', help='video files to score')
+    parser.add_argument('--target', default=TargetType.REGULAR_1_10.name, choices=[t.name for t in TargetType])
+    parser.add_argument('--ellipse', nargs=5, type=float, metavar=('X', 'Y', 'AXIS1', 'AXIS2', 'ANGLE'),
+                        help='calibration ellipse, detected on calibration frame when omitted')
+    parser.add_argument('--calibration-frame', type=int, default=0)
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--chunk-size', type=int, default=600)
+    parser.add_argument('--stride', type=int, default=1, help='score every stride-th frame')
+    parser.add_argument('--window', type=int, default=3, help='frame window of hit detection')
+    parser.add_argument('--output', help='JSON file with timeline, printed when omitted')
+    args = parser.parse_args()
+
+    ellipse = None
+    if args.ellipse is not None:
+        x, y, ax1, ax2, angle = args.ellipse
+        ellipse = ((x, y), (ax1, ax2), angle)
+
+    report = [scoreVideo(video, TargetType[args.target], ellipse, args.workers, args.chunk_size, args.stride,
+                         args.window, args.calibration_frame) for video in args.videos]
+
+    if args.output is not None:
+        with open(args.output, 'w') as file:
+            json.dump(report, file, indent=2)
+    else:
+        for video in report:
+            if 'error' in video:
+                print(video['video']+': '+video['error'])
+                continue
+            print(f"{video['video']}: {video['processedFrames']} frames in {video['seconds']:.1f} s ({video['throughputFps']:.1f} fps)")
+            for error in video['errors']:
+                print('  '+error)
+            for hit in video['hits']:
+                print(f"  frame {hit['frame']:>7}  {hit['time']:>8.2f} s  score {hit['score']:>2}  distance {hit['distance']:.3f}")
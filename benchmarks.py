@@ -0,0 +1,202 @@
+import cv2
+import numpy as np
+import argparse
+import json
+import os
+import platform
+import subprocess
+from time import perf_counter, strftime
+from typing import Tuple, Callable
+
+from game import TargetType
+from targetDetection import targetDetection, getDetectionMatrix
+from imageProcessing import getRed, getBlue, getContours, getEllipsesOfContours, getTransformationParameters,\
+    getBoundriesAndMask, getCircularMask, reduceImageOfEllipseAndGetNewCenter, reduceImageAndRemoveBackground, detectHit
+from hitPlacement import getHitDetectionMask, getBinDiffThreshold, getBinDiff, getMotionRoi, getLines, getCoordinates
+from hiDetectionDataPrepFunctions import prepareDataSet
+from ArcheryTargetModel import ArcheryTargetModel
+
+# target photos live next to this module, so benchmarks run from any working directory
+ImagesPath = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'images')
+TargetPhotosPaths = {TargetType.REGULAR_1_10: os.path.join(ImagesPath, 'REGULAR_1_10.png'),
+                     TargetType.REGULAR_5_10: os.path.join(ImagesPath, 'REGULAR_5_10.png'),
+                     TargetType.REGULAR_6_10: os.path.join(ImagesPath, 'REGULAR_6_10.png')}
+
+Resolutions = {'720p': (1280, 720), '1080p': (1920, 1080), '4K': (3840, 2160)}
+
+Stages = ['getRed/getBlue', 'getContours', 'getEllipsesOfContours', 'getDetectionMatrix', 'targetDetection',
+          'getTransformationParameters', 'getBoundriesAndMask', 'ArcheryTargetModel.getTransformedImage', 'detectHit',
+          'getHitDetectionMask', 'getMotionRoi', 'getLines', 'getCoordinates', 'ArcheryTargetModel.getHit']
+
+
+def getTestFrame(targetType: TargetType, resolution: Tuple[int, int]) -> np.ndarray:
+    # target face placed slightly tilted on a grey background, returned in RGB like detection input
+    width, height = resolution
+    face = cv2.imread(TargetPhotosPaths[targetType], cv2.IMREAD_UNCHANGED)
+    size = int(0.3*height)
+    face = cv2.resize(face, (size, size), interpolation=cv2.INTER_CUBIC)
+
+    frame = np.full((height, width, 3), 120, dtype=np.uint8)
+    x0, y0 = (width-size)//2, (height-size)//2
+    src = np.float32([[0, 0], [size, 0], [size, size], [0, size]])
+    dst = np.float32([[x0+0.05*size, y0], [x0+0.95*size, y0+0.03*size], [x0+size, y0+size], [x0, y0+0.97*size]])
+    warped = cv2.warpPerspective(face, cv2.getPerspectiveTransform(src, dst), (width, height))
+
+    alpha = warped[:, :, 3:4].astype(np.float32)/255
+    frame = (alpha*warped[:, :, :3] + (1-alpha)*frame).astype(np.uint8)
+    return cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+
+
+def getArrowFrames(frame: np.ndarray, ell: Tuple[Tuple[float, float], Tuple[float, float], float]):
+    # three camera (BGR) frames, an arrow shaft appears in the last one
+    (x, y), (axmajor, _), _ = ell
+    still = cv2.cvtColor(frame, cv2.COLOR_RGB2BGR)
+    hit = still.copy()
+    tip = (int(x+0.15*axmajor), int(y+0.1*axmajor))
+    tail = (int(x+0.45*axmajor), int(y-0.35*axmajor))
+    cv2.line(hit, tip, tail, (30, 30, 30), max(int(axmajor/100), 2))
+    return still, still.copy(), hit
+
+
+def timeCall(function: Callable, repeat: int) -> dict:
+    # wall times of repeated calls in miliseconds
+    times = []
+    for _ in range(repeat):
+        start = perf_counter()
+        function()
+        times.append(1000*(perf_counter()-start))
+    return {'medianMs': float(np.median(times)), 'minMs': float(np.min(times)), 'repeat': repeat}
+
+
+def getStageCalls(targetType: TargetType, resolution: Tuple[int, int]) -> dict:
+    # every stage gets inputs produced by the stages before it on the same test frame
+    frame = getTestFrame(targetType, resolution)
+    red, blue = getRed(frame), getBlue(frame)
+    redContours, blueContours = getContours(red, blue)
+    redEllipses, blueEllipses = getEllipsesOfContours(frame, redContours, blueContours)
+    ell = targetDetection(frame, targetType)
+
+    imReduced, newEll = reduceImageOfEllipseAndGetNewCenter(frame, ell)
+    imTrans, _, _, center = getTransformationParameters(imReduced, newEll)
+    bnds, mask = getBoundriesAndMask(imTrans, center, newEll[1][1])
+    imTransReduced = reduceImageAndRemoveBackground(imTrans, bnds, mask)
+
+    # found arrows are not added to hit mask, every repeat of getHit times the same path
+    model = ArcheryTargetModel(targetType, maskHitArrows=False)
+    model.detectTarget(frame)
+    ppframe, pframe, hitframe = getArrowFrames(frame, ell)
+    transformed = [model.getTransformedImage(im).copy() for im in (ppframe, pframe, hitframe)]
+    knn = prepareDataSet()
+
+    diff = cv2.absdiff(cv2.cvtColor(transformed[2], cv2.COLOR_RGB2GRAY), cv2.cvtColor(transformed[1], cv2.COLOR_RGB2GRAY))
+    hitMask = getHitDetectionMask(transformed[0], newEll)
+    diffBinary = getBinDiff(diff, hitMask)
+    lines = getLines(diffBinary, newEll)
+
+    def boundriesAndMask():
+        getCircularMask.cache_clear()
+        getBoundriesAndMask(imTrans, center, newEll[1][1])
+
+    return {'getRed/getBlue': lambda: (getRed(frame), getBlue(frame)),
+            'getContours': lambda: getContours(red, blue),
+            'getEllipsesOfContours': lambda: getEllipsesOfContours(frame, redContours, blueContours),
+            'getDetectionMatrix': lambda: getDetectionMatrix(redEllipses, blueEllipses, targetType),
+            'targetDetection': lambda: targetDetection(frame, targetType),
+            'getTransformationParameters': lambda: getTransformationParameters(imReduced, newEll),
+            'getBoundriesAndMask': boundriesAndMask,
+            'ArcheryTargetModel.getTransformedImage': lambda: model.getTransformedImage(hitframe),
+            'detectHit': lambda: detectHit(*transformed, knn),
+            'getHitDetectionMask': lambda: getHitDetectionMask(imTransReduced, newEll),
+            'getMotionRoi': lambda: getMotionRoi(diff, diffBinary, getBinDiffThreshold(diff)),
+            'getLines': lambda: getLines(diffBinary, newEll),
+            'getCoordinates': lambda: getCoordinates(diffBinary, newEll, lines),
+            'ArcheryTargetModel.getHit': lambda: model.getHit(*transformed)}
+
+
+def getRunInfo() -> dict:
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True).stdout.strip()
+    except OSError:
+        commit = ''
+    return {'commit': commit, 'date': strftime('%Y-%m-%d %H:%M:%S'), 'python': platform.python_version(),
+            'numpy': np.__version__, 'opencv': cv2.__version__, 'machine': platform.machine()}
+
+
+def runBenchmarks(resolutions: dict = Resolutions, stages: list = Stages, repeat: int = 5) -> dict:
+    results = {}
+    for targetType in TargetType:
+        for name, resolution in resolutions.items():
+            calls = getStageCalls(targetType, resolution)
+            for stage in stages:
+                calls[stage]()
+                results['|'.join([stage, targetType.name, name])] = timeCall(calls[stage], repeat)
+    return {'info': getRunInfo(), 'results': results}
+
+
+def compareBenchmarks(base: dict, new: dict, threshold: float = 0.1) -> list:
+    # stages which got slower by more than threshold (relative median time)
+    rows = []
+    for key, newResult in new['results'].items():
+        if key not in base['results']:
+            continue
+        baseMs, newMs = base['results'][key]['medianMs'], newResult['medianMs']
+        change = (newMs-baseMs)/baseMs if baseMs > 0 else 0.0
+        rows.append({'key': key, 'baseMs': baseMs, 'newMs': newMs, 'change': change, 'regression': change > threshold})
+    return rows
+
+
+def benchmarkPyramid(resolutions: dict = Resolutions, repeat: int = 3):
+    results = []
+    for targetType in TargetType:
+        for name, resolution in resolutions.items():
+            frame = getTestFrame(targetType, resolution)
+            fullTime = timeCall(lambda: targetDetection(frame, targetType), repeat)['medianMs']
+            pyramidTime = timeCall(lambda: targetDetection(frame, targetType, pyramid=True), repeat)['medianMs']
+            results.append({'targetType': targetType.name, 'resolution': name, 'fullMs': fullTime,
+                            'pyramidMs': pyramidTime, 'speedup': fullTime/pyramidTime})
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmarks of vision hot paths')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    runParser = subparsers.add_parser('run', help='time every stage and save results to JSON')
+    runParser.add_argument('--output', default='benchmark.json')
+    runParser.add_argument('--repeat', type=int, default=5)
+    runParser.add_argument('--resolutions', nargs='+', default=list(Resolutions), choices=list(Resolutions))
+    runParser.add_argument('--stages', nargs='+', default=Stages, choices=Stages)
+
+    compareParser = subparsers.add_parser('compare', help='compare two result files and flag regressions')
+    compareParser.add_argument('base')
+    compareParser.add_argument('new')
+    compareParser.add_argument('--threshold', type=float, default=0.1, help='allowed relative slowdown')
+
+    pyramidParser = subparsers.add_parser('pyramid', help='full resolution against pyramid target detection')
+    pyramidParser.add_argument('--repeat', type=int, default=3)
+
+    args = parser.parse_args()
+
+    if args.command == 'run':
+        report = runBenchmarks({name: Resolutions[name] for name in args.resolutions}, args.stages, args.repeat)
+        with open(args.output, 'w') as file:
+            json.dump(report, file, indent=2)
+        for key, result in report['results'].items():
+            print(f"{key:<70}{result['medianMs']:>10.2f} ms")
+
+    if args.command == 'compare':
+        with open(args.base) as file:
+            base = json.load(file)
+        with open(args.new) as file:
+            new = json.load(file)
+        rows = compareBenchmarks(base, new, args.threshold)
+        for row in rows:
+            flag = 'REGRESSION' if row['regression'] else ''
+            print(f"{row['key']:<70}{row['baseMs']:>10.2f}{row['newMs']:>10.2f}{100*row['change']:>+9.1f}%  {flag}")
+        if any(row['regression'] for row in rows):
+            raise SystemExit(1)
+
+    if args.command == 'pyramid':
+        print(f"{'target':<14}{'resolution':<12}{'full [ms]':>12}{'pyramid [ms]':>14}{'speedup':>10}")
+        for result in benchmarkPyramid(repeat=args.repeat):
+            print(f"{result['targetType']:<14}{result['resolution']:<12}{result['fullMs']:>12.1f}{result['pyramidMs']:>14.1f}{result['speedup']:>10.2f}")
@@ -1,8 +1,13 @@
 import cv2
 import numpy as np
-from typing import Tuple
+import os
+import threading
+from time import monotonic, sleep
+from typing import Tuple, List
 from enum import Enum
 
+from metrics import timed, defaultRegistry
+
 class ConnectionStatus(Enum):
     OK = 0
     ERROR = 1
@@ -16,4 +21,181 @@ def captureVideo(cap: cv2.VideoCapture) -> Tuple[np.ndarray, ConnectionStatus]:
     if not ret:
         return (np.array([[0]]), ConnectionStatus.ERROR)
 
-    return (frame, ConnectionStatus.OK)
\ No newline at end of file
+    return (frame, ConnectionStatus.OK)
+
+
+class FileFrameSource():
+    # video file or directory of frame images standing in for a camera, read() is paced to fps like a live stream
+    # (native fps of the video when None, no pacing when 0), can be passed to CameraReader in place of cv2.VideoCapture
+
+    def __init__(self, path: str, fps: float = None, loop: bool = False):
+        self.__files = None
+        self.__cap = None
+        self.__idx = 0
+        self.__loop = loop
+
+        if os.path.isdir(path):
+            self.__files = [os.path.join(path, name) for name in sorted(os.listdir(path))
+                            if name.lower().endswith(('.png', '.jpg', '.jpeg', '.bmp'))]
+            nativeFps = 30.0
+        else:
+            self.__cap = cv2.VideoCapture(path)
+            if not self.__cap.isOpened():
+                raise IOError("Cannot open video file "+path)
+            nativeFps = self.__cap.get(cv2.CAP_PROP_FPS) or 30.0
+
+        fps = nativeFps if fps is None else fps
+        self.__interval = 1/fps if fps > 0 else 0
+        self.__nextTime = None
+
+    def read(self) -> Tuple[bool, np.ndarray]:
+        if self.__interval > 0:
+            now = monotonic()
+            if self.__nextTime is not None and now < self.__nextTime:
+                sleep(self.__nextTime-now)
+            self.__nextTime = max(now, self.__nextTime or now)+self.__interval
+
+        ret, frame = self.__readFrame()
+        if not ret and self.__loop:
+            self.__rewind()
+            ret, frame = self.__readFrame()
+        return ret, frame
+
+    def __readFrame(self) -> Tuple[bool, np.ndarray]:
+        if self.__cap is not None:
+            return self.__cap.read()
+        if self.__idx >= len(self.__files):
+            return False, None
+        frame = cv2.imread(self.__files[self.__idx])
+        self.__idx += 1
+        return frame is not None, frame
+
+    def __rewind(self):
+        self.__idx = 0
+        if self.__cap is not None:
+            self.__cap.set(cv2.CAP_PROP_POS_FRAMES, 0)
+
+    def isOpened(self) -> bool:
+        return self.__cap.isOpened() if self.__cap is not None else len(self.__files) > 0
+
+    def release(self):
+        if self.__cap is not None:
+            self.__cap.release()
+
+
+class CameraReader():
+    # reads frames on its own thread so slow vision steps never stall decoding,
+    # only the newest frames are kept in a preallocated ring buffer
+
+    def __init__(self, cap: cv2.VideoCapture, bufferSize: int = 4):
+        self.__cap = cap
+        self.__bufferSize = max(bufferSize, 1)
+
+        # ring buffer is allocated when the first frame reveals the stream shape,
+        # slots are valid only for frames captured since the last allocation
+        self.__frames = None
+        self.__allocatedAt = 0
+        self.__timestamps = np.zeros(self.__bufferSize, dtype=np.float64)
+
+        # number of frames captured so far and number of the last frame handed to a consumer
+        self.__captured = 0
+        self.__consumed = 0
+        self.__dropped = 0
+
+        self.__status = ConnectionStatus.OK
+        self.__running = False
+        self.__thread = None
+        self.__condition = threading.Condition()
+
+    def start(self):
+        if self.__thread is None:
+            self.__running = True
+            self.__thread = threading.Thread(target=self.__readLoop, daemon=True)
+            self.__thread.start()
+        return self
+
+    def stop(self):
+        self.__running = False
+        if self.__thread is not None:
+            self.__thread.join(timeout=2)
+            self.__thread = None
+
+    def release(self):
+        self.stop()
+        self.__cap.release()
+
+    def __readLoop(self):
+        while self.__running:
+            with timed('camera_read_seconds', 'camera frame read and decode'):
+                frame, status = captureVideo(self.__cap)
+            timestamp = monotonic()
+
+            with self.__condition:
+                if status == ConnectionStatus.ERROR:
+                    self.__status = ConnectionStatus.ERROR
+                    self.__running = False
+                    self.__condition.notify_all()
+                    break
+
+                if self.__frames is None or self.__frames.shape[1:] != frame.shape:
+                    self.__frames = np.empty((self.__bufferSize,)+frame.shape, dtype=frame.dtype)
+                    self.__allocatedAt = self.__captured
+
+                slot = self.__captured % self.__bufferSize
+                np.copyto(self.__frames[slot], frame)
+                self.__timestamps[slot] = timestamp
+                self.__captured += 1
+
+                self.__condition.notify_all()
+            defaultRegistry.inc('camera_frames_total', help='frames captured from camera')
+
+    def waitForNewFrame(self, timeout: float = 5.0) -> bool:
+        # blocks until a frame newer than the last consumed one arrived or the stream failed
+        with self.__condition:
+            self.__condition.wait_for(lambda: self.__captured > self.__consumed or self.__status == ConnectionStatus.ERROR, timeout)
+            return self.__captured > self.__consumed
+
+    def hasNewFrame(self) -> bool:
+        return self.__captured > self.__consumed
+
+    def getFrameNumber(self) -> int:
+        # number of the newest frame, frames are numbered from 1
+        return self.__captured
+
+    def getLatestFrame(self) -> Tuple[np.ndarray, ConnectionStatus]:
+        # non-blocking, returns copy of the newest frame (same contract as captureVideo)
+        frame, _, status = self.getLatestFrameWithTimestamp()
+        return frame, status
+
+    def getLatestFrameWithTimestamp(self) -> Tuple[np.ndarray, float, ConnectionStatus]:
+        with self.__condition:
+            if self.__captured == 0:
+                return (np.array([[0]]), 0.0, ConnectionStatus.ERROR)
+
+            slot = (self.__captured-1) % self.__bufferSize
+
+            # every frame captured after the last consumed one, except the newest, was never used
+            if self.__captured > self.__consumed:
+                dropped = max(self.__captured - self.__consumed - 1, 0)
+                self.__dropped += dropped
+                self.__consumed = self.__captured
+                defaultRegistry.inc('camera_frames_dropped_total', dropped, 'frames overwritten before processing')
+
+            return (self.__frames[slot].copy(), self.__timestamps[slot], self.__status)
+
+    def getRecentFrames(self, count: int) -> List[Tuple[np.ndarray, float]]:
+        # up to count newest frames with their capture timestamps, oldest first
+        with self.__condition:
+            count = min(count, self.__bufferSize, self.__captured-self.__allocatedAt)
+            frames = []
+            for k in range(self.__captured-count, self.__captured):
+                slot = k % self.__bufferSize
+                frames.append((self.__frames[slot].copy(), self.__timestamps[slot]))
+            return frames
+
+    def getStatus(self) -> ConnectionStatus:
+        return self.__status
+
+    def getStats(self):
+        with self.__condition:
+            return {'captured': self.__captured, 'consumed': self.__consumed, 'dropped': self.__dropped}
\ No newline at end of file
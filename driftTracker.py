@@ -0,0 +1,74 @@
+import cv2
+import numpy as np
+from enum import Enum
+from typing import Tuple
+
+from imageProcessing import getEllipseCropBounds
+
+
+class DriftStatus(Enum):
+    STABLE = 0
+    CORRECTED = 1
+    REDETECTED = 2
+    LOST = 3
+
+
+class DriftTracker():
+    # estimates translation of target region against the reference frame with phase correlation
+    # on downsampled grayscale, shift is measured against reference (not accumulated frame to frame)
+
+    def __init__(self, frame: np.ndarray, ell: Tuple[Tuple[float, float], Tuple[float, float], float], interval: int = 10,\
+                 size: int = 256, minCorrection: float = 0.5, maxDrift: float = 0.1, minResponse: float = 0.1):
+        self.__interval = interval
+        self.__minCorrection = minCorrection
+        self.__minResponse = minResponse
+        # largest shift corrected without new detection [px]
+        self.__maxShift = maxDrift*max(ell[1])
+
+        self.__bounds = getEllipseCropBounds(frame.shape, ell)
+        ytop, ybottom, xleft, xright = self.__bounds
+        self.__scale = size/max(ybottom-ytop, xright-xleft)
+        self.__size = (max(int((xright-xleft)*self.__scale+0.5), 1), max(int((ybottom-ytop)*self.__scale+0.5), 1))
+        self.__window = cv2.createHanningWindow(self.__size, cv2.CV_32F)
+        self.__reference = self.__getPatch(frame)
+
+        self.__calls = 0
+        self.__shift = np.zeros(2)
+        self.__applied = np.zeros(2)
+        self.__response = 1.0
+
+    def __getPatch(self, frame: np.ndarray) -> np.ndarray:
+        ytop, ybottom, xleft, xright = self.__bounds
+        # linear downsampling keeps ring edges sharp enough for subpixel correlation and is several times cheaper than area
+        patch = cv2.resize(frame[ytop:ybottom, xleft:xright], self.__size, interpolation=cv2.INTER_LINEAR)
+        if patch.ndim == 3:
+            patch = cv2.cvtColor(patch, cv2.COLOR_BGR2GRAY)
+        return patch.astype(np.float32)
+
+    def estimate(self, frame: np.ndarray) -> Tuple[np.ndarray, float]:
+        # (dx, dy) shift of frame content against reference [px] and correlation response
+        # some OpenCV builds overwrite inputs of phaseCorrelate, so reference is passed as copy
+        (dx, dy), response = cv2.phaseCorrelate(self.__reference.copy(), self.__getPatch(frame), self.__window)
+        return np.array([dx, dy])/self.__scale, response
+
+    def update(self, frame: np.ndarray) -> Tuple[DriftStatus, np.ndarray]:
+        # every interval-th call estimates drift, CORRECTED means shift changed since last applied one,
+        # LOST means drift too large (or unreliable) for correction
+        self.__calls += 1
+        if self.__calls % self.__interval:
+            return DriftStatus.STABLE, self.__applied
+
+        self.__shift, self.__response = self.estimate(frame)
+        if self.__response < self.__minResponse or np.hypot(*self.__shift) > self.__maxShift:
+            return DriftStatus.LOST, self.__shift
+        if np.hypot(*(self.__shift-self.__applied)) < self.__minCorrection:
+            return DriftStatus.STABLE, self.__applied
+
+        self.__applied = self.__shift
+        return DriftStatus.CORRECTED, self.__applied
+
+    def getShift(self) -> np.ndarray:
+        return self.__applied
+
+    def getResponse(self) -> float:
+        return self.__response
@@ -0,0 +1,85 @@
+import cv2
+import numpy as np
+from typing import Tuple
+
+
+class FrameHistory():
+    # grayscale of the last frames kept in a preallocated ring, features of every frame pair
+    # (abs diff, its std, max and histogram) are computed lazily once and shared by all stages
+    # frames are adressed by age: 0 is the newest frame, 1 the previous one and so on
+
+    def __init__(self, length: int = 3):
+        self.__length = max(length, 2)
+        self.__grays = None
+        self.__pushed = 0
+        self.__pairCache = {}
+
+    def push(self, frame: np.ndarray):
+        shape = frame.shape[:2]
+        if self.__grays is None or self.__grays.shape[1:] != shape:
+            self.__grays = np.empty((self.__length,)+shape, dtype=np.uint8)
+            self.clear()
+
+        slot = self.__grays[self.__pushed % self.__length]
+        if frame.ndim == 3:
+            cv2.cvtColor(frame, cv2.COLOR_RGB2GRAY, dst=slot)
+        else:
+            np.copyto(slot, frame)
+        self.__pushed += 1
+
+        # features of pairs with frame which left the window are forgotten
+        oldest = self.__pushed - self.__length
+        self.__pairCache = {ids: features for ids, features in self.__pairCache.items() if ids[1] >= oldest}
+
+    def clear(self):
+        self.__pushed = 0
+        self.__pairCache = {}
+
+    def getLength(self) -> int:
+        return self.__length
+
+    def getCount(self) -> int:
+        return min(self.__pushed, self.__length)
+
+    def isFull(self) -> bool:
+        return self.__pushed >= self.__length
+
+    def getFrameId(self, age: int = 0) -> int:
+        # number of the frame since history was cleared, changes every push
+        if not 0 <= age < self.getCount():
+            raise IndexError('frame of age '+str(age)+' is not in history')
+        return self.__pushed-1-age
+
+    def getGray(self, age: int = 0) -> np.ndarray:
+        return self.__grays[self.getFrameId(age) % self.__length]
+
+    def __getPair(self, newerAge: int, olderAge: int) -> dict:
+        ids = (self.getFrameId(newerAge), self.getFrameId(olderAge))
+        if ids not in self.__pairCache:
+            self.__pairCache[ids] = {'diff': cv2.absdiff(self.getGray(newerAge), self.getGray(olderAge))}
+        return self.__pairCache[ids]
+
+    def getDiff(self, newerAge: int = 0, olderAge: int = 1) -> np.ndarray:
+        return self.__getPair(newerAge, olderAge)['diff']
+
+    def getDiffStd(self, newerAge: int = 0, olderAge: int = 1) -> float:
+        pair = self.__getPair(newerAge, olderAge)
+        if 'std' not in pair:
+            pair['std'] = float(cv2.meanStdDev(pair['diff'])[1][0, 0])
+        return pair['std']
+
+    def getDiffMax(self, newerAge: int = 0, olderAge: int = 1) -> int:
+        pair = self.__getPair(newerAge, olderAge)
+        if 'max' not in pair:
+            pair['max'] = int(pair['diff'].max())
+        return pair['max']
+
+    def getDiffHistogram(self, newerAge: int = 0, olderAge: int = 1) -> np.ndarray:
+        pair = self.__getPair(newerAge, olderAge)
+        if 'hist' not in pair:
+            pair['hist'] = np.bincount(pair['diff'].ravel(), minlength=256)
+        return pair['hist']
+
+    def getDiffFeatures(self, newerAge: int = 0, olderAge: int = 1) -> Tuple[float, int]:
+        # features used by hit detection classifier
+        return self.getDiffStd(newerAge, olderAge), self.getDiffMax(newerAge, olderAge)
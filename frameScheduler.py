@@ -0,0 +1,65 @@
+from PyQt5 import QtCore
+from typing import Callable
+
+from metrics import timed
+
+
+class FrameScheduler(QtCore.QObject):
+    # every task runs on its own QTimer, so each pipeline stage keeps its own cadence
+    # and the Qt event loop stays free between ticks
+
+    def __init__(self, parent: QtCore.QObject = None):
+        super().__init__(parent)
+        self.__timers = {}
+        self.__rates = {}
+        self.__running = False
+
+    def addTask(self, name: str, callback: Callable, rate: float):
+        # rate is given in calls per second, task with rate <= 0 is paused
+        timer = QtCore.QTimer(self)
+        timer.setTimerType(QtCore.Qt.PreciseTimer)
+        metricName = 'tick_'+name+'_seconds'
+
+        def tick():
+            with timed(metricName, name+' task tick'):
+                callback()
+        timer.timeout.connect(tick)
+        self.__timers[name] = timer
+        self.setRate(name, rate)
+
+    def removeTask(self, name: str):
+        self.__rates.pop(name, None)
+        timer = self.__timers.pop(name, None)
+        if timer is not None:
+            timer.stop()
+            timer.deleteLater()
+
+    def setRate(self, name: str, rate: float):
+        # 0 ms timer would fire on every pass of the event loop, so rate <= 0 stops the timer instead
+        if name not in self.__timers:
+            return
+        timer = self.__timers[name]
+        self.__rates[name] = rate
+        if rate > 0:
+            timer.setInterval(max(int(1000/rate+0.5), 1))
+            if self.__running and not timer.isActive():
+                timer.start()
+        else:
+            timer.stop()
+
+    def getRate(self, name: str) -> float:
+        return max(self.__rates[name], 0)
+
+    def start(self):
+        self.__running = True
+        for name, timer in self.__timers.items():
+            if self.__rates[name] > 0:
+                timer.start()
+
+    def stop(self):
+        self.__running = False
+        for timer in self.__timers.values():
+            timer.stop()
+
+    def isRunning(self) -> bool:
+        return self.__running
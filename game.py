@@ -24,6 +24,54 @@ class GameState(Enum):
     ROUND = 2
     GAME_OVER = 3
 
+def scoreDistance(targetType: TargetType, dist: float) -> int:
+    # score of a hit lying dist (relative to target radius) from the centre
+    try:
+        if targetType == TargetType.REGULAR_1_10:
+            dst = 10*(1-dist)
+            score = ceil(dst)
+            finalScore = score
+            if -0.0066 < dst-score < 0 and score != 10:
+                if score > -1:
+                    finalScore += 1
+                else:
+                    finalScore = 0
+            else:
+                if score < 0:
+                    finalScore = 0
+
+        if targetType == TargetType.REGULAR_5_10:
+            dst = 6*(1-dist)
+            score = ceil(dst)
+            finalScore = score
+            if -0.0111 < dst-score < 0 and score != 6:
+                if score > -1:
+                    finalScore += 5
+                else:
+                    finalScore = 0
+            else:
+                if score > 0:
+                    finalScore += 4
+                else:
+                    finalScore = 0 
+        if targetType == TargetType.REGULAR_6_10:
+            dst = 5*(1-dist)
+            score = ceil(dst)
+            finalScore = score
+            if -0.0133 < dst-score < 0 and score != 5:
+                if score > -1:
+                    finalScore += 6
+                else:
+                    finalScore = 0
+            else:
+                if score > 0:
+                    finalScore += 5
+                else:
+                    finalScore = 0
+    except:
+        finalScore = 0
+    return finalScore
+
 class Game():
     def __init__(self, noPlayers: int, gameType: GameType,\
                  noSets: int, noPoints: int, noArrows: int, targetType: TargetType,\
@@ -160,50 +208,7 @@ class Game():
     def scoreHit(self, dist=None):
         if dist is None:
             dist = self.__dist
-        try:
-            if self.__targetType == TargetType.REGULAR_1_10:
-                dst = 10*(1-dist)
-                score = ceil(dst)
-                finalScore = score
-                if -0.0066 < dst-score < 0 and score != 10:
-                    if score > -1:
-                        finalScore += 1
-                    else:
-                        finalScore = 0
-                else:
-                    if score < 0:
-                        finalScore = 0
-
-            if self.__targetType == TargetType.REGULAR_5_10:
-                dst = 6*(1-dist)
-                score = ceil(dst)
-                finalScore = score
-                if -0.0111 < dst-score < 0 and score != 6:
-                    if score > -1:
-                        finalScore += 5
-                    else:
-                        finalScore = 0
-                else:
-                    if score > 0:
-                        finalScore += 4
-                    else:
-                        finalScore = 0 
-            if self.__targetType == TargetType.REGULAR_6_10:
-                dst = 5*(1-dist)
-                score = ceil(dst)
-                finalScore = score
-                if -0.0133 < dst-score < 0 and score != 5:
-                    if score > -1:
-                        finalScore += 6
-                    else:
-                        finalScore = 0
-                else:
-                    if score > 0:
-                        finalScore += 5
-                    else:
-                        finalScore = 0
-        except:
-            finalScore = 0
+        finalScore = scoreDistance(self.__targetType, dist)
         self.__hitTable[self.__setToken-1,self.__playerToken-1,self.__arrowToken-1] = finalScore
         return finalScore
 
@@ -5,15 +5,22 @@ import pandas as pd
 import cv2
 import numpy as np
 
-from cameraConnection import ConnectionStatus, captureVideo
+from cameraConnection import ConnectionStatus, CameraReader
+from mjpegClient import MjpegReader
 
 from game import Game
 from game import TargetType, GameType, GameState
-from ArcheryTargetModel import ArcheryTargetModel
 from imageProcessing import getRed
+from frameScheduler import FrameScheduler
+from laneManager import Lane, LaneManager
+from metrics import defaultRegistry, drawMetricsOverlay
+from time import monotonic
 
 class Ui_MainWindow(QMainWindow):
-    def __init__(self):
+    def __init__(self, processingRate: float = 30, displayRate: float = 30, gameTickRate: float = 10, hitDetectionRate: float = 30,\
+                 frameWindow: int = 3, metrics: bool = False, metricsOverlay: bool = False, metricsPort: int = None,\
+                 metricsPath: str = None, maxWorkers: int = None, visionProcess: bool = False,\
+                 mjpegClient: bool = True):
         super().__init__()
         
         # language preference
@@ -45,19 +52,42 @@ class Ui_MainWindow(QMainWindow):
 
         # video capturing and target detecting varaibles
 
-        self.__Video = None
         self.__detect = False
         self.__manualMark = False
         self.__markedPoints = []
-        self.__backupEllipse = None
-        self.__ellipse = None
-        self.__connected = False
         self.__disconnect = False
 
-        # image processing frames
-        self.__actFrame = None
-        self.__prevFrame = None
-        self.__prevPrevFrame = None
+        # pipeline stages run on separate timers (calls per second)
+        self.__processingRate = processingRate
+        self.__displayRate = displayRate
+        self.__gameTickRate = gameTickRate
+        self.__hitDetectionRate = hitDetectionRate
+        self.__scheduler = FrameScheduler(self)
+        self.__scheduler.addTask('process', self.__processFrameTick, self.__processingRate)
+        self.__scheduler.addTask('display', self.__displayTick, self.__displayRate)
+        self.__scheduler.addTask('game', self.__gameTick, self.__gameTickRate)
+
+        # every lane has its own camera, target model, game and frame history (frameWindow frames for hit detection),
+        # vision work of all lanes runs on one bounded worker pool, GUI shows the lane picked in LaneComboBox,
+        # with visionProcess target model of every lane runs in its own process and GUI process only renders
+        self.__frameWindow = frameWindow
+        self.__visionProcess = visionProcess
+
+        # DroidCam stream is read by own MJPEG client (reconnects, decodes only processed frames) or by OpenCV
+        self.__mjpegClient = mjpegClient
+        self.__laneManager = LaneManager(maxWorkers)
+        self.__lane = None
+        self.__scoreTables = {}
+
+        # stage latency metrics, overlay is toggled with 'm' in camera view,
+        # text export is written on camera stop (metricsPath) or served on localhost (metricsPort)
+        self.__metricsOverlay = metricsOverlay
+        self.__metricsPath = metricsPath
+        self.__lastDisplayTime = None
+        if metrics or metricsOverlay or metricsPort is not None or metricsPath is not None:
+            defaultRegistry.enable()
+        if metricsPort is not None:
+            defaultRegistry.serve(metricsPort)
 
         # menu widnow index
 
@@ -78,12 +108,8 @@ class Ui_MainWindow(QMainWindow):
         self.__noSets = None
         self.__noArrows = None
 
-        # game and target controllers
-        self.__game = None
-        self.__model = None
+        # score table of the picked lane
         self.ScoreTable = None
-        self.__proceed = False
-        self.__gameState = GameState.BREAK
 
         self.__BackLayout = QVBoxLayout()
 
@@ -127,6 +153,22 @@ class Ui_MainWindow(QMainWindow):
         
         self.LanguageComboBox.currentIndexChanged.connect(self.__changeLanguage)
 
+        # 1.2 lane picker, shown from the third window on
+
+        self.LaneComboBox = QtWidgets.QComboBox(self.centralwidget)
+        self.LaneComboBox.setGeometry(QtCore.QRect(100, 10, 120, 30))
+        self.LaneComboBox.setFont(self.__font10)
+        self.LaneComboBox.setObjectName("LaneComboBox")
+        self.LaneComboBox.currentIndexChanged.connect(self.__changeLane)
+        self.LaneComboBox.hide()
+
+        self.AddLanePushButton = QtWidgets.QPushButton(self.centralwidget)
+        self.AddLanePushButton.setGeometry(QtCore.QRect(230, 10, 120, 30))
+        self.AddLanePushButton.setFont(self.__font10)
+        self.AddLanePushButton.setObjectName("AddLanePushButton")
+        self.AddLanePushButton.clicked.connect(self.__addLane)
+        self.AddLanePushButton.hide()
+
         # Next and Back push buttons
 
         self.NextPushButton = QtWidgets.QPushButton(self.centralwidget)
@@ -360,7 +402,7 @@ class Ui_MainWindow(QMainWindow):
         self.NextSetPushButton.setGeometry(QtCore.QRect(640, 420, 150, 60))
         self.NextSetPushButton.setFont(self.__font15)
         self.NextSetPushButton.setObjectName("NextPushButton")
-        self.NextSetPushButton.clicked.connect(self.__proceedGame)
+        self.NextSetPushButton.clicked.connect(self.__nextSet)
         self.NextSetPushButton.hide()
 
         # 5.2 pixmap
@@ -427,61 +469,76 @@ class Ui_MainWindow(QMainWindow):
         self.ManualMarkPushButton.setText(_translate("MainWindow", self.__language_box[self.__language][19]))
         self.ResetTargetPushButton.setText(_translate("MainWindow", self.__language_box[self.__language][26]))
         self.NextSetPushButton.setText(_translate("MainWindow", self.__language_box[self.__language][29]))
+        self.AddLanePushButton.setText(_translate("MainWindow", self.__language_box[self.__language][45]))
+        for i, lane in enumerate(self.__laneManager.getLanes()):
+            self.LaneComboBox.setItemText(i, _translate("MainWindow", self.__getLaneText(i)))
         self.TimeDisplaySquare.setText(_translate("MainWindow",""))
         self.TimeDisplayText.setText(_translate("MainWindow",""))
         self.WinnerDisplayText.setText(_translate("MainWindow", ""))
 
-    def __proceedGame(self):
-        prevState = self.__gameState
-        self.__gameState = self.__game.proceedGame()
-        if prevState != self.__gameState:
-            if prevState == GameState.BREAK and self.__gameState == GameState.READY_GO:
-                self.__proceed = True
-                self.NextSetPushButton.hide()
-                self.TimeDisplaySquare.setPixmap(QtGui.QPixmap('images/yellow_background.jpg'))
-            if prevState == GameState.READY_GO and self.__gameState == GameState.ROUND:
-                self.TimeDisplaySquare.setPixmap(QtGui.QPixmap('images/green_background.jpg'))
-            if prevState == GameState.ROUND and self.__gameState == GameState.READY_GO:
-                s,p,a = self.__game.getTokens()
-                self.ScoreTable.setItem(s, (p-1)*(self.__noArrows+1)+a, QTableWidgetItem(str(self.__game.getHitTable()[s-1,p-1,a-1])))
-                self.ScoreTable.setItem(s, p*(self.__noArrows+1), QTableWidgetItem(str(self.__game.getSumTable()[s-1,p-1])))
-                self.TimeDisplaySquare.setPixmap(QtGui.QPixmap('images/yellow_background.jpg'))
-            if prevState == GameState.ROUND and self.__gameState == GameState.BREAK:
-                s,p,a = self.__game.getTokens()
-                self.ScoreTable.setItem(s, (p-1)*(self.__noArrows+1)+a, QTableWidgetItem(str(self.__game.getHitTable()[s-1,p-1,a-1])))
-                self.ScoreTable.setItem(s, p*(self.__noArrows+1), QTableWidgetItem(str(self.__game.getSumTable()[s-1,p-1])))
-                self.__proceed = False
-                self.TimeDisplaySquare.setPixmap(QtGui.QPixmap('images/red_background.jpg'))
-                score = self.__game.getScoreTable()
+    def __proceedGame(self, lane: Lane):
+        prevState, gameState = lane.proceedGame()
+        game = lane.getGame()
+        table = self.__scoreTables[lane]
+        picked = lane is self.__lane
+        if prevState != gameState:
+            if prevState == GameState.BREAK and gameState == GameState.READY_GO:
+                lane.setProceeding(True)
+                if picked:
+                    self.NextSetPushButton.hide()
+            if prevState == GameState.ROUND and gameState in (GameState.READY_GO, GameState.BREAK):
+                s,p,a = game.getTokens()
+                table.setItem(s, (p-1)*(self.__noArrows+1)+a, QTableWidgetItem(str(game.getHitTable()[s-1,p-1,a-1])))
+                table.setItem(s, p*(self.__noArrows+1), QTableWidgetItem(str(game.getSumTable()[s-1,p-1])))
+            if prevState == GameState.ROUND and gameState == GameState.BREAK:
+                lane.setProceeding(False)
+                score = game.getScoreTable()
                 for i, sc in enumerate(score):
-                    self.ScoreTable.setItem(0,(i+1)*(self.__noArrows+1),QTableWidgetItem(str(sc)))
-                self.NextSetPushButton.show()
-            if prevState == GameState.BREAK and self.__gameState == GameState.GAME_OVER:
-                self.__proceed = False
-                self.TimeDisplaySquare.setPixmap(QtGui.QPixmap('images/red_background.jpg'))
-                self.TimeDisplayText.setText('-')
-
-                winners = np.where(self.__game.getScoreTable() == np.max(self.__game.getScoreTable()))
-                if len(winners) == 1:
-                    self.WinnerDisplayText.setText(self.__language_box[self.__language][40]+str(winners[0]+1)+" "+self.__language_box[self.__language][41])
-                    self.WinnerDisplayText.show()
-                else:
-                    txt = self.__language_box[self.__language][42] + " " + self.__language_box[self.__language][40] + str(winners[0]+1)
-                    
-                    for win in winners[1:]:
-                        txt += " " + self.__language_box[self.__language][43] + " " + self.__language_box[self.__language][40] + str(win+1)
-
-                self.WinnerDisplayText.show()
-        if self.__gameState == GameState.ROUND:
-            dist = self.__model.getHit(self.__prevPrevFrame,\
-                                       self.__prevFrame,\
-                                        self.__actFrame)
-            if dist is not None:
-                self.__game.passHit(dist)
-
-                print("returned: "+str(dist))
-                
-        return self.__gameState
+                    table.setItem(0,(i+1)*(self.__noArrows+1),QTableWidgetItem(str(sc)))
+                if picked:
+                    self.NextSetPushButton.show()
+            if prevState == GameState.BREAK and gameState == GameState.GAME_OVER:
+                lane.setProceeding(False)
+                if picked:
+                    self.__showWinner(lane)
+            if picked:
+                self.__updateTimeDisplay(lane)
+        return gameState
+
+    def __nextSet(self):
+        if self.__lane is not None:
+            self.__proceedGame(self.__lane)
+
+    def __updateTimeDisplay(self, lane: Lane):
+        # square colour and timer follow the game state of the picked lane
+        gameState = lane.getGameState()
+        if gameState == GameState.READY_GO:
+            self.TimeDisplaySquare.setPixmap(QtGui.QPixmap('images/yellow_background.jpg'))
+        elif gameState == GameState.ROUND:
+            self.TimeDisplaySquare.setPixmap(QtGui.QPixmap('images/green_background.jpg'))
+        else:
+            self.TimeDisplaySquare.setPixmap(QtGui.QPixmap('images/red_background.jpg'))
+
+        if gameState == GameState.GAME_OVER:
+            self.TimeDisplayText.setText('-')
+        elif lane.isProceeding():
+            self.TimeDisplayText.setText(str(int(lane.getGame().getTimer())))
+        else:
+            self.TimeDisplayText.setText(str(self.__preparationTime))
+
+    def __showWinner(self, lane: Lane):
+        game = lane.getGame()
+        winners = np.where(game.getScoreTable() == np.max(game.getScoreTable()))
+        if len(winners) == 1:
+            self.WinnerDisplayText.setText(self.__language_box[self.__language][40]+str(winners[0]+1)+" "+self.__language_box[self.__language][41])
+            self.WinnerDisplayText.show()
+        else:
+            txt = self.__language_box[self.__language][42] + " " + self.__language_box[self.__language][40] + str(winners[0]+1)
+            
+            for win in winners[1:]:
+                txt += " " + self.__language_box[self.__language][43] + " " + self.__language_box[self.__language][40] + str(win+1)
+
+        self.WinnerDisplayText.show()
 
     def __changeLanguage(self):
         if self.__WindowIndex == 0:
@@ -503,8 +560,63 @@ class Ui_MainWindow(QMainWindow):
         if int(self.GameTypeComboBox.currentIndex()) == 1:
             self.__gameType = GameType.TO_SPECIFIED_AMOUNT_OF_POINTS
 
+    def __getLaneText(self, idx: int) -> str:
+        return self.__language_box[self.__language][44]+" "+str(idx+1)
+
+    def __addLane(self):
+        lane = Lane('Lane '+str(self.__laneManager.getLaneCount()+1), self.__targetType, frameWindow=self.__frameWindow,\
+                    hitDetectionRate=self.__hitDetectionRate, outOfProcess=self.__visionProcess)
+        idx = self.__laneManager.addLane(lane)
+        self.LaneComboBox.addItem(self.__getLaneText(idx))
+        self.LaneComboBox.setCurrentIndex(idx)
+
+    def __changeLane(self):
+        idx = self.LaneComboBox.currentIndex()
+        if idx < 0:
+            return
+
+        # target marking is tied to the camera view of the lane it was started on
+        if self.__lane is not None:
+            self.__lane.stopMarking()
+        self.__detect = False
+        self.__manualMark = False
+        self.__markedPoints = []
+
+        if self.ScoreTable is not None:
+            self.ScoreTable.hide()
+        self.__lane = self.__laneManager.getLane(idx)
+        self.ScoreTable = self.__scoreTables.get(self.__lane)
+
+        if self.__WindowIndex == 2:
+            self.__showConnectionControls()
+        if self.__WindowIndex == 3:
+            self.__showGameControls()
+
+    def __showConnectionControls(self):
+        # push buttons of the third window follow the state of the picked lane
+        connected = self.__lane.isConnected()
+        calibrated = self.__lane.getEllipse() is not None or self.__manualMark
+        self.ConnectPushButton.setVisible(not connected)
+        self.DisconnectPushButton.setVisible(connected)
+        self.DetectPushButton.setVisible(connected and not calibrated)
+        self.ManualMarkPushButton.setVisible(connected and not calibrated)
+        self.ResetTargetPushButton.setVisible(connected and calibrated)
+
+    def __showGameControls(self):
+        gameState = self.__lane.getGameState()
+        if self.ScoreTable is not None:
+            self.ScoreTable.show()
+        self.__updateTimeDisplay(self.__lane)
+        self.NextSetPushButton.setVisible(not self.__lane.isProceeding() and gameState != GameState.GAME_OVER)
+        if gameState == GameState.GAME_OVER:
+            self.__showWinner(self.__lane)
+        else:
+            self.WinnerDisplayText.hide()
+
     def __detectTarget(self):
+        # detection runs on the lane job, display tick waits for its result
         self.ManualMarkPushButton.hide()
+        self.__lane.detectTarget()
         self.__detect = True
 
     def __disconnectCamera(self):
@@ -515,11 +627,8 @@ class Ui_MainWindow(QMainWindow):
             self.__markedPoints.append((x,y))
         if event == cv2.EVENT_RBUTTONDOWN and len(self.__markedPoints) > 0:
             self.__markedPoints.pop()
-        if len(self.__markedPoints) == 5:
-            self.__ellipse = self.__model.createEllipse(self.__markedPoints)
-            self.__model.prepareTransformation(self.__actFrame)
-        else:
-            self.__ellipse = None
+        if self.__manualMark:
+            self.__lane.markTarget(self.__markedPoints)
 
     def __markTarget(self):
         self.DetectPushButton.hide()
@@ -527,8 +636,9 @@ class Ui_MainWindow(QMainWindow):
         self.ResetTargetPushButton.show()
         self.__markedPoints = []
         self.__manualMark = True
+        self.__lane.markTarget(self.__markedPoints)
 
-        frame, status = captureVideo(self.__Video)
+        frame, status = self.__lane.getReader().getLatestFrame()
 
         if status == ConnectionStatus.ERROR:
             return
@@ -544,12 +654,11 @@ class Ui_MainWindow(QMainWindow):
         cv2.setMouseCallback("CameraView", self.__markPoints)
 
     def __resetTarget(self):
-        self.__ellipse = None
         self.__detect = False
         self.__manualMark = False
         self.__markedPoints = []
 
-        self.__model.resetEllipse()
+        self.__lane.resetTarget()
 
         self.DetectPushButton.show()
         self.ManualMarkPushButton.show()
@@ -557,11 +666,10 @@ class Ui_MainWindow(QMainWindow):
         
 
     def __connectToCamera(self):
-        if self.__game is None:
-            self.__game = Game(self.__noPlayers, self.__gameType, self.__noSets, self.__noPoints, self.__noArrows, self.__targetType,\
-                           self.__preparationTime, self.__shootTime)
-        if self.__model is None:
-            self.__model = ArcheryTargetModel(self.__targetType)
+        lane = self.__lane
+        if lane.getGame() is None:
+            lane.setGame(Game(self.__noPlayers, self.__gameType, self.__noSets, self.__noPoints, self.__noArrows, self.__targetType,\
+                         self.__preparationTime, self.__shootTime))
 
         # IP and port validation
         if any(elem =='' for elem in[self.IPLineEdit1.text(), self.IPLineEdit2.text(), self.IPLineEdit3.text(), 
@@ -578,10 +686,13 @@ class Ui_MainWindow(QMainWindow):
             url = "http://"+self.IPLineEdit1.text()+"."+self.IPLineEdit2.text()+"."+self.IPLineEdit3.text()+\
                 "."+self.IPLineEdit4.text()+":"+self.DroidCamPortLineEdit.text()+"/video"
             
-            self.__Video  = cv2.VideoCapture(url)
-            frame, status = captureVideo(self.__Video)
-
-            self.__actFrame = frame.copy()
+            if self.__mjpegClient:
+                # camera lost in the middle of a session is given up after about 15 s of reconnects and reported
+                reader = MjpegReader(url, maxReconnects=5).start()
+            else:
+                reader = CameraReader(cv2.VideoCapture(url)).start()
+            reader.waitForNewFrame()
+            frame, status = reader.getLatestFrame()
             
             if status == ConnectionStatus.ERROR:
                 # error service
@@ -592,103 +703,121 @@ class Ui_MainWindow(QMainWindow):
                                     '\n'+self.__language_box[self.__language][17])
                 error_message.setStandardButtons(QMessageBox.Ok)
                 error_message.exec_()    
+                reader.release()
             else:
-                self.__connected = True   
-                self.ConnectPushButton.hide()
-                self.DisconnectPushButton.show() 
-                self.DetectPushButton.show()
-                self.ManualMarkPushButton.show()
-
-            i = 0
-
-            while status == ConnectionStatus.OK and self.__disconnect == False:
-                i += 1
-                if i % 100 == 0:
-                    if self.__proceed:
-                        self.__proceedGame()
-
-                        self.TimeDisplayText.setText(str(int(self.__game.getTimer())))
-
-                    imshow = frame.copy()
-
-                    # if target is detected/marked draw it
-                    if self.__ellipse is not None:
-                        imshow = self.__model.drawEllipse(imshow)
-                    
-                    # when target is pointed manually, draw marked points
-                    if self.__manualMark:
-                        imshow = self.__model.drawPoints(imshow, self.__markedPoints)
-                        if len(self.__markedPoints) == 5 and self.__ellipse is not None:
-                            self.__model.prepareTransformation(frame.copy())
-
-                    # constant image display
-                    if self.__WindowIndex == 3 and self.__ellipse is not None and imshow is not None:
-                        imshow = self.__model.getTransformedImage(frame)
-                        if self.__actFrame is None:
-                            self.__actFrame = imshow
-                            self.__prevFrame = imshow
-                            self.__prevPrevFrame = imshow
-                        self.__prevPrevFrame = self.__prevFrame
-                        self.__prevFrame = self.__actFrame
-                        self.__actFrame = imshow
-                        cv2.imshow("CameraView", imshow)
-                    if self.__WindowIndex == 2 and imshow is not None:
-                        cv2.imshow("CameraView", imshow)
-
-                    """if self.__proceed:
-                        if self.__actFrame is None:
-                            self.__actFrame = imshow
-                            self.__prevFrame = imshow
-                            self.__prevPrevFrame = imshow
-                        self.__prevPrevFrame = self.__prevFrame
-                        self.__prevFrame = self.__actFrame
-                        self.__actFrame = imshow
-                        if self.__actFrame.shape != self.__prevFrame.shape:
-                            self.__prevFrame = imshow
-                            self.__prevPrevFrame = imshow
-                        if self.__actFrame.shape != self.__prevPrevFrame.shape:
-                            self.__prevPrevFrame = self.__prevFrame
-                    else:
-                        self.__actFrame = frame.copy()"""
-                    i=0
-
-                    frame, status = captureVideo(self.__Video)
-
-                    if (cv2.waitKey(1) & 0xFF == ord('q')) or self.__disconnect:
-                        break
-                    
-                    # when order to detect target
-                    if self.__detect:
-                        #self.__ellipse = self.__model.detectTarget(cv2.cvtColor(frame.copy(), cv2.COLOR_BGR2RGB))
-                        fRGB = cv2.cvtColor(frame.copy(), cv2.COLOR_BGR2RGB)
-                        self.__ellipse = self.__model.detectTarget(fRGB)
-                        if self.__ellipse is None:
-                            # if target was not found
-                            errorEllNotFound = QMessageBox(self)
-                            errorEllNotFound.setIcon(QMessageBox.Critical)
-                            errorEllNotFound.setWindowTitle(self.__language_box[self.__language][14])
-                            errorEllNotFound.setText(self.__language_box[self.__language][20])
-                            errorEllNotFound.setStandardButtons(QMessageBox.Ok)
-                            errorEllNotFound.exec_()
-                            
-                            self.ManualMarkPushButton.show()
-                        else:
-                            self.DetectPushButton.hide()
-                            self.ResetTargetPushButton.show()
-                        self.__detect = False
+                lane.connect(reader)
+                self.__showConnectionControls()
+
+                if not self.__scheduler.isRunning():
+                    self.__scheduler.start()
+
+    def __processFrameTick(self):
+        # camera failures are handled on the GUI thread, vision work of lanes with a new frame is sent to the worker pool
+        for lane in self.__laneManager.getLanes():
+            if lane.isConnected() and not lane.hasNewFrame() and lane.getStatus() == ConnectionStatus.ERROR:
+                self.__stopCamera(lane)
+        self.__laneManager.schedule()
+
+    def __displayTick(self):
+        # constant image display of the picked lane
+        imshow = self.__lane.getImage() if self.__lane is not None else None
+        if imshow is not None and self.__WindowIndex in (2, 3):
+            if self.__metricsOverlay:
+                imshow = drawMetricsOverlay(imshow.copy(), self.__getOverlayLines())
+            cv2.imshow("CameraView", imshow)
+
+            now = monotonic()
+            if self.__lastDisplayTime is not None:
+                defaultRegistry.observe('display_interval_seconds', now-self.__lastDisplayTime, 'time between displayed frames')
+            self.__lastDisplayTime = now
+
+        key = cv2.waitKey(1) & 0xFF
+        if key == ord('m'):
+            self.__metricsOverlay = not self.__metricsOverlay
+            defaultRegistry.enable(defaultRegistry.isEnabled() or self.__metricsOverlay)
+        if key == ord('q'):
+            for lane in self.__laneManager.getLanes():
+                if lane.isConnected():
+                    self.__stopCamera(lane)
+            return
+        if self.__disconnect:
+            self.__stopCamera(self.__lane)
+            return
 
-            self.DisconnectPushButton.hide()
-            self.DetectPushButton.hide()
-            self.ManualMarkPushButton.hide()
-            self.ConnectPushButton.show()
+        # when ordered target detection is done
+        detected, ellipse = self.__lane.takeDetection() if self.__detect else (False, None)
+        if detected:
+            if ellipse is None:
+                # if target was not found
+                errorEllNotFound = QMessageBox(self)
+                errorEllNotFound.setIcon(QMessageBox.Critical)
+                errorEllNotFound.setWindowTitle(self.__language_box[self.__language][14])
+                errorEllNotFound.setText(self.__language_box[self.__language][20])
+                errorEllNotFound.setStandardButtons(QMessageBox.Ok)
+                errorEllNotFound.exec_()
 
+                self.ManualMarkPushButton.show()
+            else:
+                self.DetectPushButton.hide()
+                self.ResetTargetPushButton.show()
+            self.__detect = False
+
+    def __gameTick(self):
+        # every lane plays its own game, only the picked one is shown
+        for lane in self.__laneManager.getLanes():
+            if lane.isProceeding():
+                self.__proceedGame(lane)
+
+        if self.__lane is not None and self.__lane.isProceeding():
+            self.TimeDisplayText.setText(str(int(self.__lane.getGame().getTimer())))
+
+    def __getOverlayLines(self):
+        # smoothed values of the main stages in milliseconds
+        lines = []
+        interval = defaultRegistry.get('display_interval_seconds')
+        if interval is not None and interval.getSmoothed():
+            lines.append(f"FPS {1/interval.getSmoothed():.1f}")
+        for name, label in [('frame_age_seconds', 'lag'), ('lane_job_seconds', 'process'), ('model_warp_seconds', 'warp'),\
+                            ('model_hit_classify_seconds', 'classify'), ('model_lines_seconds', 'lines'),\
+                            ('model_coordinates_seconds', 'localise')]:
+            metric = defaultRegistry.get(name)
+            if metric is not None and metric.getSmoothed() is not None:
+                lines.append(f"{label} {1000*metric.getSmoothed():.1f} ms")
+        lines.append(f"workers {self.__laneManager.getInFlight()}/{self.__laneManager.getMaxWorkers()}")
+        governor = self.__lane.getGovernor()
+        lines.append(f"stride {governor.getStride(self.__lane.getGameState())}")
+        reader = self.__lane.getReader()
+        if reader is not None:
+            stats = reader.getStats()
+            lines.append(f"dropped {stats['dropped']}/{stats['captured']}")
+            if stats.get('decoded'):
+                lines.append(f"decode {1000*stats['decodeSeconds']/stats['decoded']:.1f} ms")
+        return lines
+
+    def __stopCamera(self, lane: Lane):
+        lane.release()
+
+        if lane is self.__lane:
             self.__disconnect = False
-
-            self.__Video.release()
+            if self.__WindowIndex == 2:
+                self.__showConnectionControls()
+
+        # timers and camera view are kept while any lane is connected
+        if not any(lane.isConnected() for lane in self.__laneManager.getLanes()):
+            self.__scheduler.stop()
+            if self.__metricsPath is not None:
+                defaultRegistry.writeText(self.__metricsPath)
             cv2.destroyAllWindows()
 
-    def __createScoreTable(self):
-        self.ScoreTable = QtWidgets.QTableWidget()
+    def closeEvent(self, event):
+        # cameras, pool workers and vision processes of all lanes are stopped with the window
+        self.__scheduler.stop()
+        self.__laneManager.shutdown()
+        super().closeEvent(event)
+
+    def __createScoreTable(self, title: str):
+        table = QtWidgets.QTableWidget()
+        table.setWindowTitle(title)
 
         class BoldBorderDelegate(QtWidgets.QStyledItemDelegate):
             def __init__(self, noPlayers, noSets, noArrows, parent=None):
@@ -727,21 +856,22 @@ class Ui_MainWindow(QMainWindow):
                     
                 painter.restore()
 
-        self.ScoreTable.setColumnCount(1+(self.__noArrows+1)*self.__noPlayers)
-        self.ScoreTable.setRowCount(2+self.__noSets)
-        self.ScoreTable.setItem(0,0,QtWidgets.QTableWidgetItem('Sets\Players+Score'))
+        table.setColumnCount(1+(self.__noArrows+1)*self.__noPlayers)
+        table.setRowCount(2+self.__noSets)
+        table.setItem(0,0,QtWidgets.QTableWidgetItem('Sets\Players+Score'))
         for i in range(self.__noPlayers):
-            self.ScoreTable.setItem(0,((self.__noArrows+1)*i)+1,QtWidgets.QTableWidgetItem('Player '+str(i+1)))
-            self.ScoreTable.setSpan(0,i*(self.__noArrows+1)+1, 1, self.__noArrows)
+            table.setItem(0,((self.__noArrows+1)*i)+1,QtWidgets.QTableWidgetItem('Player '+str(i+1)))
+            table.setSpan(0,i*(self.__noArrows+1)+1, 1, self.__noArrows)
         for i in range(self.__noSets):
-            self.ScoreTable.setItem(i+1,0,QtWidgets.QTableWidgetItem('Set '+str(i+1)))
+            table.setItem(i+1,0,QtWidgets.QTableWidgetItem('Set '+str(i+1)))
 
-        self.delegate = BoldBorderDelegate(self.__noPlayers, self.__noSets, self.__noArrows, self.ScoreTable)
-        self.ScoreTable.setItemDelegate(self.delegate)                    
+        table.setItemDelegate(BoldBorderDelegate(self.__noPlayers, self.__noSets, self.__noArrows, table))
+        return table                    
 
     def __NextWindow(self):
         if self.__WindowIndex == 2:
-            if self.__connected and self.__ellipse is not None:
+            lanes = self.__laneManager.getLanes()
+            if all(lane.isConnected() and lane.getEllipse() is not None for lane in lanes):
                 self.IPAddrText.hide()
                 self.DroidCamPortText.hide()
                 self.IPLineEdit1.hide()
@@ -753,20 +883,23 @@ class Ui_MainWindow(QMainWindow):
                 self.DetectPushButton.hide()
                 self.ManualMarkPushButton.hide()
                 self.ResetTargetPushButton.hide()
+                self.DisconnectPushButton.hide()
+                self.AddLanePushButton.hide()
                 self.BackPushButton.hide()
 
                 self.__detect = False
                 self.__manualMark = False
                 self.__markedPoints = []
 
-                if self.ScoreTable is None:
-                    self.__createScoreTable()
-                self.ScoreTable.show()
+                for i, lane in enumerate(lanes):
+                    lane.stopMarking()
+                    lane.setScoring(True)
+                    if lane not in self.__scoreTables:
+                        self.__scoreTables[lane] = self.__createScoreTable(self.__getLaneText(i))
+                self.ScoreTable = self.__scoreTables[self.__lane]
                 self.TimeDisplaySquare.show()
-                if self.TimeDisplayText.text() == "":
-                    self.TimeDisplayText.setText(str(self.__preparationTime))
                 self.TimeDisplayText.show()
-                self.NextSetPushButton.show()
+                self.__showGameControls()
                 
                 self.__WindowIndex = 3
             else:
@@ -789,9 +922,14 @@ class Ui_MainWindow(QMainWindow):
             self.IPLineEdit3.show()
             self.IPLineEdit4.show()
             self.DroidCamPortLineEdit.show()
-            self.ConnectPushButton.show()
+            self.LaneComboBox.show()
+            self.AddLanePushButton.show()
 
             self.__WindowIndex = 2
+            if self.__laneManager.getLaneCount() == 0:
+                self.__addLane()
+            else:
+                self.__showConnectionControls()
         if self.__WindowIndex == 0:
             if self.NoPlayersLineEdit.text() == '' or self.NoPointsLineEdit.text() == '' or self.NoSetsLineEdit.text() == ''\
                 or self.NoArrowsLineEdit.text() == '' or self.PreparationTimeLineEdit.text() == '' or self.ShootTimeLineEdit.text() == '':
@@ -868,6 +1006,8 @@ class Ui_MainWindow(QMainWindow):
             self.DetectPushButton.hide()
             self.ManualMarkPushButton.hide()
             self.ResetTargetPushButton.hide()
+            self.LaneComboBox.hide()
+            self.AddLanePushButton.hide()
 
             self.BackPushButton.show()
             self.PickTargetText.show()
@@ -881,6 +1021,7 @@ class Ui_MainWindow(QMainWindow):
             self.TimeDisplaySquare.hide()
             self.TimeDisplayText.hide()
             self.NextSetPushButton.hide()
+            self.WinnerDisplayText.hide()
 
             self.IPAddrText.show()
             self.DroidCamPortText.show()
@@ -889,15 +1030,14 @@ class Ui_MainWindow(QMainWindow):
             self.IPLineEdit3.show()
             self.IPLineEdit4.show()
             self.DroidCamPortLineEdit.show()
-            self.ConnectPushButton.show()
-            self.DetectPushButton.show()
-            self.ManualMarkPushButton.show()
-            self.ResetTargetPushButton.show()
+            self.AddLanePushButton.show()
 
-            self.__ellipse = self.__backupEllipse
-            self.__backupEllipse = None
+            # lanes keep their calibration, scoring starts again from a fresh frame history
+            for lane in self.__laneManager.getLanes():
+                lane.setScoring(False)
 
             self.__WindowIndex = 2
+            self.__showConnectionControls()
             
 
         
@@ -1,81 +1,152 @@
 import cv2
 import numpy as np
-import pandas as pd
+import os
+import hashlib
+import atexit
 
 from sklearn.neighbors import KNeighborsClassifier
-from openpyxl import load_workbook
 from typing import Tuple
 
 from imageProcessing import reduceImageOfEllipseAndGetNewCenter, reduceImageOfEllipse,\
 getTransformationParameters, getTransformedImage, getBoundriesAndMask, reduceImageAndRemoveBackground,\
 detectHit
+from frameHistory import FrameHistory
+from hitClassifier import LookupTableClassifier
+from sampleStore import SampleStore, syncStore, flushToXlsx, makeSample
 
 
-def prepareDataSet() -> KNeighborsClassifier:
-    knn = KNeighborsClassifier(n_neighbors=3)
-    data = pd.read_excel('hitDetectionData.xlsx', sheet_name='Data')
-    noArrStd = data['noHitStd'].to_numpy()
-    noArrMax = data['noHitMax'].to_numpy()
-    arrStd = data['hitStd'].to_numpy()
-    arrMax = data['hitMax'].to_numpy()
+# training data lives next to this module, so it is found from any working directory
+DataPath = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'hitDetectionData.xlsx')
+
+def getSampleStore(path: str = DataPath) -> SampleStore:
+    # xlsx (path or the one next to the store) is the source of truth, the store is its binary copy
+    # built again when the xlsx changes, plus samples labelled since they were last flushed to the xlsx
+    base = os.path.splitext(path)[0]
+    return syncStore(base+'.xlsx', base+'.samples')
+
+def loadTrainingData(path: str = DataPath) -> Tuple[np.ndarray, np.ndarray]:
+    # rows of (std, max) diff features and labels: 0 - no arrow, 1 - arrow
+    data = getSampleStore(path).read()
+    noArrStd = data['noHitStd']
+    noArrMax = data['noHitMax']
+    arrStd = data['hitStd']
+    arrMax = data['hitMax']
 
     std_train = np.concatenate([noArrStd, arrStd], axis=0)
     max_train = np.concatenate([noArrMax, arrMax], axis=0)
     y_train = np.concatenate([np.array([0 for _ in range(len(noArrStd))]), np.array([1 for _ in range(len(arrStd))])])
 
-
-    knn.fit(np.array([std_train, max_train]).T, y_train)
-    return knn
-
-
-def addToDataSet(ppframe: np.ndarray, pframe: np.ndarray, frame: np.ndarray):
-    framecpy = cv2.cvtColor(frame.copy(), cv2.COLOR_RGB2GRAY)
-    pframecpy = cv2.cvtColor(pframe.copy(), cv2.COLOR_RGB2GRAY)
-    ppframecpy = cv2.cvtColor(ppframe.copy(), cv2.COLOR_RGB2GRAY)
-
-    frame_pframe_diff = np.abs((framecpy.astype(np.int16) - pframecpy.astype(np.int16))).astype(np.uint8)
-    pframe_ppframe_diff = np.abs((pframecpy.astype(np.int16)-ppframecpy.astype(np.int16))).astype(np.uint8)
-
-    fpf_std = np.std(frame_pframe_diff)
-    pfppf_std = np.std(pframe_ppframe_diff)
-
-    fpf_max = np.max(frame_pframe_diff)
-    pfppf_max = np.max(pframe_ppframe_diff)
+    return np.array([std_train, max_train]).T, y_train
+
+
+# classifiers loaded in this process, shared by every ArcheryTargetModel: source path -> (source signature, classifier)
+loadedClassifiers = {}
+
+def getSourceSignature(path: str) -> Tuple[int, int]:
+    stat = os.stat(path)
+    return stat.st_mtime_ns, stat.st_size
+
+def getSourceHash(path: str) -> str:
+    with open(path, 'rb') as file:
+        return hashlib.sha256(file.read()).hexdigest()
+
+def getCompiledModelPath(path: str) -> str:
+    return os.path.splitext(path)[0]+'.cache.npz'
+
+def saveCompiledModel(path: str, lut: LookupTableClassifier, x_train: np.ndarray, y_train: np.ndarray):
+    # training data and rasterized decision table stored next to the xlsx source with its signature
+    mtime, size = getSourceSignature(path)
+    writeCompiledModel(path, x_train=x_train, y_train=y_train, table=lut.getTable(), stdStep=lut.getStdStep(),
+                       nNeighbors=lut.getClassifier().n_neighbors, sourceMtime=mtime, sourceSize=size,
+                       sourceHash=getSourceHash(path))
+
+def writeCompiledModel(path: str, **data):
+    cachePath = getCompiledModelPath(path)
+    tmpPath = cachePath+'.'+str(os.getpid())+'.tmp'
+    with open(tmpPath, 'wb') as file:
+        np.savez_compressed(file, **data)
+    os.replace(tmpPath, cachePath)
+
+def loadCompiledModel(path: str) -> LookupTableClassifier:
+    # returns None when there is no compiled model or its source was edited since compilation
+    cachePath = getCompiledModelPath(path)
+    if not os.path.exists(cachePath):
+        return None
+    try:
+        with np.load(cachePath, allow_pickle=False) as compiled:
+            data = {key: compiled[key] for key in compiled.files}
+    except (OSError, ValueError, KeyError):
+        return None
+
+    signature = getSourceSignature(path)
+    if (int(data['sourceMtime']), int(data['sourceSize'])) != signature:
+        # file was touched, it is still valid when content is the same, new signature saves hashing next time
+        if str(data['sourceHash']) != getSourceHash(path):
+            return None
+        data['sourceMtime'], data['sourceSize'] = signature
+        try:
+            writeCompiledModel(path, **data)
+        except OSError:
+            pass
+
+    knn = KNeighborsClassifier(n_neighbors=int(data['nNeighbors']))
+    knn.fit(data['x_train'], data['y_train'])
+    return LookupTableClassifier(knn, stdStep=float(data['stdStep']), table=data['table'])
+
+def prepareDataSet(path: str = DataPath) -> LookupTableClassifier:
+    # compiled model is built from the sample store synced with the xlsx, only when it is missing or outdated,
+    # edited xlsx and appended samples both change the store, so the compiled model is built again
+    path = getSampleStore(path).getPath()
+    signature = getSourceSignature(path)
+    if path in loadedClassifiers and loadedClassifiers[path][0] == signature:
+        return loadedClassifiers[path][1]
+
+    lut = loadCompiledModel(path)
+    if lut is None:
+        knn = KNeighborsClassifier(n_neighbors=3)
+        x_train, y_train = loadTrainingData(path)
+
+        knn.fit(x_train, y_train)
+        lut = LookupTableClassifier(knn)
+        try:
+            saveCompiledModel(path, lut, x_train, y_train)
+        except OSError:
+            pass
+
+    loadedClassifiers[path] = (signature, lut)
+    return lut
+
+
+# xlsx files with samples labelled in this process, samples are written to them in one batch at exit
+flushedAtExit = set()
+
+def flushDataSet(path: str = DataPath) -> int:
+    # labelled samples not yet in the xlsx are appended to it, returns their number
+    return flushToXlsx(getSampleStore(path), os.path.splitext(path)[0]+'.xlsx')
+
+def addToDataSet(ppframe: np.ndarray, pframe: np.ndarray, frame: np.ndarray, path: str = DataPath) -> int:
+    # one sample appended to the store, returns number of samples, xlsx gets it with flushDataSet or at exit
+    history = FrameHistory(3)
+    for im in (ppframe, pframe, frame):
+        history.push(im)
+
+    frame_pframe_diff = history.getDiff(0, 1)
+    pframe_ppframe_diff = history.getDiff(1, 2)
+
+    fpf_std, fpf_max = history.getDiffFeatures(0, 1)
+    pfppf_std, pfppf_max = history.getDiffFeatures(1, 2)
 
     fpf_sumChanged = np.sum(frame_pframe_diff > np.mean(frame_pframe_diff))
     pfppf_sumChanged = np.sum(pframe_ppframe_diff > np.mean(pframe_ppframe_diff))
 
-    workbook = load_workbook('hitDetectionData.xlsx')
-    dataSheet = workbook['Data']
-
-    noArrowHistValsSheet = workbook['noArrowHistogramValues']
-    arrowHistValsSheet = workbook['arrowHistogramValues']
-
-    lastrow = 0
-    for row in range(1, dataSheet.max_row+2):
-        if dataSheet.cell(row=row, column=1).value is not None:
-            lastrow = row
-        else:
-            dataSheet.cell(row=lastrow+1, column=1, value=pfppf_std)
-            dataSheet.cell(row=lastrow+1, column=2, value=pfppf_max)
-            dataSheet.cell(row=lastrow+1, column=3, value=pfppf_sumChanged)
-
-            dataSheet.cell(row=lastrow+1, column=4, value=fpf_std)
-            dataSheet.cell(row=lastrow+1, column=5, value=fpf_max)
-            dataSheet.cell(row=lastrow+1, column=6, value=fpf_sumChanged)
-
-    noArrowHist, _ = np.histogram(pframe_ppframe_diff.ravel(), bins=256, range=[0,256])
-    arrowHist, _ = np.histogram(frame_pframe_diff.ravel(), bins=256, range=[0,256])
-    lastcol = 0
-    for col in range(1, noArrowHistValsSheet.max_column+2):
-        if noArrowHistValsSheet.cell(row=1, column=col).value is not None:
-            lastcol = col
-        else:
-            for row in range(0,256):
-                noArrowHistValsSheet.cell(row=row+1,column=lastcol+1,value=noArrowHist[row])
-                arrowHistValsSheet.cell(row=row+1,column=lastcol+1,value=arrowHist[row])
-    workbook.save('hitDetectionData.xlsx')
-    return
+    noArrowHist = history.getDiffHistogram(1, 2)
+    arrowHist = history.getDiffHistogram(0, 1)
+    sample = makeSample((pfppf_std, pfppf_max, pfppf_sumChanged), (fpf_std, fpf_max, fpf_sumChanged), noArrowHist, arrowHist)
+    count = getSampleStore(path).append(sample)
+    if path not in flushedAtExit:
+        flushedAtExit.add(path)
+        atexit.register(flushDataSet, path)
+    return count
 
 
 def getEllipse(frame: np.ndarray) -> Tuple[Tuple[float,float], Tuple[float,float], float]:
@@ -160,7 +231,7 @@ def getFrames(video_path: str, frame_idx = 0) -> Tuple[np.ndarray, np.ndarray, n
     return frame, pframe, ppframe
 
 
-def testDetection(video_path: str, ell: Tuple[Tuple[float,float],Tuple[float,float],float], knn: KNeighborsClassifier):
+def testDetection(video_path: str, ell: Tuple[Tuple[float,float],Tuple[float,float],float], knn: LookupTableClassifier):
     i = 0
     # Create a VideoCapture object
     cap = cv2.VideoCapture(video_path)
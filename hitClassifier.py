@@ -0,0 +1,68 @@
+import numpy as np
+from sklearn.neighbors import KNeighborsClassifier
+
+
+class LookupTableClassifier():
+    # decision of a trained classifier rasterized over quantized (std, max) grid of diff features,
+    # max of uint8 diff is an integer 0-255 and its std is bounded by 127.5, so every prediction is an array index
+
+    def __init__(self, classifier: KNeighborsClassifier, stdStep: float = 0.05, stdLimit: float = 127.5, maxLimit: int = 255,\
+                 table: np.ndarray = None):
+        self.__classifier = classifier
+        self.__stdStep = stdStep
+        self.__classes = classifier.classes_
+
+        # table compiled before can be passed directly
+        if table is not None:
+            self.__table = table
+            return
+
+        stds = np.arange(0, stdLimit+stdStep, stdStep)
+        maxs = np.arange(0, maxLimit+1)
+        grid = np.stack(np.meshgrid(stds, maxs, indexing='ij'), axis=-1).reshape(-1, 2)
+
+        # table holds index of predicted class for every grid cell
+        predicted = classifier.predict(grid)
+        self.__table = np.searchsorted(self.__classes, predicted).astype(np.uint8).reshape(len(stds), len(maxs))
+
+    def predict(self, features: np.ndarray) -> np.ndarray:
+        # batch prediction for rows of (std, max), same contract as sklearn predict
+        features = np.asarray(features, dtype=np.float64).reshape(-1, 2)
+        stdIdx = np.clip(np.rint(features[:, 0]/self.__stdStep), 0, self.__table.shape[0]-1).astype(np.intp)
+        maxIdx = np.clip(np.rint(features[:, 1]), 0, self.__table.shape[1]-1).astype(np.intp)
+        return self.__classes[self.__table[stdIdx, maxIdx]]
+
+    def getClassifier(self) -> KNeighborsClassifier:
+        return self.__classifier
+
+    def getTable(self) -> np.ndarray:
+        return self.__table
+
+    def getStdStep(self) -> float:
+        return self.__stdStep
+
+
+def getParityReport(lut: LookupTableClassifier, features: np.ndarray, labels: np.ndarray, randomSamples: int = 100000, seed: int = 0):
+    # compares lookup table with the classifier it was built from, on labelled data and on random points of feature space
+    knn = lut.getClassifier()
+    lutPred = lut.predict(features)
+    knnPred = knn.predict(features)
+
+    rng = np.random.default_rng(seed)
+    randomFeatures = np.stack([rng.uniform(0, 127.5, randomSamples), rng.integers(0, 256, randomSamples)], axis=1)
+
+    return {'samples': int(len(labels)),
+            'knnAccuracy': float(np.mean(knnPred == labels)),
+            'lutAccuracy': float(np.mean(lutPred == labels)),
+            'agreement': float(np.mean(lutPred == knnPred)),
+            'randomSamples': randomSamples,
+            'randomAgreement': float(np.mean(lut.predict(randomFeatures) == knn.predict(randomFeatures)))}
+
+
+if __name__ == '__main__':
+    from hiDetectionDataPrepFunctions import loadTrainingData, prepareDataSet
+
+    features, labels = loadTrainingData()
+    report = getParityReport(prepareDataSet(), features, labels)
+    for key, value in report.items():
+        print(f"{key:<16}{value}")
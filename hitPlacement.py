@@ -1,17 +1,19 @@
 import numpy as np
 import cv2
-from math import pi, fabs, sin, cos, tan
+from math import pi, fabs, sin, cos, tan, ceil
+from time import perf_counter
 from typing import Tuple, List
+from concurrent.futures import ThreadPoolExecutor
 
 
 def getHitDetectionMask(image: np.ndarray, ell: Tuple[Tuple[float, float], Tuple[float, float], float]):
-    imcpy = image.copy()
+    # uint8 mask, 0 around static lines along ellipse angle and 255 elsewhere
     (_,_), (_, _), angle = ell
-    imcpy = cv2.medianBlur(imcpy, ksize=5)
+    imcpy = cv2.medianBlur(image, ksize=5)
     imcpy = cv2.Canny(imcpy, 50,150)
     thr = (image.shape[0]+image.shape[1])/8
     lines = cv2.HoughLines(imcpy, rho=1, theta=pi/180, threshold=int(thr+0.5))
-    imline = np.ones(imcpy.shape)
+    imline = np.full(imcpy.shape, 255, dtype=np.uint8)
 
     rang = (image.shape[0]+image.shape[1])/2
     if lines is not None:
@@ -27,44 +29,212 @@ def getHitDetectionMask(image: np.ndarray, ell: Tuple[Tuple[float, float], Tuple
                 x2 = int(x0 - rang * (-b))
                 y2 = int(y0 - rang * (a))
 
-                imline = cv2.line(imline.copy(), (x1, y1), (x2, y2), 0, 1)
-    imdilate = cv2.erode(imline, np.ones((7,7)))
-    return imdilate
+                cv2.line(imline, (x1, y1), (x2, y2), 0, 1)
+    return cv2.erode(imline, np.ones((7,7), dtype=np.uint8))
 
-def getBinDiff(image: np.ndarray, mask: np.ndarray):
-    imcpy = image.copy()
+def updateHitDetectionMask(mask: np.ndarray, start: Tuple[int, int], end: Tuple[int, int], kernelSize: int = 7):
+    # masks new static structure (e.g. arrow already in target) given as segment of (x, y) points,
+    # only neighbourhood of the segment is eroded, result is the same as rebuilding the mask with it
+    half = kernelSize//2
+    xleft = max(int(min(start[0], end[0]))-half, 0)
+    xright = min(int(max(start[0], end[0]))+half+1, mask.shape[1])
+    ytop = max(int(min(start[1], end[1]))-half, 0)
+    ybottom = min(int(max(start[1], end[1]))+half+1, mask.shape[0])
+    if xleft >= xright or ytop >= ybottom:
+        return mask
 
-    pixels = imcpy.flatten()
-    hist, _ = np.histogram(pixels, bins=256, range=(0,256))
+    roi = np.full((ybottom-ytop, xright-xleft), 255, dtype=np.uint8)
+    cv2.line(roi, (int(start[0])-xleft, int(start[1])-ytop), (int(end[0])-xleft, int(end[1])-ytop), 0, 1)
+    mask[ytop:ybottom, xleft:xright] &= cv2.erode(roi, np.ones((kernelSize, kernelSize), dtype=np.uint8))
+    return mask
+
+def getBinDiffThreshold(image: np.ndarray):
+    # 95th percentile of difference
+    hist = np.bincount(image.ravel(), minlength=256)
     cdf = np.cumsum(hist)
     cdf_normalized = cdf/cdf[-1]
-    threshold_value = np.searchsorted(cdf_normalized, 0.95)
+    return np.searchsorted(cdf_normalized, 0.95)
+
+def getBinDiff(image: np.ndarray, mask: np.ndarray, threshold_value: int = None):
+    # pixels above threshold (95th percentile of difference by default), outside of the mask
+    if threshold_value is None:
+        threshold_value = getBinDiffThreshold(image)
+
+    _, imcpy = cv2.threshold(image, threshold_value, 255, cv2.THRESH_BINARY)
+
+    return cv2.bitwise_and(imcpy, mask)
+
+def getCrossedEdges(binary: np.ndarray, box: Tuple[int, int, int, int]):
+    # (top, bottom, left, right) sides of box which binary crosses: pixel on the side and its neighbour
+    # just outside of the box (straight or diagonal) are both set, sides on image border are never crossed
+    ytop, ybottom, xleft, xright = box
+    xl, xr = max(xleft-1, 0), min(xright+1, binary.shape[1])
+    yt, yb = max(ytop-1, 0), min(ybottom+1, binary.shape[0])
+
+    def crosses(inner: np.ndarray, outer: np.ndarray, offset: int):
+        # outer line is one pixel longer at both ends (where image allows), it is shifted to match inner
+        outer = outer != 0
+        near = np.zeros(inner.shape[0]+2, dtype=bool)
+        near[1-offset:1-offset+outer.shape[0]] = outer
+        near = near[:-2] | near[1:-1] | near[2:]
+        return bool(np.any((inner != 0) & near))
 
-    _, imcpy = cv2.threshold(imcpy, threshold_value, 255, cv2.THRESH_BINARY)
+    return (ytop > 0 and crosses(binary[ytop, xleft:xright], binary[ytop-1, xl:xr], xleft-xl),
+            ybottom < binary.shape[0] and crosses(binary[ybottom-1, xleft:xright], binary[ybottom, xl:xr], xleft-xl),
+            xleft > 0 and crosses(binary[ytop:ybottom, xleft], binary[yt:yb, xleft-1], ytop-yt),
+            xright < binary.shape[1] and crosses(binary[ytop:ybottom, xright-1], binary[yt:yb, xright], ytop-yt))
 
-    imcpy = np.multiply(imcpy, mask)
+def getMotionRoi(diff: np.ndarray, binary: np.ndarray, threshold: int, margin: int = 10, shaftExtension: float = 0.5,\
+                 scale: int = 4, growSteps: int = 3):
+    # bounding box (ytop, ybottom, xleft, xright) of every changed region: blocks of scale x scale pixels whose mean of
+    # binary difference (getBinDiff with threshold) is above threshold, enlarged by margin and extended along
+    # the direction of the regions, box grows while binary crosses its sides, None when nothing changed
+    # or the box still doesn't hold the change (whole image has to be searched)
+    small = cv2.resize(cv2.bitwise_and(diff, binary), (max(diff.shape[1]//scale, 1), max(diff.shape[0]//scale, 1)),\
+                       interpolation=cv2.INTER_AREA)
+    points = cv2.findNonZero((small > threshold).astype(np.uint8))
+    if points is None:
+        return None
 
-    return imcpy.astype(np.uint8)
+    x, y, w, h = cv2.boundingRect(points)
+    x, y, w, h = x*scale, y*scale, (w+1)*scale, (h+1)*scale
 
-def getLines(image: np.ndarray, ell: Tuple[Tuple[float, float], Tuple[float, float], float]):
+    # shaft direction is the main axis of the changed blocks
+    dx, dy = 0.0, 0.0
+    if points.shape[0] > 1:
+        vx, vy = cv2.fitLine(points, cv2.DIST_L2, 0, 0.01, 0.01)[:2, 0]
+        extension = shaftExtension*max(w, h)
+        dx, dy = extension*fabs(vx), extension*fabs(vy)
+    box = [max(int(y-margin-dy), 0), min(int(y+h+margin+dy+0.5), diff.shape[0]),
+           max(int(x-margin-dx), 0), min(int(x+w+margin+dx+0.5), diff.shape[1])]
+
+    for step in range(growSteps+1):
+        top, bottom, left, right = getCrossedEdges(binary, box)
+        if not (top or bottom or left or right):
+            return tuple(box)
+        if step == growSteps:
+            break
+        # crossed sides move out by half of the box size
+        grow = max((box[1]-box[0])//2, margin), max((box[3]-box[2])//2, margin)
+        box = [max(box[0]-grow[0], 0) if top else box[0], min(box[1]+grow[0], diff.shape[0]) if bottom else box[1],
+               max(box[2]-grow[1], 0) if left else box[2], min(box[3]+grow[1], diff.shape[1]) if right else box[3]]
+    return None
+
+def getThetaBand(angle: float, width: float):
+    # theta range [rad] covering lines within width degrees of angle, clipped to [0, 180) without wrap,
+    # one degree margin keeps accumulator edge effects out of the band, range starts at 0 so theta table
+    # (and votes) are the same as for unrestricted transform
+    if angle+width <= 0 or angle-width >= 180:
+        return None
+    return 0, min(ceil(angle+width)+1, 180)*pi/180
+
+def getLineThreshold(shapeSum: int, i: int):
+    return int(shapeSum/i+0.5)
+
+def getLines(image: np.ndarray, ell: Tuple[Tuple[float, float], Tuple[float, float], float], timeBudget: float = 0.05):
+    # lines found at the highest threshold of sequence (h+w)/i, i = 2, 3, ... at which any line lies
+    # within 30 degrees of ellipse angle, only lines within 60 degrees (used by getCoordinates) are returned,
+    # None when there is no such line
     (_,_), (_, _), angle = ell
-    imcpy = image.copy()
+    if cv2.countNonZero(image) == 0:
+        return None
+
+    shapeSum = image.shape[0]+image.shape[1]
+    resultBand = getThetaBand(angle, 60)
+    if resultBand is None:
+        return None
+
+    if hasattr(cv2, 'HoughLinesWithAccumulator'):
+        # one accumulator pass, lines come sorted by votes
+        lines = cv2.HoughLinesWithAccumulator(image, rho=1, theta=pi/180, threshold=0, min_theta=resultBand[0], max_theta=resultBand[1])
+        if lines is None:
+            return None
+        lines = lines.reshape(-1, 1, 3)
+        degrees = (180*lines[:, 0, 1]/pi) % 180
+        lines = lines[(angle-60 < degrees) & (degrees < angle+60)]
+        degrees = (180*lines[:, 0, 1]/pi) % 180
+        searched = np.abs(degrees-angle) < 30
+        if not searched.any():
+            return None
+
+        # HoughLines keeps lines with more votes than threshold
+        votes = lines[searched, 0, 2].max()
+        low, high = 2, 2*shapeSum+1
+        while low < high:
+            i = (low+high)//2
+            if getLineThreshold(shapeSum, i) < votes:
+                high = i
+            else:
+                low = i+1
+        lines = lines[lines[:, 0, 2] > getLineThreshold(shapeSum, low)]
+        return np.ascontiguousarray(lines[:, :, :2])
+
+    # binary search on threshold, every search step runs Hough transform only in the searched band
+    searchBand = getThetaBand(angle, 30)
+    if searchBand is None:
+        return None
+    deadline = perf_counter()+timeBudget
+    best = None
+    low, high = 2, 2*shapeSum+1
+    while low < high and perf_counter() < deadline:
+        i = (low+high)//2
+        lines = cv2.HoughLines(image, rho=1, theta=pi/180, threshold=getLineThreshold(shapeSum, i),\
+                               min_theta=searchBand[0], max_theta=searchBand[1])
+        if lines is not None and (np.abs((180*lines[:, 0, 1]/pi) % 180 - angle) < 30).any():
+            best = i
+            high = i
+        else:
+            low = i+1
+    # when budget runs out, the lowest threshold found so far is used
+    if best is None:
+        return None
+
+    lines = cv2.HoughLines(image, rho=1, theta=pi/180, threshold=getLineThreshold(shapeSum, best),\
+                           min_theta=resultBand[0], max_theta=resultBand[1])
+    if lines is None:
+        return None
+    degrees = (180*lines[:, 0, 1]/pi) % 180
+    return lines[(angle-60 < degrees) & (degrees < angle+60)]
+
+
+def getLineSupportMask(image: np.ndarray, ell: Tuple[Tuple[float, float], Tuple[float, float], float]):
+    # 1 where candidate traces are kept: near strong lines perpendicular to ellipse angle (0 on them)
+    (_,_), (_, _), angle = ell
+    thr = (image.shape[0]+image.shape[1])/8
+    lines = cv2.HoughLines(image, rho=1, theta=pi/180, threshold=int(thr+0.5))
+    imline = np.ones(image.shape[:2], dtype=np.uint8)
+
+    rang = (image.shape[0]+image.shape[1])/2
+    if lines is not None:
+        for line in lines:
+            rho, theta = line[0]
+            if fabs(angle-90-(180*theta/pi)%180) < 20:
+                a = np.cos(theta)
+                b = np.sin(theta)
+                x0 = a * rho
+                y0 = b * rho
+                x1 = int(x0 + rang * (-b))
+                y1 = int(y0 + rang * (a))
+                x2 = int(x0 - rang * (-b))
+                y2 = int(y0 - rang * (a))
+
+                cv2.line(imline, (x1, y1), (x2, y2), 0, 1)
+    return cv2.erode(imline, np.ones((3,3), dtype=np.uint8))
 
-    i = 2
-    while True:
-        thr = (image.shape[0]+image.shape[1])/i
-        lines = cv2.HoughLines(imcpy, rho=1, theta=pi/180, threshold=int(thr+0.5))
-        if lines is not None:
-            br = False
-            for line in lines:
-                _, theta = line[0]
-                if fabs((180*theta/pi)%180 - angle) < 30:
-                    br = True
-            if br:
-                break
-        i+=1
 
-    return lines
+def getWindowMedian(values: np.ndarray, window: int):
+    # median of every centered window, windows are truncated at the ends
+    half = window//2
+    medians = np.empty(values.shape[0])
+    if values.shape[0] >= window:
+        windows = np.lib.stride_tricks.sliding_window_view(values, window)
+        medians[half:values.shape[0]-half] = np.partition(windows, half, axis=1)[:, half]
+        borders = list(range(half))+list(range(values.shape[0]-half, values.shape[0]))
+    else:
+        borders = range(values.shape[0])
+    for i in borders:
+        medians[i] = np.median(values[max(0, i-half):min(values.shape[0], i+half+1)])
+    return medians
 
 
 class ArrowLine:
@@ -126,59 +296,41 @@ class ArrowLine:
         self.__xlinspace = np.linspace(x1,x2,num, dtype=np.int16)
         self.__ylinspace = np.linspace(y1,y2,num, dtype=np.int16)
 
-    def calculateLineTrace(self, image: np.ndarray, ell: Tuple[Tuple[float, float], Tuple[float, float], float]):
-        (_,_), (_, _), angle = ell
-        imcpy = image.copy()
-        
-        thr = (image.shape[0]+image.shape[1])/8
-        lines = cv2.HoughLines(imcpy, rho=1, theta=pi/180, threshold=int(thr+0.5))
-        imline = np.ones(imcpy.shape)
-
-        x1, x2, y1, y2 = 0, 0, 0, 0
-        rang = (image.shape[0]+image.shape[1])/2
-        if lines is not None:
-            for line in lines:
-                rho, theta = line[0]
-                if fabs(angle-90-(180*theta/pi)%180) < 20:
-                    a = np.cos(theta)
-                    b = np.sin(theta)
-                    x0 = a * rho
-                    y0 = b * rho
-                    x1 = int(x0 + rang * (-b))
-                    y1 = int(y0 + rang * (a))
-                    x2 = int(x0 - rang * (-b))
-                    y2 = int(y0 - rang * (a))
-
-                    imline = cv2.line(imline.copy(), (x1, y1), (x2, y2), 0, 1)
-        imdilate = cv2.erode(imline, np.ones((3,3)))
+    def calculateLineTrace(self, image: np.ndarray, ell: Tuple[Tuple[float, float], Tuple[float, float], float],\
+                           supportMask: np.ndarray = None):
+        # supportMask depends only on image and ellipse, it should be computed once with getLineSupportMask
+        # and shared by all candidate lines
+        if supportMask is None:
+            supportMask = getLineSupportMask(image, ell)
 
         trace = image[self.__ylinspace, self.__xlinspace]
-        newtrace = np.zeros(trace.shape)
+        if trace.shape[0] == 0:
+            self.__lineTrace = np.zeros(0)
+            self.__rectSurface = 0
+            return self.__lineTrace
+
+        # median of 5 samples window, truncated at trace ends, kept only on supported pixels
+        newtrace = getWindowMedian(trace, 5)
+        newtrace[supportMask[self.__ylinspace, self.__xlinspace] == 0] = 0
+
+        # longest run of nonzero samples, only runs ended inside trace give endpoints,
+        # right endpoint is the first sample after the run
+        edges = np.diff(np.concatenate(([0], (newtrace != 0).view(np.int8), [0])))
+        starts = np.flatnonzero(edges == 1)
+        ends = np.flatnonzero(edges == -1)
+        surfaces = ends-starts
 
-        rect = False
         maxSurface = 0
-        currentSurface = 0
         leftIdx = 0
-        currentLeftIdx = 0
         rightIdx = trace.shape[0]-1
-        for i in range(trace.shape[0]):
-            if imdilate[self.__ylinspace[i],self.__xlinspace[i]]:
-                newtrace[i] = np.median(trace[max(0,i-2):min(trace.shape[0],i+3)])
-            if newtrace[i]:
-                currentSurface += 1
-                if not rect:
-                    rect = True
-                    currentLeftIdx = i
-            else:
-                if rect:
-                    rect = False
-                    if currentSurface > maxSurface:
-                        maxSurface = currentSurface
-                        leftIdx = currentLeftIdx
-                        rightIdx = i
-                    currentSurface = 0
-        if currentSurface > maxSurface:
-            maxSurface = currentSurface
+        terminated = ends < trace.shape[0]
+        if terminated.any():
+            best = np.argmax(surfaces[terminated])
+            maxSurface = int(surfaces[terminated][best])
+            leftIdx = starts[terminated][best]
+            rightIdx = ends[terminated][best]
+        if not terminated.all() and surfaces[-1] > maxSurface:
+            maxSurface = int(surfaces[-1])
                 
         self.__lineTrace = newtrace
         self.__rectSurface = maxSurface
@@ -194,19 +346,36 @@ class ArrowLine:
         return self.__rectSurface 
     
 
-def getCoordinates(image: np.ndarray, ell: Tuple[Tuple[float, float], Tuple[float, float], float], lines: List):
-    imcpy = image.copy()
+def getCoordinates(image: np.ndarray, ell: Tuple[Tuple[float, float], Tuple[float, float], float], lines: List,\
+                   workers: int = None):
     (_,_), (_, _), angle = ell
     maxRectSurface = 0
     coords = [0,0], [0,0]
-    for i, line in enumerate(lines):
+    if lines is None:
+        return coords
+
+    supportMask = getLineSupportMask(image, ell)
+    candidates = []
+    for line in lines:
         rho, theta = line[0]
         if angle-60 < (180*theta/pi)%180 < angle+60:
-            aline = ArrowLine(rho, theta)
-            aline.calculateCoordinates(image.shape[0], image.shape[1])
-            aline.calculateLineTrace(imcpy, ell)
-            if aline.getMaxSurface() > maxRectSurface:
-                maxRectSurface = aline.getMaxSurface()
-                coords = aline.getCoords()
+            candidates.append(ArrowLine(rho, theta))
+
+    def evaluate(aline: ArrowLine):
+        aline.calculateCoordinates(image.shape[0], image.shape[1])
+        aline.calculateLineTrace(image, ell, supportMask)
+        return aline
+
+    if workers is not None and workers > 1 and len(candidates) > 1:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            candidates = list(executor.map(evaluate, candidates))
+    else:
+        candidates = [evaluate(aline) for aline in candidates]
+
+    # candidates keep Hough order, first line with the largest surface wins
+    for aline in candidates:
+        if aline.getMaxSurface() > maxRectSurface:
+            maxRectSurface = aline.getMaxSurface()
+            coords = aline.getCoords()
 
     return coords
\ No newline at end of file
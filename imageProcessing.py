@@ -1,60 +1,82 @@
 import numpy as np
-from typing import Tuple, List
+from typing import Tuple, List, Dict
+from enum import Enum
 import cv2
 from math import fabs, sin, cos, pi
-from sklearn.neighbors import KNeighborsClassifier
+from functools import lru_cache
+
+from frameHistory import FrameHistory
+from hitClassifier import LookupTableClassifier
+
+class Colour(Enum):
+    RED = 0
+    BLUE = 1
+    YELLOW = 2
+    BLACK = 3
+    WHITE = 4
+
+# inclusive HSV bounds used to seperate target colours, a colour may consist of several ranges
+ColourRanges = {
+    Colour.RED: [((161, 51, 51), (255, 255, 255)), ((0, 51, 51), (9, 255, 255))],
+    Colour.BLUE: [((91, 76, 76), (139, 255, 255))],
+    Colour.YELLOW: [((21, 51, 51), (39, 255, 255))],
+    Colour.BLACK: [((0, 0, 0), (255, 255, 49))],
+    Colour.WHITE: [((0, 0, 201), (255, 29, 255))],
+}
+
+def medianBlurMasks(masks: List[np.ndarray], times: int) -> List[np.ndarray]:
+    # masks are packed into channels of one image so a single median blur call filters several of them
+    blurred = []
+    for k in range(0, len(masks), 4):
+        group = masks[k:k+4]
+        if len(group) == 1:
+            packed = group[0]
+        else:
+            packed = cv2.merge(group + [np.zeros_like(group[0])]*(len(group) == 2))
+        for _ in range(times):
+            packed = cv2.medianBlur(packed, 5)
+        blurred += [packed] if len(group) == 1 else list(cv2.split(packed))[:len(group)]
+    return blurred
+
+def getColourMasks(image: np.ndarray, colours: List[Colour], hsv: np.ndarray = None, blurTimes: int = None) -> Dict[Colour, np.ndarray]:
+    # image is converted to HSV once and every requested colour is thresholded on the shared buffer
+    if hsv is None:
+        hsv = cv2.cvtColor(image, cv2.COLOR_RGB2HSV)
+
+    masks = []
+    for colour in colours:
+        ranges = ColourRanges[colour]
+        mask = cv2.inRange(hsv, ranges[0][0], ranges[0][1])
+        for lower, upper in ranges[1:]:
+            cv2.bitwise_or(mask, cv2.inRange(hsv, lower, upper), dst=mask)
+        masks.append(mask)
+
+    if blurTimes is None:
+        blurTimes = np.max(hsv.shape[:2])//100
+    masks = medianBlurMasks(masks, blurTimes)
+    return dict(zip(colours, masks))
 
 def getRed(image: np.ndarray):
     # This and following use HSV colormap to seperate target colours
-    imcopy = image.copy()
-    imcopy = cv2.cvtColor(imcopy, cv2.COLOR_RGB2HSV)
-    imcopy = np.bitwise_and(np.bitwise_and(np.bitwise_or(imcopy[:,:,0] > 160, imcopy[:,:,0] < 10), imcopy[:,:,1] > 50), imcopy[:,:,2] > 50, dtype=np.uint8)
-    for _ in range(np.max(imcopy.shape)//100):
-        imcopy = cv2.medianBlur(imcopy, 5)
-    return 255*imcopy
+    return getColourMasks(image, [Colour.RED])[Colour.RED]
 
 def getBlue(image: np.ndarray):
-    imcopy = image.copy()
-    imcopy = cv2.cvtColor(imcopy, cv2.COLOR_RGB2HSV)
-    imcopy = np.bitwise_and(np.bitwise_and(np.bitwise_and(imcopy[:,:,0] > 90, imcopy[:,:,0] < 140), imcopy[:,:,1] > 75), imcopy[:,:,2] > 75, dtype=np.uint8)
-    for _ in range(np.max(imcopy.shape)//100):
-        imcopy = cv2.medianBlur(imcopy, 5)
-    return 255*imcopy
+    return getColourMasks(image, [Colour.BLUE])[Colour.BLUE]
 
 def getYellow(image: np.ndarray):
-    imcopy = image.copy()
-    imcopy = cv2.cvtColor(imcopy, cv2.COLOR_RGB2HSV)
-    imcopy = np.bitwise_and(np.bitwise_and(np.bitwise_and(imcopy[:,:,0] > 20, imcopy[:,:,0] < 40), imcopy[:,:,1] > 50), imcopy[:,:,2] > 50, dtype=np.uint8)
-    for _ in range(np.max(imcopy.shape)//100):
-        imcopy = cv2.medianBlur(imcopy, 5)
-    return 255*imcopy
+    return getColourMasks(image, [Colour.YELLOW])[Colour.YELLOW]
 
 def getBlack(image: np.ndarray):
-    imcopy = image.copy()
-    imcopy = cv2.cvtColor(imcopy, cv2.COLOR_RGB2HSV)
-    imcopy = np.array(imcopy[:,:,2] < 50, dtype=np.uint8)
-    for _ in range(np.max(imcopy.shape)//100):
-        imcopy = cv2.medianBlur(imcopy, 5)
-    return 255*imcopy
+    return getColourMasks(image, [Colour.BLACK])[Colour.BLACK]
 
 def getWhite(image: np.ndarray):
-    imcopy = image.copy()
-    imcopy = cv2.cvtColor(imcopy, cv2.COLOR_RGB2HSV)
-    imcopy = np.bitwise_and(imcopy[:,:,1] < 30, imcopy[:,:,2] > 200, dtype=np.uint8)
-    for _ in range(np.max(imcopy.shape)//100):
-        imcopy = cv2.medianBlur(imcopy, 5)
-    return 255*imcopy
+    return getColourMasks(image, [Colour.WHITE])[Colour.WHITE]
 
 def getContours(RedBoosted: np.ndarray, BlueBoosted: np.ndarray):
     # function gets contours of an image
 
-    RedBlurred = RedBoosted.copy()
-    BlueBlurred = BlueBoosted.copy()
-
     # multiple median blur
-    for _ in range(np.max(RedBoosted.shape)//100):
-        RedBlurred = cv2.medianBlur(RedBlurred, 5)
-        BlueBlurred = cv2.medianBlur(BlueBlurred, 5)
+    RedBlurred, BlueBlurred = medianBlurMasks([RedBoosted, BlueBoosted], np.max(RedBoosted.shape)//100)
 
     # edge detection
     RedEdges = cv2.Canny(RedBlurred,50,150)
@@ -169,44 +191,33 @@ def getTransformedImage(image: np.ndarray, rotationMatrix: np.ndarray, scalingMa
 
     return cv2.warpAffine(rotatedImage, scalingMatrix.astype(np.float32), (image.shape[1], image.shape[0])).astype(np.uint8)
 
-def reduceImageOfEllipse(image: np.ndarray, ell: Tuple[Tuple[float, float], Tuple[float, float], float]):
+def getEllipseCropBounds(imageShape: Tuple[int, ...], ell: Tuple[Tuple[float, float], Tuple[float, float], float]):
     (x, y), (axmajor, _), _ = ell
 
     ytop = max(int(y - axmajor+0.5),0)
-    ybottom = min(int(y + axmajor+0.5),image.shape[0]-1)
+    ybottom = min(int(y + axmajor+0.5),imageShape[0]-1)
     xleft = max(int(x - axmajor+0.5),0)
-    xright = min(int(x + axmajor+0.5),image.shape[1]-1)
+    xright = min(int(x + axmajor+0.5),imageShape[1]-1)
 
     if ytop == 0:
         ybottom = int(2*y+0.5)
-    elif ybottom == image.shape[0]-1:
+    elif ybottom == imageShape[0]-1:
         ytop = int(ybottom - 2*fabs(ybottom-y) + 0.5)
     if xleft == 0:
         xright = int(2*x+0.5)
-    elif xright == image.shape[1]-1:
+    elif xright == imageShape[1]-1:
         xleft = int(xright - 2*fabs(xright-x) + 0.5)
 
+    return ytop, ybottom, xleft, xright
+
+def reduceImageOfEllipse(image: np.ndarray, ell: Tuple[Tuple[float, float], Tuple[float, float], float]):
+    ytop, ybottom, xleft, xright = getEllipseCropBounds(image.shape, ell)
     return image[ytop:ybottom, xleft:xright]
 
 def reduceImageOfEllipseAndGetNewCenter(image: np.ndarray, ell: Tuple[Tuple[float, float], Tuple[float, float], float]):
-    (x, y), (axmajor, axminor), angle = ell
-
-    ytop = max(int(y - axmajor+0.5),0)
-    ybottom = min(int(y + axmajor+0.5),image.shape[0]-1)
-    xleft = max(int(x - axmajor+0.5),0)
-    xright = min(int(x + axmajor+0.5),image.shape[1]-1)
-
-    if ytop == 0:
-        ybottom = int(2*y+0.5)
-    elif ybottom == image.shape[0]-1:
-        ytop = int(ybottom - 2*fabs(ybottom-y) + 0.5)
-    if xleft == 0:
-        xright = int(2*x+0.5)
-    elif xright == image.shape[1]-1:
-        xleft = int(xright - 2*fabs(xright-x) + 0.5)
+    (_, _), (axmajor, axminor), angle = ell
 
-    newim = image[ytop:ybottom, xleft:xright]
-    
+    newim = reduceImageOfEllipse(image, ell)
 
     return newim, (((newim.shape[0]+0.5)//2, (newim.shape[1]+0.5)//2), (axmajor, axminor), angle)
 
@@ -228,33 +239,53 @@ def getBoundriesAndMask(image: np.ndarray, centre: Tuple[float, float], radius:
 
     m, n = ybottom-ytop, xright-xleft
 
-    mask = np.zeros((m,n,3), dtype=np.uint8)
-    for i in range(m):
-        for j in range(n):
-            if ((i-m//2)**2 + (j-n//2)**2)**0.5 < 1.2*radius:
-                mask[i,j,:] = 1
+    return (ytop,ybottom,xleft,xright), getCircularMask(m, n, radius)
 
-    return (ytop,ybottom,xleft,xright), mask
+@lru_cache(maxsize=8)
+def getCircularMask(m: int, n: int, radius: float) -> np.ndarray:
+    # single channel boolean mask, cached so re-detection and manual re-marking reuse it
+    rows, cols = np.ogrid[:m, :n]
+    mask = np.sqrt((rows-m//2)**2 + (cols-n//2)**2) < 1.2*radius
+    mask.setflags(write=False)
+    return mask
 
 def reduceImageAndRemoveBackground(image: np.ndarray, bounds: Tuple[int,int,int,int], mask: np.ndarray):
-    imreduced = image[bounds[0]:bounds[1], bounds[2]:bounds[3]]
-    return np.multiply(imreduced, mask)
-
-def detectHit(ppframe: np.ndarray, pframe: np.ndarray, frame: np.ndarray, knn: KNeighborsClassifier):
-    framecpy = cv2.cvtColor(frame.copy(), cv2.COLOR_RGB2GRAY)
-    pframecpy = cv2.cvtColor(pframe.copy(), cv2.COLOR_RGB2GRAY)
-    ppframecpy = cv2.cvtColor(ppframe.copy(), cv2.COLOR_RGB2GRAY)
-
-    frame_pframe_diff = np.abs((framecpy.astype(np.int16) - pframecpy.astype(np.int16))).astype(np.uint8)
-    pframe_ppframe_diff = np.abs((pframecpy.astype(np.int16)-ppframecpy.astype(np.int16))).astype(np.uint8)
-
-    fpf_std = np.std(frame_pframe_diff)
-    pfppf_std = np.std(pframe_ppframe_diff)
-
-    fpf_max = np.max(frame_pframe_diff)
-    pfppf_max = np.max(pframe_ppframe_diff)
-
-    pfppf_pred = knn.predict(np.array([[pfppf_std, pfppf_max]]))
-    fpf_pred = knn.predict(np.array([[fpf_std, fpf_max]]))
-    
-    return True if pfppf_pred == 0 and fpf_pred == 1 else False
\ No newline at end of file
+    # background is removed from a copy of the reduced region, input image (e.g. camera frame shown in preview) is left alone
+    imreduced = image[bounds[0]:bounds[1], bounds[2]:bounds[3]].copy()
+    imreduced[~mask[:imreduced.shape[0], :imreduced.shape[1]]] = 0
+    return imreduced
+
+def getFusedTransformation(rotationMatrix: np.ndarray, scalingMatrix: np.ndarray, bounds: Tuple[int,int,int,int]) -> np.ndarray:
+    # rotation, anisotropic scaling and reduction to bounds composed into one affine matrix
+    # which maps the image reduced of ellipse straight to the final target image
+    rotation = np.vstack([rotationMatrix, [0, 0, 1]])
+    scaling = np.vstack([scalingMatrix, [0, 0, 1]])
+    shift = np.array([[1, 0, -bounds[2]], [0, 1, -bounds[0]], [0, 0, 1]], dtype=np.float64)
+    return (shift @ scaling @ rotation)[:2]
+
+def applyFusedTransformation(image: np.ndarray, ell: Tuple[Tuple[float, float], Tuple[float, float], float], fusedMatrix: np.ndarray,\
+                             shape: Tuple[int, int], dst: np.ndarray = None, mask: np.ndarray = None) -> np.ndarray:
+    # single warp of the raw frame (reduced of ellipse without copying) into the final target image
+    imReduced = reduceImageOfEllipse(image, ell)
+    dst = cv2.warpAffine(imReduced, fusedMatrix, (shape[1], shape[0]), dst=dst, flags=cv2.INTER_LINEAR,\
+                         borderMode=cv2.BORDER_CONSTANT, borderValue=0)
+    if mask is not None:
+        np.multiply(dst, mask if dst.ndim == 2 else mask[:, :, None], out=dst)
+    return dst
+
+def detectHitInHistory(history: FrameHistory, knn: LookupTableClassifier) -> bool:
+    # hit is when the newest pair of frames differs like an arrow hit and every older pair does not
+    if not history.isFull():
+        return False
+
+    features = np.array([history.getDiffFeatures(age, age+1) for age in range(history.getLength()-1)])
+    pred = knn.predict(features)
+
+    return True if pred[0] == 1 and not np.any(pred[1:]) else False
+
+def detectHit(ppframe: np.ndarray, pframe: np.ndarray, frame: np.ndarray, knn: LookupTableClassifier):
+    history = FrameHistory(3)
+    for im in (ppframe, pframe, frame):
+        history.push(im)
+
+    return detectHitInHistory(history, knn)
\ No newline at end of file
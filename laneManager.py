@@ -0,0 +1,335 @@
+import os
+import threading
+import traceback
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from time import monotonic, perf_counter
+from typing import List, Tuple
+
+import numpy as np
+
+from cameraConnection import ConnectionStatus, CameraReader
+from visionWorker import LaneVision, VisionWorker
+from game import Game, GameState, TargetType
+from processingGovernor import ProcessingGovernor
+from metrics import timed, defaultRegistry
+
+
+class Lane():
+    # one shooting lane: camera, target calibration and game
+    # vision work (process) runs on a pool worker, at most one at a time per lane, in this process
+    # or, with outOfProcess, in a VisionWorker process of the lane while the pool worker waits for it,
+    # game is only advanced by the GUI thread, hits found by workers wait in a queue for it,
+    # calibration calls of the GUI thread are queued and run by the next lane job, so GUI never waits for vision,
+    # governor decides which frames are processed and which stages run for them
+
+    def __init__(self, name: str, targetType: TargetType, game: Game = None, frameWindow: int = 3,\
+                 hitDetectionRate: float = 30, outOfProcess: bool = False, governor: ProcessingGovernor = None):
+        self.__name = name
+        self.__governor = governor if governor is not None else ProcessingGovernor(name)
+        self.__reader = None
+        if outOfProcess:
+            self.__vision = VisionWorker(targetType, frameWindow, hitDetectionRate).start()
+        else:
+            self.__vision = LaneVision(targetType, frameWindow, hitDetectionRate)
+
+        self.__game = game
+        self.__gameState = GameState.BREAK
+        self.__proceed = False
+        self.__hits = deque()
+        self.__imshow = None
+
+        # calibration commands waiting for a lane job and calibration state published by lane jobs
+        self.__commands = deque()
+        self.__ellipse = None
+        self.__detectionDone = False
+        self.__detectedEllipse = None
+
+        # lock guards only taking and publishing lane state, vision lock is held by the lane job for its vision work
+        self.__lock = threading.Lock()
+        self.__visionLock = threading.Lock()
+
+    def getName(self) -> str:
+        return self.__name
+
+    def getGovernor(self) -> ProcessingGovernor:
+        return self.__governor
+
+    def getGame(self) -> Game:
+        return self.__game
+
+    def setGame(self, game: Game):
+        self.__game = game
+        self.__gameState = game.getGameState() if game is not None else GameState.BREAK
+        self.__proceed = False
+
+    def close(self):
+        # camera is released and vision worker process stopped, lane can't be used afterwards
+        self.release()
+        with self.__visionLock:
+            if isinstance(self.__vision, VisionWorker):
+                self.__vision.stop()
+
+    # camera
+
+    def connect(self, reader: CameraReader):
+        with self.__lock:
+            self.__reader = reader
+            self.__imshow = None
+            self.__governor.reset()
+
+    def release(self):
+        with self.__lock:
+            if self.__reader is not None:
+                self.__reader.release()
+            self.__reader = None
+            self.__imshow = None
+
+    def isConnected(self) -> bool:
+        return self.__reader is not None
+
+    def getReader(self) -> CameraReader:
+        return self.__reader
+
+    def hasNewFrame(self) -> bool:
+        reader = self.__reader
+        return reader is not None and reader.hasNewFrame()
+
+    def isDue(self) -> bool:
+        # new frame which the governor wants processed in the current game state
+        reader = self.__reader
+        return reader is not None and reader.hasNewFrame() and\
+            self.__governor.isDue(self.__gameState, reader.getFrameNumber())
+
+    def getStatus(self) -> ConnectionStatus:
+        reader = self.__reader
+        return reader.getStatus() if reader is not None else ConnectionStatus.ERROR
+
+    def getImage(self) -> np.ndarray:
+        # last image prepared for display, camera view or transformed target while scoring
+        return self.__imshow
+
+    # target calibration
+
+    def getEllipse(self):
+        # ellipse after the last lane job which ran every queued command
+        return self.__ellipse
+
+    def hasCommands(self) -> bool:
+        return len(self.__commands) > 0
+
+    def __queue(self, kind: str, *args):
+        with self.__lock:
+            self.__commands.append((kind, args))
+
+    def detectTarget(self):
+        # detection runs on the newest frame in the next lane job, its result is taken with takeDetection
+        with self.__lock:
+            self.__detectionDone = False
+            self.__detectedEllipse = None
+            self.__commands.append(('detect', ()))
+
+    def takeDetection(self) -> Tuple[bool, Tuple]:
+        # (True, ellipse or None when target was not found) once the requested detection finished
+        with self.__lock:
+            done, ellipse = self.__detectionDone, self.__detectedEllipse
+            self.__detectionDone = False
+            return done, ellipse
+
+    def markTarget(self, points: List[Tuple[int, int]]):
+        # points marked on the camera view, ellipse is fitted once all 5 are given
+        self.__queue('markTarget', list(points))
+
+    def stopMarking(self):
+        self.__queue('stopMarking')
+
+    def resetTarget(self):
+        self.__queue('resetTarget')
+
+    def setScoring(self, scoring: bool):
+        # target images are warped and checked for hits only while scoring
+        self.__queue('setScoring', scoring)
+
+    # game, called from the GUI thread only
+
+    def getGameState(self) -> GameState:
+        return self.__gameState
+
+    def proceedGame(self) -> Tuple[GameState, GameState]:
+        # hits found since the last call are passed first, returns previous and new game state
+        while self.__hits:
+            self.__game.passHit(self.__hits.popleft())
+        prevState = self.__gameState
+        self.__gameState = self.__game.proceedGame()
+        return prevState, self.__gameState
+
+    def isProceeding(self) -> bool:
+        return self.__proceed
+
+    def setProceeding(self, proceed: bool):
+        self.__proceed = proceed
+
+    # vision work, called from a pool worker
+
+    def isReady(self) -> bool:
+        # lane job has queued commands to run or a frame due
+        return self.hasCommands() or self.isDue()
+
+    def process(self):
+        # runs queued calibration commands, then takes the newest camera frame when it is due,
+        # prepares the display image and, while scoring, looks for a hit
+        with self.__visionLock:
+            with self.__lock:
+                reader = self.__reader
+                gameState = self.__gameState
+                commands = list(self.__commands)
+                self.__commands.clear()
+            self.__runCommands(commands, reader)
+
+            imshow, dist = None, None
+            if reader is not None and reader.hasNewFrame() and self.__governor.isDue(gameState, reader.getFrameNumber()):
+                imshow, dist = self.__processFrame(reader, gameState)
+            ellipse = self.__vision.getEllipse()
+
+            with self.__lock:
+                # without preview stage the last display image stays, image of a replaced camera is not shown
+                if imshow is not None and reader is self.__reader:
+                    self.__imshow = imshow
+                # commands queued during the job may still change the ellipse
+                if not self.__commands:
+                    self.__ellipse = ellipse
+                if dist is not None:
+                    self.__hits.append(dist)
+                    defaultRegistry.inc('lane_hits_total', help='hits found by lane jobs, waiting for the game')
+
+    def __runCommands(self, commands: List[Tuple[str, tuple]], reader: CameraReader):
+        # failed command (e.g. vision worker error) doesn't stop the others, failed detection is reported
+        # as target not found, so the GUI waiting for it gets its controls back
+        for kind, args in commands:
+            try:
+                if kind == 'detect':
+                    ellipse = None
+                    try:
+                        if reader is not None:
+                            frame, status = reader.getLatestFrame()
+                            if status != ConnectionStatus.ERROR:
+                                ellipse = self.__vision.detectTarget(frame)
+                    finally:
+                        with self.__lock:
+                            self.__detectionDone = True
+                            self.__detectedEllipse = ellipse
+                else:
+                    getattr(self.__vision, kind)(*args)
+            except Exception:
+                defaultRegistry.inc('lane_command_errors_total', help='calibration commands which raised an exception')
+                traceback.print_exc()
+
+    def __processFrame(self, reader: CameraReader, gameState: GameState) -> Tuple[np.ndarray, float]:
+        start = perf_counter()
+        frameNumber = reader.getFrameNumber()
+        frame, timestamp, status = reader.getLatestFrameWithTimestamp()
+        if status == ConnectionStatus.ERROR:
+            return None, None
+        defaultRegistry.observe('frame_age_seconds', monotonic()-timestamp, 'time from capture to processing')
+
+        imshow, dist = self.__vision.process(frame, gameState, self.__governor.getStages(gameState))
+        self.__governor.update(gameState, frameNumber, timestamp, perf_counter()-start)
+        return imshow, dist
+
+
+class LaneManager():
+    # lanes share one bounded pool of workers, jobs are only submitted for free workers so nothing queues up
+    # and every job takes the newest frame of its lane, a lane has at most one job in flight,
+    # lanes in ROUND are served first, inside both groups the lane served longest ago goes first,
+    # a lane is ready when its governor wants the new frame, governors count on their share of the workers
+
+    def __init__(self, maxWorkers: int = None):
+        if maxWorkers is None:
+            # one core is left for the GUI and camera readers
+            maxWorkers = max((os.cpu_count() or 2)-1, 1)
+        self.__maxWorkers = maxWorkers
+        self.__pool = ThreadPoolExecutor(max_workers=maxWorkers, thread_name_prefix='lane')
+        self.__lanes = []
+        self.__busy = set()
+        self.__served = {}
+        self.__submitted = 0
+        self.__condition = threading.Condition()
+
+    def addLane(self, lane: Lane) -> int:
+        with self.__condition:
+            self.__lanes.append(lane)
+            defaultRegistry.setGauge('lanes', len(self.__lanes), 'lanes handled by the lane manager')
+            self.__shareWorkers()
+            return len(self.__lanes)-1
+
+    def removeLane(self, lane: Lane):
+        # lane job in flight is finished, camera and vision worker of the lane are closed
+        with self.__condition:
+            if lane in self.__lanes:
+                self.__lanes.remove(lane)
+            self.__served.pop(lane, None)
+            defaultRegistry.setGauge('lanes', len(self.__lanes), 'lanes handled by the lane manager')
+            self.__shareWorkers()
+        lane.close()
+
+    def __shareWorkers(self):
+        for lane in self.__lanes:
+            lane.getGovernor().setShare(self.__maxWorkers/len(self.__lanes))
+
+    def getLane(self, idx: int) -> Lane:
+        return self.__lanes[idx]
+
+    def getLanes(self) -> List[Lane]:
+        return list(self.__lanes)
+
+    def getLaneCount(self) -> int:
+        return len(self.__lanes)
+
+    def getMaxWorkers(self) -> int:
+        return self.__maxWorkers
+
+    def getInFlight(self) -> int:
+        return len(self.__busy)
+
+    def schedule(self) -> int:
+        # submits jobs of lanes with a new frame due or queued commands, returns number of submitted jobs
+        with self.__condition:
+            free = self.__maxWorkers - len(self.__busy)
+            if free <= 0 or not self.__lanes:
+                return 0
+
+            ready = [lane for lane in self.__lanes if lane not in self.__busy and lane.isReady()]
+            ready.sort(key=lambda lane: (lane.getGameState() != GameState.ROUND, self.__served.get(lane, -1)))
+            ready = ready[:free]
+            if not ready:
+                return 0
+
+            for lane in ready:
+                self.__busy.add(lane)
+                self.__served[lane] = self.__submitted
+                self.__submitted += 1
+                self.__pool.submit(self.__run, lane)
+            defaultRegistry.setGauge('lane_jobs_in_flight', len(self.__busy), 'lane jobs running on the pool')
+            return len(ready)
+
+    def __run(self, lane: Lane):
+        try:
+            with timed('lane_job_seconds', 'vision work of one lane frame'):
+                lane.process()
+        except Exception:
+            defaultRegistry.inc('lane_job_errors_total', help='lane jobs which raised an exception')
+            traceback.print_exc()
+        finally:
+            with self.__condition:
+                self.__busy.discard(lane)
+                self.__condition.notify_all()
+
+    def wait(self, timeout: float = None) -> bool:
+        # blocks until no lane job is in flight
+        with self.__condition:
+            return self.__condition.wait_for(lambda: not self.__busy, timeout)
+
+    def shutdown(self):
+        self.__pool.shutdown(wait=True)
+        for lane in self.getLanes():
+            lane.close()
@@ -3,12 +3,14 @@ from PyQt5.QtWidgets import QApplication
 
 import gui
 
-app = QApplication(sys.argv)
+# vision workers are spawned processes which import this module, app is only started in the main process
+if __name__ == '__main__':
+    app = QApplication(sys.argv)
 
 
-main_window = gui.Ui_MainWindow()
-main_window.setupUi(main_window)
+    main_window = gui.Ui_MainWindow(visionProcess=True)
+    main_window.setupUi(main_window)
 
-main_window.show()
+    main_window.show()
 
-sys.exit(app.exec_())
\ No newline at end of file
+    sys.exit(app.exec_())
\ No newline at end of file
@@ -0,0 +1,225 @@
+import threading
+from bisect import bisect_left
+import cv2
+import numpy as np
+from contextlib import nullcontext
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from time import perf_counter
+from typing import Dict, List, Tuple
+
+# latency buckets upper bounds [s]
+LatencyBuckets = (0.0005, 0.001, 0.002, 0.005, 0.01, 0.02, 0.05, 0.1, 0.2, 0.5, 1, 2, 5)
+
+
+class Counter():
+    def __init__(self, name: str, help: str = ''):
+        self.name = name
+        self.help = help
+        self.__value = 0
+        self.__lock = threading.Lock()
+
+    def inc(self, value: float = 1):
+        with self.__lock:
+            self.__value += value
+
+    def getValue(self) -> float:
+        return self.__value
+
+    def exportText(self) -> List[str]:
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter", f"{self.name} {self.__value}"]
+
+
+class Gauge():
+    def __init__(self, name: str, help: str = ''):
+        self.name = name
+        self.help = help
+        self.__value = 0
+
+    def set(self, value: float):
+        self.__value = value
+
+    def getValue(self) -> float:
+        return self.__value
+
+    def exportText(self) -> List[str]:
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} gauge", f"{self.name} {self.__value}"]
+
+
+class Histogram():
+    def __init__(self, name: str, help: str = '', buckets: Tuple[float] = LatencyBuckets, smoothing: float = 0.1):
+        self.name = name
+        self.help = help
+        self.__buckets = tuple(sorted(buckets))
+        self.__counts = [0]*(len(self.__buckets)+1)
+        self.__sum = 0
+        self.__count = 0
+        self.__last = None
+        # exponentially smoothed value for live display
+        self.__smoothing = smoothing
+        self.__smoothed = None
+        self.__lock = threading.Lock()
+
+    def observe(self, value: float):
+        idx = bisect_left(self.__buckets, value)
+        with self.__lock:
+            self.__counts[idx] += 1
+            self.__sum += value
+            self.__count += 1
+            self.__last = value
+            self.__smoothed = value if self.__smoothed is None else self.__smoothed+self.__smoothing*(value-self.__smoothed)
+
+    def getCount(self) -> int:
+        return self.__count
+
+    def getSum(self) -> float:
+        return self.__sum
+
+    def getLast(self):
+        return self.__last
+
+    def getSmoothed(self):
+        return self.__smoothed
+
+    def getBuckets(self) -> List[Tuple[float, int]]:
+        # cumulative counts, last bucket is +Inf
+        with self.__lock:
+            cumulative = np.cumsum(self.__counts).tolist()
+        return list(zip(self.__buckets+(float('inf'),), cumulative))
+
+    def exportText(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for bound, count in self.getBuckets():
+            le = '+Inf' if bound == float('inf') else repr(bound)
+            lines.append(f'{self.name}_bucket{{le="{le}"}} {count}')
+        lines.append(f"{self.name}_sum {self.__sum}")
+        lines.append(f"{self.name}_count {self.__count}")
+        return lines
+
+
+class Timer():
+    # context manager observing elapsed seconds into histogram
+    def __init__(self, histogram: Histogram):
+        self.__histogram = histogram
+        self.__start = None
+
+    def __enter__(self):
+        self.__start = perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.__histogram.observe(perf_counter()-self.__start)
+        return False
+
+
+class MetricsRegistry():
+    def __init__(self, enabled: bool = False, prefix: str = 'archery_'):
+        self.__enabled = enabled
+        self.__prefix = prefix
+        self.__metrics: Dict[str, object] = {}
+        self.__lock = threading.Lock()
+        self.__noop = nullcontext()
+        self.__server = None
+
+    def enable(self, enabled: bool = True):
+        self.__enabled = enabled
+
+    def isEnabled(self) -> bool:
+        return self.__enabled
+
+    def __getMetric(self, name: str, metricClass, *args):
+        name = self.__prefix+name
+        metric = self.__metrics.get(name)
+        if metric is None:
+            with self.__lock:
+                metric = self.__metrics.setdefault(name, metricClass(name, *args))
+        return metric
+
+    def counter(self, name: str, help: str = '') -> Counter:
+        return self.__getMetric(name, Counter, help)
+
+    def gauge(self, name: str, help: str = '') -> Gauge:
+        return self.__getMetric(name, Gauge, help)
+
+    def histogram(self, name: str, help: str = '', buckets: Tuple[float] = LatencyBuckets) -> Histogram:
+        return self.__getMetric(name, Histogram, help, buckets)
+
+    def get(self, name: str):
+        return self.__metrics.get(self.__prefix+name)
+
+    def getHistograms(self) -> Dict[str, Histogram]:
+        # histograms by name without prefix
+        return {name[len(self.__prefix):]: metric for name, metric in list(self.__metrics.items()) if isinstance(metric, Histogram)}
+
+    # recording helpers do nothing when registry is disabled
+    def timed(self, name: str, help: str = ''):
+        if not self.__enabled:
+            return self.__noop
+        return Timer(self.histogram(name, help))
+
+    def inc(self, name: str, value: float = 1, help: str = ''):
+        if self.__enabled:
+            self.counter(name, help).inc(value)
+
+    def setGauge(self, name: str, value: float, help: str = ''):
+        if self.__enabled:
+            self.gauge(name, help).set(value)
+
+    def observe(self, name: str, value: float, help: str = ''):
+        if self.__enabled:
+            self.histogram(name, help).observe(value)
+
+    def exportText(self) -> str:
+        lines = []
+        for name in sorted(self.__metrics):
+            lines += self.__metrics[name].exportText()
+        return '\n'.join(lines)+'\n'
+
+    def writeText(self, path: str):
+        with open(path, 'w') as file:
+            file.write(self.exportText())
+
+    def serve(self, port: int = 9100, host: str = '127.0.0.1'):
+        # text export over http on a daemon thread, any path returns all metrics
+        registry = self
+
+        class MetricsHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                body = registry.exportText().encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.__server = ThreadingHTTPServer((host, port), MetricsHandler)
+        threading.Thread(target=self.__server.serve_forever, daemon=True).start()
+        return self.__server
+
+    def stopServing(self):
+        if self.__server is not None:
+            self.__server.shutdown()
+            self.__server.server_close()
+            self.__server = None
+
+
+# registry used by the model and the gui, disabled by default
+defaultRegistry = MetricsRegistry()
+
+
+def timed(name: str, help: str = ''):
+    return defaultRegistry.timed(name, help)
+
+
+def drawMetricsOverlay(image: np.ndarray, lines: List[str], origin: Tuple[int, int] = (10, 10)) -> np.ndarray:
+    # text lines in top left corner on dark background
+    scale = max(image.shape[0]/720, 0.4)
+    height = int(22*scale)
+    x, y = origin
+    width = int(max((len(line) for line in lines), default=0)*11*scale)
+    cv2.rectangle(image, (x, y), (x+width, y+height*len(lines)+int(6*scale)), (0, 0, 0), -1)
+    for k, line in enumerate(lines):
+        cv2.putText(image, line, (x+int(5*scale), y+height*(k+1)), cv2.FONT_HERSHEY_SIMPLEX, 0.55*scale, (255, 255, 255), 1, cv2.LINE_AA)
+    return image
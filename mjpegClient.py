@@ -0,0 +1,421 @@
+import argparse
+import asyncio
+import os
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from time import monotonic, perf_counter, sleep
+from typing import List, Tuple
+from urllib.parse import urlsplit
+
+import cv2
+import numpy as np
+
+from cameraConnection import ConnectionStatus, FileFrameSource
+from metrics import defaultRegistry
+
+
+class MjpegReader():
+    # multipart MJPEG stream (DroidCam /video) read by asyncio on its own thread, frame boundaries are parsed here,
+    # only JPEG bytes of the newest frames are kept and a frame is decoded when a consumer takes it,
+    # lost connection is retried with exponential backoff, interface is the same as CameraReader
+
+    def __init__(self, url: str, bufferSize: int = 4, connectTimeout: float = 5.0, readTimeout: float = 5.0,\
+                 backoff: float = 0.5, maxBackoff: float = 8.0, maxReconnects: int = None):
+        parts = urlsplit(url)
+        self.__host = parts.hostname
+        self.__port = parts.port or 80
+        self.__path = (parts.path or '/')+('?'+parts.query if parts.query else '')
+
+        self.__bufferSize = max(bufferSize, 1)
+        self.__connectTimeout = connectTimeout
+        self.__readTimeout = readTimeout
+        self.__backoff = backoff
+        self.__maxBackoff = maxBackoff
+        self.__maxReconnects = maxReconnects
+
+        # ring of encoded frames, newest decoded frame is cached for repeated reads
+        self.__jpegs = [None]*self.__bufferSize
+        self.__timestamps = np.zeros(self.__bufferSize, dtype=np.float64)
+        self.__decodedNumber = 0
+        self.__decodedFrame = None
+
+        self.__captured = 0
+        self.__consumed = 0
+        self.__dropped = 0
+        self.__decoded = 0
+        self.__decodeErrors = 0
+        self.__decodeSeconds = 0.0
+        self.__bytes = 0
+        self.__reconnects = 0
+        self.__failures = 0
+
+        self.__status = ConnectionStatus.OK
+        self.__running = False
+        self.__thread = None
+        self.__loop = None
+        self.__task = None
+        self.__condition = threading.Condition()
+
+    def start(self):
+        if self.__thread is None:
+            self.__running = True
+            self.__thread = threading.Thread(target=asyncio.run, args=(self.__readLoop(),), daemon=True)
+            self.__thread.start()
+        return self
+
+    def stop(self):
+        self.__running = False
+        loop, task = self.__loop, self.__task
+        if loop is not None and task is not None:
+            try:
+                loop.call_soon_threadsafe(task.cancel)
+            except RuntimeError:
+                # loop already finished
+                pass
+        if self.__thread is not None:
+            self.__thread.join(timeout=2)
+            self.__thread = None
+
+    def release(self):
+        self.stop()
+
+    async def __readLoop(self):
+        self.__loop = asyncio.get_running_loop()
+        self.__task = asyncio.current_task()
+        try:
+            while self.__running:
+                try:
+                    await self.__readStream()
+                except (OSError, EOFError, ValueError, asyncio.TimeoutError, asyncio.IncompleteReadError,\
+                        asyncio.LimitOverrunError):
+                    pass
+                if not self.__running:
+                    break
+
+                # failures since the last received frame set the wait, reconnects stop after maxReconnects of them
+                if self.__maxReconnects is not None and self.__failures >= self.__maxReconnects:
+                    break
+                wait = min(self.__backoff*2**self.__failures, self.__maxBackoff)
+                self.__failures += 1
+                self.__reconnects += 1
+                defaultRegistry.inc('camera_reconnects_total', help='reconnects of MJPEG stream')
+                await asyncio.sleep(wait)
+        except asyncio.CancelledError:
+            pass
+        finally:
+            with self.__condition:
+                # stream given up, not stopped by consumer
+                if self.__running:
+                    self.__status = ConnectionStatus.ERROR
+                self.__running = False
+                self.__condition.notify_all()
+
+    async def __readStream(self):
+        # frames are large, stream buffer limit has to hold one whole JPEG when part has no Content-Length
+        reader, writer = await asyncio.wait_for(asyncio.open_connection(self.__host, self.__port, limit=2**24),\
+                                                self.__connectTimeout)
+        try:
+            request = "GET "+self.__path+" HTTP/1.1\r\nHost: "+self.__host+":"+str(self.__port)+"\r\nConnection: close\r\n\r\n"
+            writer.write(request.encode())
+            await writer.drain()
+
+            statusLine, headers = await self.__readHeaders(reader)
+            if len(statusLine.split()) < 2 or statusLine.split()[1] != b'200':
+                raise ValueError('MJPEG stream answered '+statusLine.decode(errors='replace'))
+            boundary = self.__getBoundary(headers.get('content-type', ''))
+
+            # boundary line of the next part is already consumed when part body was read up to it
+            atPart = False
+            while self.__running:
+                if not atPart:
+                    await asyncio.wait_for(reader.readuntil(boundary), self.__readTimeout)
+                ending = await asyncio.wait_for(reader.readexactly(2), self.__readTimeout)
+                if ending == b'--':
+                    return
+
+                _, partHeaders = await self.__readHeaders(reader, ending)
+                length = partHeaders.get('content-length')
+                if length is not None:
+                    data = await asyncio.wait_for(reader.readexactly(int(length)), self.__readTimeout)
+                    atPart = False
+                else:
+                    try:
+                        data = await asyncio.wait_for(reader.readuntil(b'\r\n'+boundary), self.__readTimeout)
+                    except asyncio.IncompleteReadError as error:
+                        # stream closed without next boundary, last part is kept when its JPEG is complete
+                        data = error.partial.rstrip(b'\r\n')
+                        if data.endswith(b'\xff\xd9'):
+                            self.__pushJpeg(data)
+                        raise
+                    data = data[:-len(boundary)-2]
+                    atPart = True
+                self.__pushJpeg(data)
+        finally:
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except OSError:
+                pass
+
+    async def __readHeaders(self, reader: asyncio.StreamReader, prefix: bytes = b'') -> Tuple[bytes, dict]:
+        # first line and lower case header fields up to the empty line, prefix is already read start of the block
+        block = prefix+await asyncio.wait_for(reader.readuntil(b'\r\n\r\n'), self.__readTimeout)
+        lines = block.strip(b'\r\n').split(b'\r\n')
+        headers = {}
+        for line in lines[1:] if b':' not in lines[0] else lines:
+            name, _, value = line.partition(b':')
+            headers[name.strip().lower().decode(errors='replace')] = value.strip().decode(errors='replace')
+        return lines[0], headers
+
+    def __getBoundary(self, contentType: str) -> bytes:
+        for param in contentType.split(';')[1:]:
+            name, _, value = param.strip().partition('=')
+            if name.lower() == 'boundary':
+                value = value.strip('"')
+                return (value if value.startswith('--') else '--'+value).encode()
+        raise ValueError('stream is not multipart: '+contentType)
+
+    def __pushJpeg(self, data: bytes):
+        timestamp = monotonic()
+        with self.__condition:
+            slot = self.__captured % self.__bufferSize
+            self.__jpegs[slot] = data
+            self.__timestamps[slot] = timestamp
+            self.__captured += 1
+            self.__bytes += len(data)
+            self.__failures = 0
+            self.__condition.notify_all()
+        defaultRegistry.inc('camera_frames_total', help='frames captured from camera')
+        defaultRegistry.inc('camera_bytes_total', len(data), help='bytes of JPEG frames received')
+
+    def __decode(self, number: int, data: bytes) -> np.ndarray:
+        # the same frame asked for again is not decoded twice
+        if number == self.__decodedNumber:
+            return self.__decodedFrame.copy()
+
+        start = perf_counter()
+        frame = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_COLOR)
+        elapsed = perf_counter()-start
+        defaultRegistry.observe('camera_decode_seconds', elapsed, 'JPEG decode of a consumed frame')
+
+        with self.__condition:
+            self.__decodeSeconds += elapsed
+            if frame is None:
+                self.__decodeErrors += 1
+                return None
+            self.__decoded += 1
+            if number > self.__decodedNumber:
+                self.__decodedNumber = number
+                self.__decodedFrame = frame
+        return frame.copy() if number == self.__decodedNumber else frame
+
+    def waitForNewFrame(self, timeout: float = 5.0) -> bool:
+        # blocks until a frame newer than the last consumed one arrived or the stream was given up
+        with self.__condition:
+            self.__condition.wait_for(lambda: self.__captured > self.__consumed or self.__status == ConnectionStatus.ERROR, timeout)
+            return self.__captured > self.__consumed
+
+    def hasNewFrame(self) -> bool:
+        return self.__captured > self.__consumed
+
+    def getFrameNumber(self) -> int:
+        # number of the newest frame, frames are numbered from 1
+        return self.__captured
+
+    def read(self) -> Tuple[bool, np.ndarray]:
+        # blocking cv2.VideoCapture style read of the next frame, so the stream can also be passed to captureVideo
+        if not self.waitForNewFrame(self.__readTimeout):
+            return False, None
+        frame, _, status = self.getLatestFrameWithTimestamp()
+        return status == ConnectionStatus.OK, frame
+
+    def getLatestFrame(self) -> Tuple[np.ndarray, ConnectionStatus]:
+        # non-blocking, returns the newest frame (same contract as captureVideo)
+        frame, _, status = self.getLatestFrameWithTimestamp()
+        return frame, status
+
+    def getLatestFrameWithTimestamp(self) -> Tuple[np.ndarray, float, ConnectionStatus]:
+        with self.__condition:
+            if self.__captured == 0:
+                return (np.array([[0]]), 0.0, ConnectionStatus.ERROR)
+
+            number = self.__captured
+            slot = (number-1) % self.__bufferSize
+            data = self.__jpegs[slot]
+            timestamp = self.__timestamps[slot]
+
+            # every frame received after the last consumed one, except the newest, is never decoded
+            if number > self.__consumed:
+                dropped = max(number - self.__consumed - 1, 0)
+                self.__dropped += dropped
+                self.__consumed = number
+                defaultRegistry.inc('camera_frames_dropped_total', dropped, 'frames overwritten before processing')
+            status = self.__status
+
+        frame = self.__decode(number, data)
+        if frame is None:
+            return (np.array([[0]]), timestamp, ConnectionStatus.ERROR)
+        return (frame, timestamp, status)
+
+    def getRecentFrames(self, count: int) -> List[Tuple[np.ndarray, float]]:
+        # up to count newest frames with their capture timestamps, oldest first
+        with self.__condition:
+            count = min(count, self.__bufferSize, self.__captured)
+            encoded = [(k+1, self.__jpegs[k % self.__bufferSize], self.__timestamps[k % self.__bufferSize])
+                       for k in range(self.__captured-count, self.__captured)]
+        frames = []
+        for number, data, timestamp in encoded:
+            frame = self.__decode(number, data)
+            if frame is not None:
+                frames.append((frame, timestamp))
+        return frames
+
+    def getStatus(self) -> ConnectionStatus:
+        return self.__status
+
+    def getStats(self):
+        with self.__condition:
+            return {'captured': self.__captured, 'consumed': self.__consumed, 'dropped': self.__dropped,
+                    'decoded': self.__decoded, 'decodeErrors': self.__decodeErrors, 'decodeSeconds': self.__decodeSeconds,
+                    'bytes': self.__bytes, 'reconnects': self.__reconnects}
+
+
+def loadJpegFrames(path: str, quality: int = 90) -> List[bytes]:
+    # JPEG files of a directory as they are, frames of a video (or other images) encoded
+    if os.path.isdir(path):
+        names = sorted(name for name in os.listdir(path) if name.lower().endswith(('.jpg', '.jpeg')))
+        if names:
+            frames = []
+            for name in names:
+                with open(os.path.join(path, name), 'rb') as file:
+                    frames.append(file.read())
+            return frames
+
+    source = FileFrameSource(path, fps=0)
+    frames = []
+    while True:
+        ret, frame = source.read()
+        if not ret:
+            break
+        frames.append(cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, quality])[1].tobytes())
+    source.release()
+    return frames
+
+
+class MjpegServer():
+    # local stand-in for DroidCam serving recorded JPEGs in a loop as multipart stream on any path,
+    # dropAfter closes every connection after that many frames to exercise reconnects
+
+    def __init__(self, frames: List[bytes], fps: float = 30, port: int = 0, host: str = '127.0.0.1',\
+                 boundary: str = 'frame', contentLength: bool = True, dropAfter: int = None):
+        if not frames:
+            raise ValueError('no frames to serve')
+        server = self
+
+        class MjpegHandler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.0'
+
+            def do_GET(self):
+                self.send_response(200)
+                self.send_header('Content-Type', 'multipart/x-mixed-replace; boundary='+boundary)
+                self.send_header('Cache-Control', 'no-cache')
+                self.end_headers()
+                server.streamFrames(self.wfile)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.__frames = frames
+        self.__interval = 1/fps if fps > 0 else 0
+        self.__boundary = boundary.encode()
+        self.__contentLength = contentLength
+        self.__dropAfter = dropAfter
+        self.__running = True
+        self.__server = ThreadingHTTPServer((host, port), MjpegHandler)
+        self.__server.daemon_threads = True
+        threading.Thread(target=self.__server.serve_forever, daemon=True).start()
+
+    def streamFrames(self, out):
+        sent = 0
+        nextTime = monotonic()
+        try:
+            while self.__running and (self.__dropAfter is None or sent < self.__dropAfter):
+                data = self.__frames[sent % len(self.__frames)]
+                header = b'--'+self.__boundary+b'\r\nContent-Type: image/jpeg\r\n'
+                if self.__contentLength:
+                    header += b'Content-Length: '+str(len(data)).encode()+b'\r\n'
+                out.write(header+b'\r\n'+data+b'\r\n')
+                out.flush()
+                sent += 1
+
+                nextTime += self.__interval
+                if nextTime > monotonic():
+                    sleep(nextTime-monotonic())
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+    def getPort(self) -> int:
+        return self.__server.server_address[1]
+
+    def getUrl(self) -> str:
+        host, port = self.__server.server_address[:2]
+        return "http://"+host+":"+str(port)+"/video"
+
+    def stop(self):
+        self.__running = False
+        self.__server.shutdown()
+        self.__server.server_close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='MJPEG stream client and local stand-in server')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    serveParser = subparsers.add_parser('serve', help='serve recorded footage like DroidCam')
+    serveParser.add_argument('source', help='video file or directory of frames')
+    serveParser.add_argument('--port', type=int, default=4747)
+    serveParser.add_argument('--fps', type=float, default=30)
+    serveParser.add_argument('--drop-after', type=int, help='close connection after that many frames')
+    serveParser.add_argument('--no-length', action='store_true', help='parts without Content-Length header')
+
+    readParser = subparsers.add_parser('read', help='read a stream at scheduler rate and print stats')
+    readParser.add_argument('url', nargs='?', help='stream url, a local server with --source is started when omitted')
+    readParser.add_argument('--source', help='video file or directory of frames for local server')
+    readParser.add_argument('--fps', type=float, default=30, help='fps of local server')
+    readParser.add_argument('--rate', type=float, default=10, help='frames taken per second')
+    readParser.add_argument('--seconds', type=float, default=5)
+    readParser.add_argument('--drop-after', type=int, help='local server closes connection after that many frames')
+    args = parser.parse_args()
+
+    if args.command == 'serve':
+        server = MjpegServer(loadJpegFrames(args.source), args.fps, args.port, contentLength=not args.no_length,\
+                             dropAfter=args.drop_after)
+        print("serving "+server.getUrl())
+        try:
+            while True:
+                sleep(1)
+        except KeyboardInterrupt:
+            server.stop()
+
+    if args.command == 'read':
+        server = None
+        url = args.url
+        if url is None:
+            server = MjpegServer(loadJpegFrames(args.source), args.fps, dropAfter=args.drop_after)
+            url = server.getUrl()
+
+        reader = MjpegReader(url).start()
+        reader.waitForNewFrame()
+        end = monotonic()+args.seconds
+        while monotonic() < end:
+            frame, status = reader.getLatestFrame()
+            sleep(1/args.rate)
+        stats = reader.getStats()
+        reader.release()
+        if server is not None:
+            server.stop()
+
+        for key, value in stats.items():
+            print(f"{key:<15}{value}")
+        if stats['decoded']:
+            print(f"{'decodeMs':<15}{1000*stats['decodeSeconds']/stats['decoded']:.2f}")
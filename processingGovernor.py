@@ -0,0 +1,110 @@
+import re
+from enum import Enum
+from math import ceil
+from typing import Dict, FrozenSet, Tuple
+
+from game import GameState
+from metrics import defaultRegistry
+
+
+class ProcessingStage(Enum):
+    PREVIEW = 0     # display image, camera view or transformed target while scoring
+    DRIFT = 1       # camera drift tracking
+    HISTORY = 2     # transformed target images pushed to frame history
+    HIT = 3         # hit detection on frame history
+
+
+# stages and frame stride of every game state, during BREAK people walk to the target so only preview is shown,
+# READY_GO fills frame history so first hit of ROUND can be found, GAME_OVER only keeps the view alive
+DefaultPolicy = {
+    GameState.BREAK: (frozenset({ProcessingStage.PREVIEW}), 3),
+    GameState.READY_GO: (frozenset({ProcessingStage.PREVIEW, ProcessingStage.DRIFT, ProcessingStage.HISTORY}), 1),
+    GameState.ROUND: (frozenset(ProcessingStage), 1),
+    GameState.GAME_OVER: (frozenset({ProcessingStage.PREVIEW}), 5),
+}
+
+
+class ProcessingGovernor():
+    # decides for one lane which stages run and which camera frames are processed,
+    # stride of the game state is raised when measured processing time of a frame (EWMA) is longer than
+    # stride frames take to arrive, share is the part of one worker the lane can count on
+
+    def __init__(self, name: str, policy: Dict[GameState, Tuple[FrozenSet[ProcessingStage], int]] = None,\
+                 maxStride: int = 8, smoothing: float = 0.2, headroom: float = 0.9):
+        self.__policy = dict(DefaultPolicy)
+        if policy is not None:
+            self.__policy.update(policy)
+        self.__maxStride = maxStride
+        self.__smoothing = smoothing
+        self.__headroom = headroom
+        self.__share = 1.0
+
+        # EWMA of processing time of a frame and of time between camera frames
+        self.__cost = None
+        self.__interval = None
+        self.__adaptiveStride = 1
+
+        self.__lastNumber = 0
+        self.__lastTimestamp = None
+
+        # lane name in metric names, e.g. governor_stride_lane_1
+        self.__metricSuffix = re.sub(r'[^a-z0-9]+', '_', name.lower()).strip('_')
+
+    def setShare(self, share: float):
+        self.__share = min(max(share, 1e-3), 1.0)
+        self.__updateStride()
+
+    def getStages(self, gameState: GameState) -> FrozenSet[ProcessingStage]:
+        return self.__policy[gameState][0]
+
+    def getStride(self, gameState: GameState) -> int:
+        return min(max(self.__policy[gameState][1], self.__adaptiveStride), self.__maxStride)
+
+    def getCost(self) -> float:
+        return self.__cost
+
+    def getInterval(self) -> float:
+        return self.__interval
+
+    def isDue(self, gameState: GameState, frameNumber: int) -> bool:
+        # frames between two processed ones are skipped and never handed out by the camera reader
+        return frameNumber - self.__lastNumber >= self.getStride(gameState)
+
+    def update(self, gameState: GameState, frameNumber: int, timestamp: float, seconds: float):
+        # processed frame with its capture timestamp and the time its processing took, decisions go to metrics
+        if self.__lastTimestamp is not None and frameNumber > self.__lastNumber:
+            interval = (timestamp - self.__lastTimestamp)/(frameNumber - self.__lastNumber)
+            self.__interval = self.__smooth(self.__interval, interval)
+        skipped = max(frameNumber - self.__lastNumber - 1, 0) if self.__lastTimestamp is not None else 0
+        self.__lastNumber = frameNumber
+        self.__lastTimestamp = timestamp
+        self.__cost = self.__smooth(self.__cost, seconds)
+        self.__updateStride()
+
+        if skipped:
+            defaultRegistry.inc('governor_skipped_frames_total', skipped, 'camera frames between two processed frames of a lane')
+        defaultRegistry.setGauge('governor_frame_cost_seconds_'+self.__metricSuffix, self.__cost,\
+                                 'smoothed processing time of a frame')
+        defaultRegistry.setGauge('governor_stride_'+self.__metricSuffix, self.getStride(gameState),\
+                                 'every stride-th camera frame is processed')
+        defaultRegistry.setGauge('governor_stages_'+self.__metricSuffix, len(self.getStages(gameState)),\
+                                 'pipeline stages run in current game state')
+
+    def reset(self):
+        # new camera stream, frame numbers and timing start over
+        self.__lastNumber = 0
+        self.__lastTimestamp = None
+        self.__interval = None
+        self.__cost = None
+        self.__updateStride()
+
+    def __smooth(self, smoothed: float, value: float) -> float:
+        return value if smoothed is None else smoothed + self.__smoothing*(value - smoothed)
+
+    def __updateStride(self):
+        # stride frames have to arrive in at least the time the lane needs for one of them
+        if self.__cost is None or not self.__interval:
+            self.__adaptiveStride = 1
+        else:
+            budget = self.__interval*self.__share*self.__headroom
+            self.__adaptiveStride = min(max(ceil(self.__cost/budget), 1), self.__maxStride)
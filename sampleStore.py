@@ -0,0 +1,273 @@
+import argparse
+import hashlib
+import os
+from typing import Tuple
+
+import numpy as np
+import pandas as pd
+from openpyxl import Workbook, load_workbook
+
+
+# one labelled sample: diff features of the frame pair without arrow (noHit) and of the pair with the new arrow (hit),
+# (std, max, number of changed pixels) and diff histograms of both pairs
+SampleDtype = np.dtype([('noHitStd', np.float64), ('noHitMax', np.float64), ('noHitSum', np.int64),
+                        ('hitStd', np.float64), ('hitMax', np.float64), ('hitSum', np.int64),
+                        ('noArrowHistogram', np.int64, 256), ('arrowHistogram', np.int64, 256)])
+
+DataColumns = ['noHitStd', 'noHitMax', 'noHitSum', 'hitStd', 'hitMax', 'hitSum']
+
+# header holds record size, a store written with other record layout is refused, and the xlsx source the store
+# was built from: its signature, hash and number of samples taken from it, samples after them are not in the xlsx yet
+StoreMagic = b'HITSMPL2'
+HeaderDtype = np.dtype([('magic', 'S8'), ('itemSize', '<i8'), ('sourceSize', '<i8'), ('sourceMtime', '<i8'),
+                        ('sourceCount', '<i8'), ('sourceHash', 'S64')])
+HeaderSize = 128
+
+
+class SampleStore():
+    # append-only file of fixed size records behind a header, samples are appended with one write
+    # and read in one read, torn record at the end (crashed write) is ignored and overwritten
+
+    def __init__(self, path: str):
+        self.__path = path
+
+    def getPath(self) -> str:
+        return self.__path
+
+    def exists(self) -> bool:
+        return os.path.exists(self.__path)
+
+    def getCount(self) -> int:
+        if not self.exists():
+            return 0
+        return max(os.path.getsize(self.__path)-HeaderSize, 0)//SampleDtype.itemsize
+
+    def __readHeader(self, file) -> np.ndarray:
+        file.seek(0)
+        data = file.read(HeaderSize)
+        if len(data) < HeaderDtype.itemsize:
+            raise ValueError('not a sample store: '+self.__path)
+        header = np.frombuffer(data[:HeaderDtype.itemsize], dtype=HeaderDtype)[0]
+        if header['magic'] != StoreMagic or int(header['itemSize']) != SampleDtype.itemsize:
+            raise ValueError('not a sample store: '+self.__path)
+        return header
+
+    def __writeHeader(self, file, source: Tuple[int, int, str, int]):
+        header = np.zeros(1, dtype=HeaderDtype)
+        header['magic'] = StoreMagic
+        header['itemSize'] = SampleDtype.itemsize
+        header['sourceSize'], header['sourceMtime'], header['sourceHash'], header['sourceCount'] = source
+        file.seek(0)
+        file.write(header.tobytes().ljust(HeaderSize, b'\0'))
+
+    def getSource(self) -> Tuple[int, int, str, int]:
+        # (size, mtime, sha256 hash, sample count) of the xlsx the store was built from, hash is empty without one
+        with open(self.__path, 'rb') as file:
+            header = self.__readHeader(file)
+        return int(header['sourceSize']), int(header['sourceMtime']), header['sourceHash'].decode(),\
+            int(header['sourceCount'])
+
+    def setSource(self, source: Tuple[int, int, str, int]):
+        with open(self.__path, 'r+b') as file:
+            self.__readHeader(file)
+            self.__writeHeader(file, source)
+
+    def getPendingCount(self) -> int:
+        # samples appended since the store was built from or written to its xlsx
+        if not self.exists():
+            return 0
+        return self.getCount()-self.getSource()[3]
+
+    def append(self, sample: np.ndarray) -> int:
+        return self.extend(np.atleast_1d(sample))
+
+    def extend(self, samples: np.ndarray) -> int:
+        # batch of samples in one write, returns number of samples in the store
+        samples = np.ascontiguousarray(samples, dtype=SampleDtype)
+        if not self.exists():
+            with open(self.__path, 'wb') as file:
+                self.__writeHeader(file, (0, 0, '', 0))
+
+        with open(self.__path, 'r+b') as file:
+            self.__readHeader(file)
+            count = self.getCount()
+            file.seek(HeaderSize+count*SampleDtype.itemsize)
+            file.write(samples.tobytes())
+            file.truncate()
+        return count+len(samples)
+
+    def read(self) -> np.ndarray:
+        # all samples, columns are taken by name, e.g. read()['hitStd'], no memory map is kept open,
+        # so the store can be replaced by syncStore (Windows refuses to replace a mapped file)
+        count = self.getCount()
+        if count == 0:
+            return np.empty(0, dtype=SampleDtype)
+        with open(self.__path, 'rb') as file:
+            self.__readHeader(file)
+            file.seek(HeaderSize)
+            return np.fromfile(file, dtype=SampleDtype, count=count)
+
+
+def makeSample(noHitFeatures: Tuple[float, float, int], hitFeatures: Tuple[float, float, int],\
+               noArrowHistogram: np.ndarray, arrowHistogram: np.ndarray) -> np.ndarray:
+    sample = np.zeros(1, dtype=SampleDtype)
+    sample['noHitStd'], sample['noHitMax'], sample['noHitSum'] = noHitFeatures
+    sample['hitStd'], sample['hitMax'], sample['hitSum'] = hitFeatures
+    sample['noArrowHistogram'] = noArrowHistogram[:256]
+    sample['arrowHistogram'] = arrowHistogram[:256]
+    return sample
+
+
+def getXlsxSignature(xlsxPath: str) -> Tuple[int, int]:
+    stat = os.stat(xlsxPath)
+    return stat.st_size, stat.st_mtime_ns
+
+
+def getXlsxHash(xlsxPath: str) -> str:
+    with open(xlsxPath, 'rb') as file:
+        return hashlib.sha256(file.read()).hexdigest()
+
+
+def readXlsx(xlsxPath: str) -> np.ndarray:
+    # row i of Data sheet and column i of both histogram sheets are one sample, missing values are zeros
+    data = pd.read_excel(xlsxPath, sheet_name='Data')
+    data = data[data[DataColumns[0]].notna()]
+    noArrow = pd.read_excel(xlsxPath, sheet_name='noArrowHistogramValues', header=None).fillna(0).to_numpy()
+    arrow = pd.read_excel(xlsxPath, sheet_name='arrowHistogramValues', header=None).fillna(0).to_numpy()
+
+    samples = np.zeros(len(data), dtype=SampleDtype)
+    for name in DataColumns:
+        samples[name] = data[name].fillna(0).to_numpy()
+    for name, histograms in (('noArrowHistogram', noArrow), ('arrowHistogram', arrow)):
+        count = min(histograms.shape[1], len(samples))
+        samples[name][:count, :histograms.shape[0]] = histograms[:256, :count].T
+    return samples
+
+
+def importXlsx(xlsxPath: str, store: SampleStore) -> int:
+    return store.extend(readXlsx(xlsxPath))
+
+
+def syncStore(xlsxPath: str, path: str) -> SampleStore:
+    # xlsx is the source of truth, the store is its binary copy plus samples labelled since the last flush,
+    # store is built again when the xlsx content changed, aside and moved in place,
+    # so vision worker processes calibrating at once don't disturb each other
+    store = SampleStore(path)
+    if not os.path.exists(xlsxPath):
+        return store
+
+    size, mtime = getXlsxSignature(xlsxPath)
+    source = None
+    if store.exists():
+        try:
+            source = store.getSource()
+        except ValueError:
+            source = None
+    if source is not None and source[:2] == (size, mtime):
+        return store
+
+    digest = getXlsxHash(xlsxPath)
+    if source is not None and source[2] == digest:
+        # xlsx was only touched, new signature saves hashing next time
+        store.setSource((size, mtime, digest, source[3]))
+        return store
+
+    pending = store.read()[source[3]:] if source is not None else np.empty(0, dtype=SampleDtype)
+    samples = readXlsx(xlsxPath)
+    tmpPath = path+'.'+str(os.getpid())+'.tmp'
+    if os.path.exists(tmpPath):
+        os.remove(tmpPath)
+    tmpStore = SampleStore(tmpPath)
+    tmpStore.extend(np.concatenate([samples, pending]))
+    tmpStore.setSource((size, mtime, digest, len(samples)))
+    os.replace(tmpPath, path)
+    return store
+
+
+def flushToXlsx(store: SampleStore, xlsxPath: str) -> int:
+    # samples not yet in the xlsx are appended to it in one save, returns number of written samples
+    if not os.path.exists(xlsxPath):
+        exportXlsx(store, xlsxPath)
+        count = store.getCount()
+    else:
+        count = store.getPendingCount()
+        if count == 0:
+            return 0
+        pending = store.read()[-count:]
+
+        workbook = load_workbook(xlsxPath)
+        dataSheet = workbook['Data']
+        # new rows and columns follow the last filled ones, like samples written one by one before
+        lastRow = max((cell.row for cell in dataSheet['A'] if cell.value is not None), default=1)
+        for i, sample in enumerate(pending):
+            for col, name in enumerate(DataColumns):
+                dataSheet.cell(row=lastRow+1+i, column=col+1, value=sample[name].item())
+
+        for title, name in (('noArrowHistogramValues', 'noArrowHistogram'), ('arrowHistogramValues', 'arrowHistogram')):
+            sheet = workbook[title]
+            lastCol = max((cell.column for cell in sheet[1] if cell.value is not None), default=0)
+            for i, sample in enumerate(pending):
+                for row, value in enumerate(sample[name].tolist()):
+                    sheet.cell(row=row+1, column=lastCol+1+i, value=value)
+        workbook.save(xlsxPath)
+
+    store.setSource(getXlsxSignature(xlsxPath)+(getXlsxHash(xlsxPath), store.getCount()))
+    return count
+
+
+def exportXlsx(store: SampleStore, xlsxPath: str):
+    # layout of hitDetectionData.xlsx: Data sheet with header row, histogram sheets with one sample per column
+    samples = store.read()
+    workbook = Workbook(write_only=True)
+
+    dataSheet = workbook.create_sheet('Data')
+    dataSheet.append(DataColumns+['noHitCenter', 'HitCenter'])
+    for sample in samples:
+        dataSheet.append([sample[name].item() for name in DataColumns])
+
+    for title, name in (('noArrowHistogramValues', 'noArrowHistogram'), ('arrowHistogramValues', 'arrowHistogram')):
+        sheet = workbook.create_sheet(title)
+        for row in np.asarray(samples[name]).T.tolist():
+            sheet.append(row)
+    workbook.save(xlsxPath)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Hit detection sample store and its xlsx exchange format')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    importParser = subparsers.add_parser('import', help='append samples of xlsx to store')
+    importParser.add_argument('xlsx')
+    importParser.add_argument('store')
+
+    exportParser = subparsers.add_parser('export', help='write all samples of store to xlsx')
+    exportParser.add_argument('store')
+    exportParser.add_argument('xlsx')
+
+    flushParser = subparsers.add_parser('flush', help='append samples not yet in xlsx to it')
+    flushParser.add_argument('store')
+    flushParser.add_argument('xlsx')
+
+    infoParser = subparsers.add_parser('info', help='number of samples and feature ranges')
+    infoParser.add_argument('store')
+    args = parser.parse_args()
+
+    if args.command == 'import':
+        count = importXlsx(args.xlsx, SampleStore(args.store))
+        print(f"{args.store}: {count} samples")
+
+    if args.command == 'export':
+        exportXlsx(SampleStore(args.store), args.xlsx)
+        print(f"{args.xlsx}: {SampleStore(args.store).getCount()} samples")
+
+    if args.command == 'flush':
+        count = flushToXlsx(SampleStore(args.store), args.xlsx)
+        print(f"{args.xlsx}: {count} samples written")
+
+    if args.command == 'info':
+        store = SampleStore(args.store)
+        samples = store.read()
+        print(f"{args.store}: {len(samples)} samples, {store.getPendingCount()} not in xlsx")
+        for name in DataColumns:
+            if len(samples):
+                print(f"{name:<10}{samples[name].min():>12.3f}{samples[name].max():>12.3f}")
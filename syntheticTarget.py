@@ -0,0 +1,268 @@
+import cv2
+import numpy as np
+import argparse
+import json
+import os
+from math import sin, cos, pi, sqrt
+from time import perf_counter
+from typing import Tuple, List
+
+from game import TargetType, scoreDistance
+from targetDetection import targetDetection
+from ArcheryTargetModel import ArcheryTargetModel
+from frameHistory import FrameHistory
+
+# synthetic footage with known ground truth: procedurally drawn target face seen by a tilted camera,
+# arrows arrive at known positions and times, positions are given on target plane relative to its radius
+
+# ring colours in BGR
+White = (255, 255, 255)
+Black = (20, 20, 20)
+Blue = (227, 178, 0)
+Red = (90, 80, 245)
+Gold = (80, 229, 255)
+
+# colour of every scoring zone from outer to inner and number of zones of the face
+TargetZones = {TargetType.REGULAR_1_10: [White, White, Black, Black, Blue, Blue, Red, Red, Gold, Gold],
+               TargetType.REGULAR_5_10: [Blue, Blue, Red, Red, Gold, Gold],
+               TargetType.REGULAR_6_10: [Blue, Red, Red, Gold, Gold]}
+
+
+class Arrow():
+    def __init__(self, time: float, x: float, y: float, length: float = 1.2):
+        self.time = time
+        self.x = x
+        self.y = y
+        self.length = length
+
+    def getDistance(self) -> float:
+        return sqrt(self.x**2+self.y**2)
+
+
+def drawTargetFace(targetType: TargetType, size: int) -> np.ndarray:
+    # square BGRA image of the face, transparent outside the outer ring
+    face = np.zeros((size, size, 4), dtype=np.uint8)
+    zones = TargetZones[targetType]
+    centre = (size//2, size//2)
+    radius = size/2-1
+
+    for k, colour in enumerate(zones):
+        r = int(radius*(len(zones)-k)/len(zones)+0.5)
+        cv2.circle(face, centre, r, colour+(255,), -1, cv2.LINE_AA)
+        lineColour = White if colour == Black else Black
+        cv2.circle(face, centre, r, lineColour+(255,), max(size//500, 1), cv2.LINE_AA)
+
+    # inner ten
+    cv2.circle(face, centre, int(radius/(2*len(zones))+0.5), Black+(255,), max(size//500, 1), cv2.LINE_AA)
+    return face
+
+
+class SyntheticCamera():
+    # pinhole camera looking at target plane, target radius is 1 in plane units
+    # hit placement scores the right end of the arrow line in the target image, so by default the camera sees
+    # shafts going to the left of the tip there, e.g. yaw 25, pitch 10 turns the target image by the ellipse angle
+    # (about 160 degrees) and the tail end is scored, with score error about 3-4 rings on every target type
+
+    def __init__(self, resolution: Tuple[int, int], targetScale: float = 0.15, yaw: float = -25, pitch: float = -10, roll: float = 0,\
+                 offset: Tuple[float, float] = (0, 0)):
+        self.resolution = resolution
+        width, height = resolution
+        self.__focal = 1.5*width
+        self.__distance = self.__focal/(targetScale*height)
+
+        a, b, c = yaw*pi/180, pitch*pi/180, roll*pi/180
+        rotY = np.array([[cos(a), 0, sin(a)], [0, 1, 0], [-sin(a), 0, cos(a)]])
+        rotX = np.array([[1, 0, 0], [0, cos(b), -sin(b)], [0, sin(b), cos(b)]])
+        rotZ = np.array([[cos(c), -sin(c), 0], [sin(c), cos(c), 0], [0, 0, 1]])
+        self.__rotation = rotZ @ rotX @ rotY
+        self.__translation = np.array([0, 0, self.__distance])
+        self.__intrinsic = np.array([[self.__focal, 0, width/2+offset[0]*width], [0, self.__focal, height/2+offset[1]*height], [0, 0, 1]])
+
+    def project(self, points: np.ndarray) -> np.ndarray:
+        # points of target space (x, y, z), z is positive towards the camera
+        points = np.asarray(points, dtype=np.float64).reshape(-1, 3)*np.array([1, 1, -1])
+        cam = points @ self.__rotation.T + self.__translation
+        pix = cam @ self.__intrinsic.T
+        return pix[:, :2]/pix[:, 2:3]
+
+    def getFaceHomography(self, faceSize: int) -> np.ndarray:
+        corners = np.float32([[0, 0], [faceSize, 0], [faceSize, faceSize], [0, faceSize]])
+        radius = faceSize/2-1
+        plane = np.array([[(u-faceSize/2)/radius, (v-faceSize/2)/radius, 0] for u, v in corners])
+        return cv2.getPerspectiveTransform(corners, self.project(plane).astype(np.float32))
+
+    def getTargetEllipse(self):
+        # image of the outer ring fitted as ellipse, same format as target detection result
+        angles = np.linspace(0, 2*pi, 90, endpoint=False)
+        circle = np.stack([np.cos(angles), np.sin(angles), np.zeros_like(angles)], axis=1)
+        return cv2.fitEllipse(self.project(circle).astype(np.float32))
+
+
+class SyntheticSession():
+    def __init__(self, targetType: TargetType, resolution: Tuple[int, int] = (1280, 720), fps: float = 30, duration: float = 10,\
+                 arrows: List[Arrow] = None, camera: SyntheticCamera = None, noise: float = 2.0, lighting: float = 0.3, seed: int = 0):
+        self.targetType = targetType
+        self.resolution = resolution
+        self.fps = fps
+        self.frameCount = int(duration*fps)
+        self.arrows = arrows if arrows is not None else getRandomArrows(duration, 3, seed)
+        self.camera = camera if camera is not None else SyntheticCamera(resolution)
+        self.__noise = noise
+        self.__seed = seed
+
+        width, height = resolution
+        faceSize = max(height//2, 256)
+        face = drawTargetFace(targetType, faceSize)
+        warped = cv2.warpPerspective(face, self.camera.getFaceHomography(faceSize), (width, height), flags=cv2.INTER_AREA)
+
+        # background with lighting gradient, face composed over it
+        xs = np.linspace(-1, 1, width, dtype=np.float32)[None, :, None]
+        ys = np.linspace(-1, 1, height, dtype=np.float32)[:, None, None]
+        self.__light = 1-lighting/2+lighting*(0.5+0.35*xs+0.15*ys)
+        background = np.full((height, width, 3), (110, 125, 120), dtype=np.float32)
+        alpha = warped[:, :, 3:4].astype(np.float32)/255
+        self.__still = alpha*warped[:, :, :3]+(1-alpha)*background
+
+    def getArrowFrame(self, arrow: Arrow) -> int:
+        return int(arrow.time*self.fps+0.5)
+
+    def renderFrame(self, frameIdx: int) -> np.ndarray:
+        # camera (BGR) frame with every arrow which already arrived
+        frame = self.__still.copy()
+        width = self.resolution[0]
+        for arrow in self.arrows:
+            if self.getArrowFrame(arrow) <= frameIdx:
+                tip, tail = self.camera.project([[arrow.x, arrow.y, 0], [arrow.x, arrow.y, arrow.length]])
+                thickness = max(int(width/400), 2)
+                cv2.line(frame, tuple(tip.astype(int)), tuple(tail.astype(int)), (40, 40, 40), thickness, cv2.LINE_AA)
+                nock = tip+0.9*(tail-tip)
+                cv2.line(frame, tuple(nock.astype(int)), tuple(tail.astype(int)), (40, 200, 40), 2*thickness, cv2.LINE_AA)
+
+        rng = np.random.default_rng(self.__seed+frameIdx)
+        frame = frame*self.__light+rng.normal(0, self.__noise, frame.shape).astype(np.float32)
+        return np.clip(frame, 0, 255).astype(np.uint8)
+
+    def frames(self):
+        for frameIdx in range(self.frameCount):
+            yield self.renderFrame(frameIdx)
+
+    def getGroundTruth(self) -> dict:
+        (xc, yc), (axmajor, axminor), angle = self.camera.getTargetEllipse()
+        return {'targetType': self.targetType.name,
+                'resolution': list(self.resolution),
+                'fps': self.fps,
+                'frames': self.frameCount,
+                'ellipse': [[float(xc), float(yc)], [float(axmajor), float(axminor)], float(angle)],
+                'arrows': [{'frame': self.getArrowFrame(arrow), 'time': arrow.time, 'x': arrow.x, 'y': arrow.y,
+                            'distance': arrow.getDistance(), 'score': int(scoreDistance(self.targetType, arrow.getDistance()))}
+                           for arrow in self.arrows]}
+
+
+def getRandomArrows(duration: float, count: int, seed: int = 0) -> List[Arrow]:
+    # arrows evenly spread in time, positions uniform over the face
+    rng = np.random.default_rng(seed)
+    arrows = []
+    for k in range(count):
+        r, phi = 0.9*sqrt(rng.uniform()), rng.uniform(0, 2*pi)
+        arrows.append(Arrow(duration*(k+1)/(count+1), r*cos(phi), r*sin(phi)))
+    return arrows
+
+
+def writeSession(session: SyntheticSession, path: str):
+    # video file or directory of png frames, ground truth goes to JSON sidecar
+    if os.path.splitext(path)[1] == '':
+        os.makedirs(path, exist_ok=True)
+        for frameIdx, frame in enumerate(session.frames()):
+            cv2.imwrite(os.path.join(path, f"frame_{frameIdx:06d}.png"), frame)
+        sidecar = os.path.join(path, 'groundTruth.json')
+    else:
+        writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*'MJPG'), session.fps, session.resolution)
+        for frame in session.frames():
+            writer.write(frame)
+        writer.release()
+        sidecar = os.path.splitext(path)[0]+'.json'
+
+    with open(sidecar, 'w') as file:
+        json.dump(session.getGroundTruth(), file, indent=2)
+    return sidecar
+
+
+def evaluateSession(session: SyntheticSession, pyramid: bool = True, frameWindow: int = 3, matchFrames: int = 5) -> dict:
+    # runs target detection and hit scoring on synthetic frames, measures latency and scoring error,
+    # frames are converted to RGB like camera frames in batchScoring and the GUI
+    truth = session.getGroundTruth()
+    model = ArcheryTargetModel(session.targetType, pyramid)
+
+    first = session.renderFrame(0)
+    start = perf_counter()
+    ell = model.detectTarget(cv2.cvtColor(first, cv2.COLOR_BGR2RGB))
+    detectionMs = 1000*(perf_counter()-start)
+    if ell is None:
+        return {'truth': truth, 'detectionMs': detectionMs, 'error': 'target not found'}
+
+    history = FrameHistory(frameWindow)
+    hits = []
+    frameTimes = []
+    for frameIdx, frame in enumerate(session.frames()):
+        start = perf_counter()
+        history.push(model.getTransformedImage(cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)))
+        dist = model.getHitInHistory(history)
+        frameTimes.append(1000*(perf_counter()-start))
+        if dist is not None:
+            hits.append({'frame': frameIdx, 'distance': float(dist), 'score': int(scoreDistance(session.targetType, dist)),
+                         'latencyMs': frameTimes[-1]})
+
+    # every arrow is matched with the first detection not later than matchFrames after its arrival
+    arrows = []
+    for arrow in truth['arrows']:
+        matched = next((hit for hit in hits if 0 <= hit['frame']-arrow['frame'] <= matchFrames), None)
+        arrows.append(dict(arrow, detected=matched))
+
+    detected = [arrow for arrow in arrows if arrow['detected'] is not None]
+    (xc, yc), _, _ = ell
+    return {'truth': truth,
+            'ellipse': [[float(v) for v in ell[0]], [float(v) for v in ell[1]], float(ell[2])],
+            'ellipseCenterError': float(np.hypot(xc-truth['ellipse'][0][0], yc-truth['ellipse'][0][1])),
+            'detectionMs': detectionMs,
+            'frameMsMedian': float(np.median(frameTimes)),
+            'frameMsMax': float(np.max(frameTimes)),
+            'arrows': arrows,
+            'falseHits': len(hits)-len(detected),
+            'detectionRate': len(detected)/len(arrows) if arrows else 1.0,
+            'meanScoreError': float(np.mean([abs(a['detected']['score']-a['score']) for a in detected])) if detected else None,
+            'meanDistanceError': float(np.mean([abs(a['detected']['distance']-a['distance']) for a in detected])) if detected else None}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Synthetic target and arrow impact footage')
+    parser.add_argument('command', choices=['generate', 'evaluate'])
+    parser.add_argument('--output', help='video file or frame directory (generate) or JSON report (evaluate)')
+    parser.add_argument('--target', default=TargetType.REGULAR_1_10.name, choices=[t.name for t in TargetType])
+    parser.add_argument('--resolution', default='1280x720')
+    parser.add_argument('--fps', type=float, default=30)
+    parser.add_argument('--duration', type=float, default=10)
+    parser.add_argument('--arrows', type=int, default=3)
+    parser.add_argument('--yaw', type=float, default=-25, help='camera tilt around vertical axis [deg]')
+    parser.add_argument('--pitch', type=float, default=-10, help='camera tilt around horizontal axis [deg]')
+    parser.add_argument('--noise', type=float, default=2.0, help='std of gaussian noise')
+    parser.add_argument('--lighting', type=float, default=0.3, help='strength of lighting gradient')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    width, height = (int(v) for v in args.resolution.lower().split('x'))
+    camera = SyntheticCamera((width, height), yaw=args.yaw, pitch=args.pitch)
+    session = SyntheticSession(TargetType[args.target], (width, height), args.fps, args.duration,
+                               getRandomArrows(args.duration, args.arrows, args.seed), camera, args.noise, args.lighting, args.seed)
+
+    if args.command == 'generate':
+        print(writeSession(session, args.output or 'synthetic.avi'))
+
+    if args.command == 'evaluate':
+        report = evaluateSession(session)
+        if args.output is not None:
+            with open(args.output, 'w') as file:
+                json.dump(report, file, indent=2)
+        for key in ['detectionMs', 'ellipseCenterError', 'frameMsMedian', 'frameMsMax', 'detectionRate', 'falseHits',
+                    'meanScoreError', 'meanDistanceError', 'error']:
+            if key in report:
+                print(f"{key:<20}{report[key]}")
@@ -1,12 +1,12 @@
 import numpy as np
 from typing import List, Tuple
 import cv2
-from math import inf, fabs
+from math import inf
 from statistics import mean
 from enum import Enum
 from game import TargetType
 
-from imageProcessing import getContours, getEllipsesOfContours, getRed, getBlue
+from imageProcessing import getContours, getEllipsesOfContours, getColourMasks, Colour
 
 class TargetContoursOlympicTarget(Enum):
     # enum type represents which rings were found in detection process
@@ -16,84 +16,67 @@ class TargetContoursOlympicTarget(Enum):
     OutRedInBlue = 2
     OutRedOutBlue = 3
 
+# ellipse as returned by cv2.fitEllipse packed into structured array
+EllipseDtype = np.dtype([('center', np.float64, 2), ('axes', np.float64, 2), ('angle', np.float64)])
+
+# ring placement hypotheses checked in order: (compared ratio, scored ratio, placement)
+# hypothesis wins when its compared ratio is closer than the score of the current winner
+RatioHypotheses = {
+    TargetType.REGULAR_1_10: [(1, 1, TargetContoursOlympicTarget.OutRedInBlue), (1.5, 1.5, TargetContoursOlympicTarget.OutRedOutBlue),
+                              (2, 2, TargetContoursOlympicTarget.InRedInBlue), (3, 3, TargetContoursOlympicTarget.InRedOutBlue)],
+    TargetType.REGULAR_5_10: [(1, 1, TargetContoursOlympicTarget.OutRedInBlue), (1.5, 1.5, TargetContoursOlympicTarget.OutRedOutBlue),
+                              (2, 2, TargetContoursOlympicTarget.InRedInBlue), (3, 3, TargetContoursOlympicTarget.InRedOutBlue)],
+    TargetType.REGULAR_6_10: [(1, 1, TargetContoursOlympicTarget.OutRedInBlue), (1.5, 1.2, TargetContoursOlympicTarget.OutRedOutBlue),
+                              (2, 2, TargetContoursOlympicTarget.InRedInBlue), (3, 2.5, TargetContoursOlympicTarget.InRedOutBlue)],
+}
+
+def packEllipses(ellipses: List) -> np.ndarray:
+    return np.array([(center, axes, angle) for center, axes, angle in ellipses], dtype=EllipseDtype)
+
+def normaliseCriterion(matrix: np.ndarray) -> np.ndarray:
+    # scales criterion so the best pair gets 1 and the worst 0, equal values are all equally good
+    matrix = matrix - np.min(matrix)
+    maxValue = np.max(matrix)
+    if maxValue == 0:
+        return np.ones(matrix.shape)
+    return 1-matrix/maxValue
+
 def getDetectionMatrix(redEllipses: List, blueEllipses: List, targetType: TargetType):
     # creates matrix which represents quality of a pair of red and blue ellipse
+    # rows are red ellipses and columns blue ones, every criterion is computed for all pairs at once
+
+    red = packEllipses(redEllipses)
+    blue = packEllipses(blueEllipses)
+    m, n = len(red), len(blue)
 
-    m, n = len(redEllipses), len(blueEllipses)
+    redCenter, blueCenter = red['center'][:, None, :], blue['center'][None, :, :]
+    axmajorR, axminorR = red['axes'][:, 0, None], red['axes'][:, 1, None]
+    axmajorB, axminorB = blue['axes'][None, :, 0], blue['axes'][None, :, 1]
 
     # first criteria: how far from each other are ellipses centres
-    centerDistanceAccMatrix = np.zeros((m,n), dtype=float)
+    centerDistanceAccMatrix = ((redCenter[:, :, 1]-blueCenter[:, :, 1])**2+(redCenter[:, :, 0]-blueCenter[:, :, 0])**2)**0.5
 
     # second criteria: are axes length matching for specific target
     axesRatioMatrix = np.zeros((m,n), dtype=float)
 
-    # third criteria: is ratio between major and minor axis similiar in red and blue axis
-    adequateAxesRatioMatrix = np.zeros((m,n), dtype=float)
-
     # matrix which determines what is estimated placement of the rings
     axesPlacementMatrix = np.zeros((m,n), dtype=TargetContoursOlympicTarget)
 
-    # for every pair of ellipses: distance between centers, ratio of axes and difference between angles is calculated
-    for r, redEll in enumerate(redEllipses):
-        for b, blueEll in enumerate(blueEllipses):
-            (yr, xr), (axmajorR, axminorR), _ = redEll
-            (yb, xb), (axmajorB, axminorB), _ = blueEll
-
-            centerDistanceAccMatrix[r,b] = ((xr-xb)**2+(yr-yb)**2)**0.5
-
-            ratioDiff = inf
-            ratio = (axmajorB/axmajorR + axminorB/axminorR)/2
-
-            if targetType == TargetType.REGULAR_1_10 or targetType == TargetType.REGULAR_5_10:
-                if fabs(ratio-1) < ratioDiff:
-                    ratioDiff = fabs(ratio-1)
-                    axesRatioMatrix[r,b] = ratioDiff
-                    axesPlacementMatrix[r,b] = TargetContoursOlympicTarget.OutRedInBlue
-                if fabs(ratio-1.5) < ratioDiff:
-                    ratioDiff = fabs(ratio-1.5)
-                    axesRatioMatrix[r,b] = ratioDiff
-                    axesPlacementMatrix[r,b] = TargetContoursOlympicTarget.OutRedOutBlue
-                if fabs(ratio-2) < ratioDiff:
-                    ratioDiff = fabs(ratio-2)
-                    axesRatioMatrix[r,b] = ratioDiff
-                    axesPlacementMatrix[r,b] = TargetContoursOlympicTarget.InRedInBlue
-                if fabs(ratio-3) < ratioDiff:
-                    ratioDiff = fabs(ratio-3)
-                    axesRatioMatrix[r,b] = ratioDiff
-                    axesPlacementMatrix[r,b] = TargetContoursOlympicTarget.InRedOutBlue
-
-            elif targetType == TargetType.REGULAR_6_10:
-                if fabs(ratio-1) < ratioDiff:
-                    ratioDiff = fabs(ratio-1)
-                    axesRatioMatrix[r,b] = ratioDiff
-                    axesPlacementMatrix[r,b] = TargetContoursOlympicTarget.OutRedInBlue
-                if fabs(ratio-1.5) < ratioDiff:
-                    ratioDiff = fabs(ratio-1.2)
-                    axesRatioMatrix[r,b] = ratioDiff
-                    axesPlacementMatrix[r,b] = TargetContoursOlympicTarget.OutRedOutBlue
-                if fabs(ratio-2) < ratioDiff:
-                    ratioDiff = fabs(ratio-2)
-                    axesRatioMatrix[r,b] = ratioDiff
-                    axesPlacementMatrix[r,b] = TargetContoursOlympicTarget.InRedInBlue
-                if fabs(ratio-3) < ratioDiff:
-                    ratioDiff = fabs(ratio-2.5)
-                    axesRatioMatrix[r,b] = ratioDiff
-                    axesPlacementMatrix[r,b] = TargetContoursOlympicTarget.InRedOutBlue               
-            
-            adequateAxesRatioMatrix[r,b] = fabs(axmajorR/axminorR-axmajorB/axminorB)
+    ratio = (axmajorB/axmajorR + axminorB/axminorR)/2
+    ratioDiff = np.full((m,n), inf)
+    for comparedRatio, scoredRatio, placement in RatioHypotheses.get(targetType, []):
+        better = np.abs(ratio-comparedRatio) < ratioDiff
+        ratioDiff = np.where(better, np.abs(ratio-scoredRatio), ratioDiff)
+        axesRatioMatrix[better] = ratioDiff[better]
+        axesPlacementMatrix[better] = placement
 
-    # every matrix is normalised
-    centerDistanceAccMatrix = centerDistanceAccMatrix - np.min(centerDistanceAccMatrix)
-    centerDistanceAccMatrix = centerDistanceAccMatrix/np.max(centerDistanceAccMatrix)
-    centerDistanceAccMatrix = 1-centerDistanceAccMatrix
-
-    axesRatioMatrix = axesRatioMatrix - np.min(axesRatioMatrix)
-    axesRatioMatrix = axesRatioMatrix/np.max(axesRatioMatrix)
-    axesRatioMatrix = 1-axesRatioMatrix
+    # third criteria: is ratio between major and minor axis similiar in red and blue axis
+    adequateAxesRatioMatrix = np.abs(axmajorR/axminorR-axmajorB/axminorB)
 
-    adequateAxesRatioMatrix = adequateAxesRatioMatrix - np.min(adequateAxesRatioMatrix)
-    adequateAxesRatioMatrix = adequateAxesRatioMatrix/np.max(adequateAxesRatioMatrix)
-    adequateAxesRatioMatrix = 1-adequateAxesRatioMatrix
+    # every matrix is normalised
+    centerDistanceAccMatrix = normaliseCriterion(centerDistanceAccMatrix)
+    axesRatioMatrix = normaliseCriterion(axesRatioMatrix)
+    adequateAxesRatioMatrix = normaliseCriterion(adequateAxesRatioMatrix)
 
     # multiplication of each is returned
     return np.multiply(np.multiply(centerDistanceAccMatrix, axesRatioMatrix), adequateAxesRatioMatrix), axesPlacementMatrix
@@ -170,9 +153,10 @@ def getBestEllipse(redEllipses, blueEllipses, detectionMatrix, axesPlacementMatr
 
     return ((y,x), (axmajor, axminor), angle)
 
-def targetDetection(image: np.ndarray, targetType: TargetType):
-    RedImage = getRed(image)
-    BlueImage = getBlue(image)
+def getRingCandidates(image: np.ndarray, targetType: TargetType):
+    # finds red and blue ellipses and the matrix which rates every pair of them
+    masks = getColourMasks(image, [Colour.RED, Colour.BLUE])
+    RedImage, BlueImage = masks[Colour.RED], masks[Colour.BLUE]
 
     ContoursResult = getContours(RedImage, BlueImage)
     if ContoursResult is None:
@@ -187,5 +171,66 @@ def targetDetection(image: np.ndarray, targetType: TargetType):
     redEllipses, blueEllipses = AccuracyResult
 
     detectionMatrix, axesPlacementMatrix = getDetectionMatrix(redEllipses, blueEllipses, targetType)
-        
+
+    return redEllipses, blueEllipses, detectionMatrix, axesPlacementMatrix
+
+def scaleEllipse(ell: Tuple[Tuple[float, float], Tuple[float, float], float], sx: float, sy: float):
+    (xc, yc), (axmajor, axminor), angle = ell
+    s = (sx+sy)/2
+    return ((xc*sx, yc*sy), (axmajor*s, axminor*s), angle)
+
+def refineEllipse(image: np.ndarray, ell: Tuple[Tuple[float, float], Tuple[float, float], float], colour: Colour, band: int):
+    # fits ellipse again at full resolution using only colour edges lying in a band around the coarse ellipse
+    (xc, yc), (axmajor, axminor), angle = ell
+    r = max(axmajor, axminor)/2 + band
+    xleft, xright = max(int(xc-r), 0), min(int(xc+r+1), image.shape[1])
+    ytop, ybottom = max(int(yc-r), 0), min(int(yc+r+1), image.shape[0])
+    if xright-xleft < 5 or ybottom-ytop < 5:
+        return ell
+
+    roi = image[ytop:ybottom, xleft:xright]
+    edges = cv2.Canny(getColourMasks(roi, [colour], blurTimes=2)[colour], 50, 150)
+
+    bandMask = np.zeros(edges.shape, dtype=np.uint8)
+    cv2.ellipse(bandMask, ((xc-xleft, yc-ytop), (axmajor, axminor), angle), 255, band)
+
+    points = np.argwhere(cv2.bitwise_and(edges, bandMask))
+    if points.shape[0] < 5:
+        return ell
+
+    (xr, yr), axes, angleR = cv2.fitEllipse(points[:, ::-1].astype(np.int32))
+    return ((xr+xleft, yr+ytop), axes, angleR)
+
+def pyramidTargetDetection(image: np.ndarray, targetType: TargetType, coarseSize: int = 640):
+    # ring candidates are found on a downscaled frame, chosen pair is refined at full resolution
+    scale = max(image.shape[:2])/coarseSize
+    if scale <= 1:
+        return targetDetection(image, targetType)
+
+    small = cv2.resize(image, (int(image.shape[1]/scale+0.5), int(image.shape[0]/scale+0.5)), interpolation=cv2.INTER_AREA)
+    sx, sy = image.shape[1]/small.shape[1], image.shape[0]/small.shape[0]
+
+    CandidatesResult = getRingCandidates(small, targetType)
+    if CandidatesResult is None:
+        return None
+
+    redEllipses, blueEllipses, detectionMatrix, axesPlacementMatrix = CandidatesResult
+    r, b = np.unravel_index(np.argmax(detectionMatrix), detectionMatrix.shape)
+
+    band = int(2*scale+4.5)
+    redEll = refineEllipse(image, scaleEllipse(redEllipses[r], sx, sy), Colour.RED, band)
+    blueEll = refineEllipse(image, scaleEllipse(blueEllipses[b], sx, sy), Colour.BLUE, band)
+
+    return getBestEllipse([redEll], [blueEll], np.ones((1,1)), axesPlacementMatrix[r:r+1, b:b+1], targetType)
+
+def targetDetection(image: np.ndarray, targetType: TargetType, pyramid: bool = False):
+    if pyramid:
+        return pyramidTargetDetection(image, targetType)
+
+    CandidatesResult = getRingCandidates(image, targetType)
+    if CandidatesResult is None:
+        return None
+
+    redEllipses, blueEllipses, detectionMatrix, axesPlacementMatrix = CandidatesResult
+
     return getBestEllipse(redEllipses, blueEllipses, detectionMatrix, axesPlacementMatrix, targetType)
\ No newline at end of file
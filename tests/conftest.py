@@ -0,0 +1,51 @@
+import os
+import sys
+
+import cv2
+import numpy as np
+import pytest
+
+# modules of the repo are imported by name like the scripts import each other
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from game import TargetType
+from hitPlacement import getHitDetectionMask, getBinDiffThreshold, getBinDiff
+from imageProcessing import reduceImageOfEllipse, reduceImageOfEllipseAndGetNewCenter, getTransformationParameters,\
+    getTransformedImage, getBoundriesAndMask, reduceImageAndRemoveBackground
+from syntheticTarget import SyntheticSession
+
+
+def getTargetImage(frame: np.ndarray, ell, transformation) -> np.ndarray:
+    # camera (BGR) frame to target image by the step by step pipeline, like testDetection does
+    rotationMatrix, scalingMatrix, bounds, mask = transformation
+    image = getTransformedImage(reduceImageOfEllipse(cv2.cvtColor(frame, cv2.COLOR_BGR2RGB), ell), rotationMatrix, scalingMatrix)
+    return reduceImageAndRemoveBackground(image, bounds, mask)
+
+
+def getSyntheticHit() -> dict:
+    # difference of the frames before and after the first arrow of a noise free synthetic session,
+    # transformed with the true target ellipse, so it doesn't depend on target detection
+    session = SyntheticSession(TargetType.REGULAR_1_10, duration=4, noise=0)
+    truth = session.getGroundTruth()
+    (xc, yc), (axmajor, axminor), angle = truth['ellipse']
+    ell = ((xc, yc), (axmajor, axminor), angle)
+
+    arrowFrame = truth['arrows'][0]['frame']
+    still = session.renderFrame(arrowFrame-1)
+    imReduced, newEll = reduceImageOfEllipseAndGetNewCenter(cv2.cvtColor(still, cv2.COLOR_BGR2RGB), ell)
+    imTrans, rotationMatrix, scalingMatrix, center = getTransformationParameters(imReduced, newEll)
+    bounds, mask = getBoundriesAndMask(imTrans, center, newEll[1][1])
+    transformation = (rotationMatrix, scalingMatrix, bounds, mask)
+
+    before = getTargetImage(still, ell, transformation)
+    after = getTargetImage(session.renderFrame(arrowFrame), ell, transformation)
+    diff = cv2.absdiff(cv2.cvtColor(after, cv2.COLOR_RGB2GRAY), cv2.cvtColor(before, cv2.COLOR_RGB2GRAY))
+    hitMask = getHitDetectionMask(before, newEll)
+    threshold = getBinDiffThreshold(diff)
+    return {'session': session, 'ellipse': newEll, 'image': after, 'diff': diff, 'threshold': threshold,
+            'binary': getBinDiff(diff, hitMask, threshold)}
+
+
+@pytest.fixture(scope='session')
+def syntheticHit():
+    return getSyntheticHit()
@@ -0,0 +1,28 @@
+import cv2
+
+from ArcheryTargetModel import ArcheryTargetModel
+from frameHistory import FrameHistory
+
+
+def test_sliding_get_hit_matches_fresh_history(syntheticHit):
+    # getHit keeps its history between calls, results must be the same as with a history built for every call
+    session = syntheticHit['session']
+    arrowFrame = session.getArrowFrame(session.arrows[0])
+    models = [ArcheryTargetModel(session.targetType, maskHitArrows=False) for _ in range(2)]
+    for model in models:
+        assert model.detectTarget(cv2.cvtColor(session.renderFrame(0), cv2.COLOR_BGR2RGB)) is not None
+    frames = [models[0].getTransformedImage(cv2.cvtColor(session.renderFrame(frameIdx), cv2.COLOR_BGR2RGB)).copy()
+              for frameIdx in range(arrowFrame-4, arrowFrame+3)]
+
+    hits, expected = [], []
+    for k in range(2, len(frames)):
+        hits.append(models[0].getHit(frames[k-2], frames[k-1], frames[k]))
+        history = FrameHistory(3)
+        for im in frames[k-2:k+1]:
+            history.push(im)
+        expected.append(models[1].getHitInHistory(history))
+
+    assert hits == expected
+    assert sum(dist is not None for dist in hits) == 1
+    # the same frames again are not taken as a continuation
+    assert models[0].getHit(*frames[-5:-2]) == expected[-3]
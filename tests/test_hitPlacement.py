@@ -0,0 +1,158 @@
+import cv2
+import numpy as np
+import pytest
+from math import pi, fabs
+
+from ArcheryTargetModel import ArcheryTargetModel
+from frameHistory import FrameHistory
+from hitPlacement import ArrowLine, getMotionRoi, getCrossedEdges, getLines, getCoordinates
+
+
+def getLinesByLoop(image: np.ndarray, ell):
+    # Hough transform at thresholds (h+w)/i, i = 2, 3, ... until a line lies within 30 degrees of ellipse angle,
+    # as getLines did before one accumulator pass, lines within 60 degrees are kept like getCoordinates does
+    (_,_), (_, _), angle = ell
+    i = 2
+    while True:
+        lines = cv2.HoughLines(image, rho=1, theta=pi/180, threshold=int((image.shape[0]+image.shape[1])/i+0.5))
+        if lines is not None and any(fabs((180*line[0][1]/pi) % 180 - angle) < 30 for line in lines):
+            break
+        i += 1
+    degrees = (180*lines[:, 0, 1]/pi) % 180
+    return lines[(angle-60 < degrees) & (degrees < angle+60)]
+
+
+def getLineTraceByLoop(image: np.ndarray, ell, ys: np.ndarray, xs: np.ndarray):
+    # support mask drawn line by line and median and longest run taken sample by sample,
+    # as ArrowLine.calculateLineTrace did before it was vectorised, returns (trace, surface, left end, right end)
+    (_,_), (_, _), angle = ell
+    lines = cv2.HoughLines(image, rho=1, theta=pi/180, threshold=int((image.shape[0]+image.shape[1])/8+0.5))
+    imline = np.ones(image.shape)
+    rang = (image.shape[0]+image.shape[1])/2
+    if lines is not None:
+        for line in lines:
+            rho, theta = line[0]
+            if fabs(angle-90-(180*theta/pi)%180) < 20:
+                a, b = np.cos(theta), np.sin(theta)
+                x0, y0 = a*rho, b*rho
+                imline = cv2.line(imline.copy(), (int(x0-rang*b), int(y0+rang*a)), (int(x0+rang*b), int(y0-rang*a)), 0, 1)
+    support = cv2.erode(imline, np.ones((3, 3)))
+
+    trace = image[ys, xs]
+    newtrace = np.zeros(trace.shape)
+    rect, maxSurface, currentSurface = False, 0, 0
+    leftIdx, currentLeftIdx, rightIdx = 0, 0, trace.shape[0]-1
+    for i in range(trace.shape[0]):
+        if support[ys[i], xs[i]]:
+            newtrace[i] = np.median(trace[max(0, i-2):min(trace.shape[0], i+3)])
+        if newtrace[i]:
+            currentSurface += 1
+            if not rect:
+                rect = True
+                currentLeftIdx = i
+        elif rect:
+            rect = False
+            if currentSurface > maxSurface:
+                maxSurface, leftIdx, rightIdx = currentSurface, currentLeftIdx, i
+            currentSurface = 0
+    if currentSurface > maxSurface:
+        maxSurface = currentSurface
+    return newtrace, maxSurface, np.array([ys[leftIdx], xs[leftIdx]]), np.array([ys[rightIdx], xs[rightIdx]])
+
+
+@pytest.fixture(params=['clean', 'noisy'])
+def hitBinary(request, syntheticHit):
+    # binary difference of the synthetic hit, noisy one has 3 % of pixels set at random
+    binary = syntheticHit['binary']
+    if request.param == 'noisy':
+        binary = binary.copy()
+        binary[np.random.default_rng(0).random(binary.shape) < 0.03] = 255
+    return binary, syntheticHit['ellipse']
+
+
+def test_lines_match_threshold_loop(hitBinary):
+    binary, ell = hitBinary
+    lines = getLines(binary, ell)
+    expected = getLinesByLoop(binary, ell)
+    assert sorted(map(tuple, lines[:, 0].tolist())) == sorted(map(tuple, expected[:, 0].tolist()))
+
+
+def test_line_traces_match_per_sample_loop(hitBinary):
+    binary, ell = hitBinary
+    for line in getLines(binary, ell):
+        aline = ArrowLine(*line[0])
+        aline.calculateCoordinates(binary.shape[0], binary.shape[1])
+        trace = aline.calculateLineTrace(binary, ell)
+
+        ys, xs = aline._ArrowLine__ylinspace, aline._ArrowLine__xlinspace
+        expectedTrace, surface, leftEnd, rightEnd = getLineTraceByLoop(binary, ell, ys, xs)
+        np.testing.assert_array_equal(trace, expectedTrace)
+        assert aline.getMaxSurface() == surface
+        np.testing.assert_array_equal(aline.getCoords()[0], leftEnd)
+        np.testing.assert_array_equal(aline.getCoords()[1], rightEnd)
+
+
+def test_arrow_ends_on_synthetic_frame(hitBinary):
+    # ends found by the original per line code on this frame
+    binary, ell = hitBinary
+    leftEnd, rightEnd = getCoordinates(binary, ell, getLines(binary, ell))
+    assert (leftEnd.tolist(), rightEnd.tolist()) == ([54, 97], [59, 125])
+    threaded = getCoordinates(binary, ell, getLines(binary, ell), workers=4)
+    assert (threaded[0].tolist(), threaded[1].tolist()) == ([54, 97], [59, 125])
+
+
+def clearOutside(binary: np.ndarray, roi) -> np.ndarray:
+    ytop, ybottom, xleft, xright = roi
+    region = np.zeros_like(binary)
+    region[ytop:ybottom, xleft:xright] = binary[ytop:ybottom, xleft:xright]
+    return region
+
+
+def test_motion_roi_holds_every_changed_pixel(syntheticHit):
+    binary = syntheticHit['binary']
+    roi = getMotionRoi(syntheticHit['diff'], binary, syntheticHit['threshold'])
+    assert roi is not None
+    assert cv2.countNonZero(clearOutside(binary, roi)) == cv2.countNonZero(binary)
+
+
+def test_coordinates_are_the_same_with_motion_roi(syntheticHit):
+    binary, ell = syntheticHit['binary'], syntheticHit['ellipse']
+    region = clearOutside(binary, getMotionRoi(syntheticHit['diff'], binary, syntheticHit['threshold']))
+
+    full = getCoordinates(binary, ell, getLines(binary, ell))
+    cropped = getCoordinates(region, ell, getLines(region, ell))
+    assert not np.array_equal(full[0], full[1])
+    for end, croppedEnd in zip(full, cropped):
+        np.testing.assert_array_equal(end, croppedEnd)
+
+
+def test_crossed_box_is_grown():
+    # shaft runs out of the changed blocks, box has to grow along it until the whole shaft is inside
+    binary = np.zeros((200, 200), dtype=np.uint8)
+    cv2.line(binary, (20, 100), (180, 110), 255, 1)
+    diff = np.zeros_like(binary)
+    diff[95:115, 90:130] = 200
+
+    assert getCrossedEdges(binary, (90, 120, 80, 140)) == (False, False, True, True)
+    roi = getMotionRoi(diff, binary, 10, margin=2, shaftExtension=0)
+    assert roi is not None
+    assert cv2.countNonZero(clearOutside(binary, roi)) == cv2.countNonZero(binary)
+    assert getCrossedEdges(binary, roi) == (False, False, False, False)
+
+
+def test_model_hits_are_the_same_with_motion_roi(syntheticHit):
+    session = syntheticHit['session']
+    hits = {}
+    for motionRoi in (False, True):
+        model = ArcheryTargetModel(session.targetType, maskHitArrows=False, motionRoi=motionRoi)
+        assert model.detectTarget(cv2.cvtColor(session.renderFrame(0), cv2.COLOR_BGR2RGB)) is not None
+        history = FrameHistory(3)
+        hits[motionRoi] = []
+        for frameIdx, frame in enumerate(session.frames()):
+            history.push(model.getTransformedImage(cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)))
+            dist = model.getHitInHistory(history)
+            if dist is not None:
+                hits[motionRoi].append((frameIdx, dist))
+
+    assert len(hits[False]) == len(session.arrows)
+    assert hits[True] == hits[False]
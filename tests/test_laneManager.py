@@ -0,0 +1,43 @@
+import numpy as np
+
+from cameraConnection import ConnectionStatus
+from game import TargetType
+from laneManager import Lane
+from visionWorker import LaneVision
+
+
+class StillReader():
+    # camera giving one grey frame, never a new one, so lane jobs only run commands
+    def getLatestFrame(self):
+        return np.full((72, 128, 3), 120, dtype=np.uint8), ConnectionStatus.OK
+
+    def hasNewFrame(self) -> bool:
+        return False
+
+    def getStatus(self) -> ConnectionStatus:
+        return ConnectionStatus.OK
+
+    def release(self):
+        pass
+
+
+def test_failed_detection_is_reported_as_not_found(monkeypatch):
+    def failDetection(self, frame):
+        raise RuntimeError('vision worker failed on detect')
+
+    scoring = []
+    monkeypatch.setattr(LaneVision, 'detectTarget', failDetection)
+    monkeypatch.setattr(LaneVision, 'setScoring', lambda self, value: scoring.append(value))
+
+    lane = Lane('lane', TargetType.REGULAR_1_10, hitDetectionRate=0)
+    lane.connect(StillReader())
+    lane.detectTarget()
+    lane.setScoring(True)
+    assert lane.takeDetection() == (False, None)
+
+    lane.process()
+    assert lane.takeDetection() == (True, None)
+    # commands after the failed one still run
+    assert scoring == [True]
+    assert not lane.hasCommands()
+    lane.close()
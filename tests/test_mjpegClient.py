@@ -0,0 +1,104 @@
+from time import monotonic, sleep
+
+import cv2
+import numpy as np
+import pytest
+
+from cameraConnection import ConnectionStatus
+from mjpegClient import MjpegReader, MjpegServer
+
+
+def makeFrames(count: int = 8):
+    # frame i is filled with gray level 20*i, so received frames can be told apart
+    return [cv2.imencode('.jpg', np.full((48, 64, 3), 20*i, dtype=np.uint8))[1].tobytes() for i in range(count)]
+
+
+def waitFor(condition, timeout: float = 5.0) -> bool:
+    end = monotonic()+timeout
+    while monotonic() < end:
+        if condition():
+            return True
+        sleep(0.01)
+    return condition()
+
+
+@pytest.fixture
+def serve():
+    servers = []
+    readers = []
+
+    def start(frames, readerArgs=None, **serverArgs):
+        server = MjpegServer(frames, **serverArgs)
+        servers.append(server)
+        reader = MjpegReader(server.getUrl(), **(readerArgs or {})).start()
+        readers.append(reader)
+        return server, reader
+
+    yield start
+    for reader in readers:
+        reader.stop()
+    for server in servers:
+        server.stop()
+
+
+@pytest.mark.parametrize('contentLength', [True, False])
+def test_parts_are_read_with_and_without_content_length(serve, contentLength):
+    frames = makeFrames()
+    _, reader = serve(frames, fps=100, contentLength=contentLength)
+
+    assert reader.waitForNewFrame()
+    ret, frame = reader.read()
+    assert ret
+    assert frame.shape == (48, 64, 3)
+    assert waitFor(lambda: reader.getStats()['captured'] >= 10)
+    assert reader.getStats()['decodeErrors'] == 0
+    assert reader.getStatus() == ConnectionStatus.OK
+
+
+@pytest.mark.parametrize('contentLength', [True, False])
+def test_last_part_before_close_is_kept(serve, contentLength):
+    # every part of a closed connection is captured, also the one not followed by a boundary
+    _, reader = serve(makeFrames(), fps=0, contentLength=contentLength, dropAfter=3, readerArgs={'maxReconnects': 0})
+
+    assert waitFor(lambda: reader.getStatus() == ConnectionStatus.ERROR)
+    assert reader.getStats()['captured'] == 3
+
+    frame, status = reader.getLatestFrame()
+    assert status == ConnectionStatus.ERROR
+    assert abs(int(frame.mean())-40) <= 2
+
+
+def test_dropped_connection_is_reconnected(serve):
+    _, reader = serve(makeFrames(), fps=200, dropAfter=5, readerArgs={'backoff': 0.01})
+
+    assert waitFor(lambda: reader.getStats()['reconnects'] >= 2 and reader.getStats()['captured'] >= 15)
+    assert reader.getStatus() == ConnectionStatus.OK
+    ret, frame = reader.read()
+    assert ret and frame.shape == (48, 64, 3)
+
+
+def test_stream_is_given_up_after_max_reconnects(serve):
+    server, reader = serve(makeFrames(), fps=100, readerArgs={'backoff': 0.01, 'maxBackoff': 0.05, 'connectTimeout': 0.5,
+                                                              'readTimeout': 0.5, 'maxReconnects': 2})
+    assert reader.waitForNewFrame()
+    server.stop()
+
+    assert waitFor(lambda: reader.getStatus() == ConnectionStatus.ERROR)
+    assert reader.getStats()['reconnects'] == 2
+    # frames left from before are taken, then nothing new comes
+    reader.getLatestFrame()
+    assert not reader.waitForNewFrame(timeout=0.1)
+
+
+def test_frames_taken_at_lower_rate_are_not_decoded(serve):
+    _, reader = serve(makeFrames(), fps=100)
+
+    assert reader.waitForNewFrame()
+    end = monotonic()+1.0
+    while monotonic() < end:
+        reader.getLatestFrame()
+        sleep(0.1)
+
+    stats = reader.getStats()
+    assert 0 < stats['decoded'] < stats['captured']
+    assert stats['dropped'] > 0
@@ -0,0 +1,14 @@
+import numpy as np
+
+from game import TargetType
+from syntheticTarget import SyntheticSession, evaluateSession
+
+
+def test_synthetic_hits_are_scored_close_to_ground_truth():
+    # sessions are deterministic (noise is seeded per frame), median keeps a single misplaced arrow end
+    # from hiding a shift of every score
+    report = evaluateSession(SyntheticSession(TargetType.REGULAR_1_10, duration=4))
+    assert report['detectionRate'] == 1.0
+    assert report['falseHits'] == 0
+    errors = [abs(arrow['detected']['distance']-arrow['distance']) for arrow in report['arrows']]
+    assert np.median(errors) < 0.1
@@ -0,0 +1,81 @@
+import numpy as np
+import pytest
+from math import fabs, inf
+
+from game import TargetType
+from targetDetection import TargetContoursOlympicTarget, getDetectionMatrix, getBestEllipse
+
+
+# ratio hypotheses of the per pair loop getDetectionMatrix replaced: (compared ratio, scored ratio, placement)
+LoopHypotheses = {
+    TargetType.REGULAR_1_10: [(1, 1, TargetContoursOlympicTarget.OutRedInBlue), (1.5, 1.5, TargetContoursOlympicTarget.OutRedOutBlue),
+                              (2, 2, TargetContoursOlympicTarget.InRedInBlue), (3, 3, TargetContoursOlympicTarget.InRedOutBlue)],
+    TargetType.REGULAR_5_10: [(1, 1, TargetContoursOlympicTarget.OutRedInBlue), (1.5, 1.5, TargetContoursOlympicTarget.OutRedOutBlue),
+                              (2, 2, TargetContoursOlympicTarget.InRedInBlue), (3, 3, TargetContoursOlympicTarget.InRedOutBlue)],
+    TargetType.REGULAR_6_10: [(1, 1, TargetContoursOlympicTarget.OutRedInBlue), (1.5, 1.2, TargetContoursOlympicTarget.OutRedOutBlue),
+                              (2, 2, TargetContoursOlympicTarget.InRedInBlue), (3, 2.5, TargetContoursOlympicTarget.InRedOutBlue)],
+}
+
+
+def getDetectionMatrixByLoop(redEllipses, blueEllipses, targetType: TargetType):
+    # every pair evaluated on its own, as getDetectionMatrix did before it was vectorised
+    m, n = len(redEllipses), len(blueEllipses)
+    centerDistanceAccMatrix = np.zeros((m, n), dtype=float)
+    axesRatioMatrix = np.zeros((m, n), dtype=float)
+    adequateAxesRatioMatrix = np.zeros((m, n), dtype=float)
+    axesPlacementMatrix = np.zeros((m, n), dtype=TargetContoursOlympicTarget)
+
+    for r, redEll in enumerate(redEllipses):
+        for b, blueEll in enumerate(blueEllipses):
+            (yr, xr), (axmajorR, axminorR), _ = redEll
+            (yb, xb), (axmajorB, axminorB), _ = blueEll
+            centerDistanceAccMatrix[r, b] = ((xr-xb)**2+(yr-yb)**2)**0.5
+
+            ratioDiff = inf
+            ratio = (axmajorB/axmajorR + axminorB/axminorR)/2
+            for comparedRatio, scoredRatio, placement in LoopHypotheses[targetType]:
+                if fabs(ratio-comparedRatio) < ratioDiff:
+                    ratioDiff = fabs(ratio-scoredRatio)
+                    axesRatioMatrix[r, b] = ratioDiff
+                    axesPlacementMatrix[r, b] = placement
+            adequateAxesRatioMatrix[r, b] = fabs(axmajorR/axminorR-axmajorB/axminorB)
+
+    matrices = []
+    for matrix in (centerDistanceAccMatrix, axesRatioMatrix, adequateAxesRatioMatrix):
+        matrix = matrix - np.min(matrix)
+        matrices.append(1-matrix/np.max(matrix))
+    return np.multiply(np.multiply(matrices[0], matrices[1]), matrices[2]), axesPlacementMatrix
+
+
+def getRandomEllipses(rng: np.random.Generator, count: int):
+    ellipses = []
+    for _ in range(count):
+        axes = rng.uniform(10, 300, 2)
+        ellipses.append(((float(rng.uniform(0, 720)), float(rng.uniform(0, 1280))),
+                         (float(axes.max()), float(axes.min())), float(rng.uniform(0, 180))))
+    return ellipses
+
+
+@pytest.mark.parametrize('targetType', list(TargetType))
+def test_detection_matrix_matches_per_pair_loop(targetType):
+    rng = np.random.default_rng(targetType.value)
+    for _ in range(100):
+        # at least two ellipses of each colour, so no criterion has zero range (the loop divided by zero there)
+        red = getRandomEllipses(rng, int(rng.integers(2, 12)))
+        blue = getRandomEllipses(rng, int(rng.integers(2, 12)))
+
+        matrix, placement = getDetectionMatrix(red, blue, targetType)
+        expectedMatrix, expectedPlacement = getDetectionMatrixByLoop(red, blue, targetType)
+        # numpy and python floats may round the last bit differently, chosen pair has to be the same
+        np.testing.assert_allclose(matrix, expectedMatrix, rtol=1e-12, atol=1e-15)
+        assert np.argmax(matrix) == np.argmax(expectedMatrix)
+        assert (placement == expectedPlacement).all()
+        assert getBestEllipse(red, blue, matrix, placement, targetType) ==\
+            getBestEllipse(red, blue, expectedMatrix, expectedPlacement, targetType)
+
+
+def test_detection_matrix_of_single_pair():
+    # zero range criterion is equally good for every pair instead of nan
+    matrix, placement = getDetectionMatrix([((100, 100), (50, 40), 0)], [((101, 100), (100, 80), 0)], TargetType.REGULAR_1_10)
+    np.testing.assert_array_equal(matrix, np.ones((1, 1)))
+    assert placement[0, 0] == TargetContoursOlympicTarget.InRedInBlue
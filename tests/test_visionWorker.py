@@ -0,0 +1,64 @@
+from multiprocessing import shared_memory
+
+import pytest
+
+from cameraConnection import FileFrameSource
+from game import GameState, TargetType
+from syntheticTarget import SyntheticSession, writeSession
+from visionWorker import LaneVision, VisionWorker
+
+
+@pytest.fixture(scope='module')
+def sessionPath(tmp_path_factory):
+    # 4 s session of png frames, arrows come at 1, 2 and 3 s
+    session = SyntheticSession(TargetType.REGULAR_1_10, duration=4)
+    path = str(tmp_path_factory.mktemp('session')/'frames')
+    writeSession(session, path)
+    return session, path
+
+
+def scoreFrames(vision, path: str):
+    # every frame window is checked for hit, so results don't depend on the process the vision runs in
+    source = FileFrameSource(path, fps=0)
+    ret, frame = source.read()
+    assert ret
+    assert vision.detectTarget(frame) is not None
+    vision.setScoring(True)
+
+    hits = []
+    frameIdx = 0
+    while True:
+        ret, frame = source.read()
+        if not ret:
+            break
+        frameIdx += 1
+        image, dist = vision.process(frame, GameState.ROUND)
+        assert image is not None
+        if dist is not None:
+            hits.append((frameIdx, dist))
+    source.release()
+    return hits
+
+
+def test_worker_finds_the_same_hits_as_in_process_vision(sessionPath):
+    session, path = sessionPath
+    expected = scoreFrames(LaneVision(TargetType.REGULAR_1_10, hitDetectionRate=0), path)
+
+    worker = VisionWorker(TargetType.REGULAR_1_10, hitDetectionRate=0).start()
+    try:
+        hits = scoreFrames(worker, path)
+        names = worker.getRingNames()
+    finally:
+        worker.stop()
+
+    arrowFrames = [session.getArrowFrame(arrow) for arrow in session.arrows]
+    assert arrowFrames == [30, 60, 90]
+    assert [frameIdx for frameIdx, _ in expected] == arrowFrames
+    assert hits == expected
+
+    # both shared rings are unlinked by stop
+    assert len(names) == 2
+    for name in names:
+        with pytest.raises(FileNotFoundError):
+            shared_memory.SharedMemory(name=name)
+    assert worker.getRingNames() == []
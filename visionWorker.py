@@ -0,0 +1,446 @@
+import argparse
+import multiprocessing
+import queue
+import traceback
+from multiprocessing import shared_memory
+from time import monotonic, perf_counter
+from typing import FrozenSet, List, Tuple
+
+import cv2
+import numpy as np
+
+from ArcheryTargetModel import ArcheryTargetModel
+from cameraConnection import FileFrameSource
+from frameHistory import FrameHistory
+from driftTracker import DriftStatus
+from game import GameState, TargetType
+from processingGovernor import ProcessingStage
+from metrics import timed, defaultRegistry
+
+
+class SharedFrameRing():
+    # uint8 frames of any shape up to slotBytes kept in shared memory, so they pass between processes without pickling
+    # frame number of a slot is -1 while it is written, reader checks the number before and after its copy
+
+    SlotHeader = np.dtype([('number', np.int64), ('timestamp', np.float64), ('shape', np.int64, 3)])
+
+    def __init__(self, slotBytes: int, slots: int = 2, name: str = None):
+        # new ring when name is None, otherwise ring created by another process is attached
+        self.__slotBytes = slotBytes
+        self.__slots = max(slots, 2)
+        self.__owner = name is None
+        headerBytes = self.SlotHeader.itemsize*self.__slots+8
+
+        if self.__owner:
+            self.__memory = shared_memory.SharedMemory(create=True, size=headerBytes+self.__slots*slotBytes)
+        else:
+            self.__memory = shared_memory.SharedMemory(name=name)
+        self.__headers = np.ndarray((self.__slots,), self.SlotHeader, buffer=self.__memory.buf)
+        self.__latest = np.ndarray((1,), np.int64, buffer=self.__memory.buf, offset=headerBytes-8)
+        self.__data = np.ndarray((self.__slots, slotBytes), np.uint8, buffer=self.__memory.buf, offset=headerBytes)
+        if self.__owner:
+            self.__headers['number'] = 0
+            self.__latest[0] = 0
+
+    def getName(self) -> str:
+        return self.__memory.name
+
+    def getSlotBytes(self) -> int:
+        return self.__slotBytes
+
+    def getSlots(self) -> int:
+        return self.__slots
+
+    def getLatestNumber(self) -> int:
+        return int(self.__latest[0])
+
+    def fits(self, frame: np.ndarray) -> bool:
+        return frame.dtype == np.uint8 and frame.ndim in (2, 3) and frame.nbytes <= self.__slotBytes
+
+    def write(self, frame: np.ndarray, timestamp: float = 0.0) -> int:
+        # returns number of the written frame, numbers start at 1
+        if not self.fits(frame):
+            raise ValueError('frame of shape '+str(frame.shape)+' does not fit in shared ring slot')
+        number = int(self.__latest[0])+1
+        slot = number % self.__slots
+
+        self.__headers['number'][slot] = -1
+        np.copyto(self.__data[slot, :frame.nbytes].reshape(frame.shape), frame)
+        self.__headers['timestamp'][slot] = timestamp
+        self.__headers['shape'][slot] = frame.shape+(0,)*(3-frame.ndim)
+        self.__headers['number'][slot] = number
+        self.__latest[0] = number
+        return number
+
+    def read(self, number: int = None) -> Tuple[np.ndarray, float]:
+        # copy of the frame with given number (newest by default) and its timestamp,
+        # (None, 0) when the frame was not written yet or is already overwritten
+        if number is None:
+            number = int(self.__latest[0])
+        slot = number % self.__slots
+        if number <= 0 or self.__headers['number'][slot] != number:
+            return None, 0.0
+
+        height, width, channels = (int(v) for v in self.__headers['shape'][slot])
+        shape = (height, width, channels) if channels > 0 else (height, width)
+        timestamp = float(self.__headers['timestamp'][slot])
+        frame = self.__data[slot, :height*width*max(channels, 1)].reshape(shape).copy()
+        if self.__headers['number'][slot] != number:
+            return None, 0.0
+        return frame, timestamp
+
+    def close(self):
+        # views have to be dropped before the mapping is closed, creator also removes the memory
+        self.__headers = None
+        self.__latest = None
+        self.__data = None
+        self.__memory.close()
+        if self.__owner:
+            self.__memory.unlink()
+
+
+class LaneVision():
+    # vision state of one lane: target model, frame history and the last camera frame,
+    # used by the lane directly or inside a VisionWorker process, all frames are camera (BGR) frames
+
+    def __init__(self, targetType: TargetType, frameWindow: int = 3, hitDetectionRate: float = 30):
+        self.__model = ArcheryTargetModel(targetType)
+
+        # grayscale of the last frameWindow target images, every frame window is checked for hit once
+        self.__history = FrameHistory(frameWindow)
+        self.__checkedFrameId = -1
+        self.__hitInterval = 1/hitDetectionRate if hitDetectionRate > 0 else 0
+        self.__lastHitCheck = None
+
+        self.__historyPaused = False
+
+        self.__ellipse = None
+        self.__markedPoints = None
+        self.__scoring = False
+        self.__actFrame = None
+
+    def getEllipse(self):
+        return self.__ellipse
+
+    def detectTarget(self, frame: np.ndarray):
+        self.__actFrame = frame
+        self.__ellipse = self.__model.detectTarget(cv2.cvtColor(frame, cv2.COLOR_BGR2RGB))
+        return self.__ellipse
+
+    def markTarget(self, points: List[Tuple[int, int]]):
+        # points marked on the camera view, ellipse is fitted once all 5 are given
+        self.__markedPoints = list(points)
+        if len(points) == 5 and self.__actFrame is not None:
+            self.__ellipse = self.__model.createEllipse(self.__markedPoints)
+            self.__model.prepareTransformation(self.__actFrame)
+        else:
+            self.__ellipse = None
+        return self.__ellipse
+
+    def stopMarking(self):
+        self.__markedPoints = None
+
+    def resetTarget(self):
+        self.__ellipse = None
+        self.__markedPoints = None
+        self.__model.resetEllipse()
+
+    def setScoring(self, scoring: bool):
+        # target images are warped and checked for hits only while scoring
+        self.__scoring = scoring
+        self.__history.clear()
+        self.__checkedFrameId = -1
+
+    def process(self, frame: np.ndarray, gameState: GameState, stages: FrozenSet[ProcessingStage] = None)\
+            -> Tuple[np.ndarray, float]:
+        # display image (camera view or transformed target while scoring) and distance of a hit found in this frame,
+        # only given stages run (all when None), display image is None without PREVIEW
+        if stages is None:
+            stages = frozenset(ProcessingStage)
+        imshow = frame.copy()
+        dist = None
+
+        # if target is detected/marked draw it
+        if self.__ellipse is not None:
+            imshow = self.__model.drawEllipse(imshow)
+
+        # when target is pointed manually, draw marked points
+        if self.__markedPoints is not None:
+            imshow = self.__model.drawPoints(imshow, self.__markedPoints)
+            if len(self.__markedPoints) == 5 and self.__ellipse is not None:
+                self.__model.prepareTransformation(frame.copy())
+
+        self.__actFrame = frame
+
+        if self.__scoring and self.__ellipse is not None and imshow is not None:
+            # camera drift moves the target image, frames from before the correction can't be compared with the new ones
+            if ProcessingStage.DRIFT in stages:
+                drift = self.__model.trackDrift(frame)
+                if drift in (DriftStatus.CORRECTED, DriftStatus.REDETECTED):
+                    self.__ellipse = self.__model.getEllipse()
+                    self.__history.clear()
+
+            # frames from before a pause of history (arrows pulled out) can't be compared with the new ones
+            if ProcessingStage.HISTORY not in stages:
+                self.__historyPaused = True
+            elif self.__historyPaused:
+                self.__historyPaused = False
+                self.__history.clear()
+                self.__checkedFrameId = -1
+
+            # warp buffer ring keeps the image valid for the next frames, long enough for the display tick
+            if ProcessingStage.PREVIEW in stages or ProcessingStage.HISTORY in stages:
+                imshow = self.__model.getTransformedImage(frame)
+            if ProcessingStage.HISTORY in stages:
+                self.__history.push(imshow)
+            if gameState == GameState.ROUND and ProcessingStage.HIT in stages:
+                dist = self.__checkHit()
+
+        if ProcessingStage.PREVIEW not in stages:
+            imshow = None
+        return imshow, dist
+
+    def __checkHit(self):
+        # every frame window is checked once, hit detection rate lower than processing rate skips windows
+        if not self.__history.isFull() or self.__history.getFrameId() == self.__checkedFrameId:
+            return None
+        now = monotonic()
+        if self.__lastHitCheck is not None and now-self.__lastHitCheck < self.__hitInterval:
+            return None
+        self.__lastHitCheck = now
+        self.__checkedFrameId = self.__history.getFrameId()
+
+        return self.__model.getHitInHistory(self.__history)
+
+
+def runVisionWorker(commands, results, targetType: TargetType, frameWindow: int, hitDetectionRate: float, metrics: bool):
+    # loop of the worker process, every command (id, kind, args) gets exactly one reply with the same id
+    defaultRegistry.enable(metrics)
+    vision = LaneVision(targetType, frameWindow, hitDetectionRate)
+    frames = None
+    images = None
+
+    while True:
+        # worker doesn't outlive the GUI process, even when it was killed
+        try:
+            callId, kind, args = commands.get(timeout=1)
+        except queue.Empty:
+            if not multiprocessing.parent_process().is_alive():
+                break
+            continue
+        if kind == 'stop':
+            break
+
+        reply = {'id': callId}
+        try:
+            if kind == 'rings':
+                for ring in (frames, images):
+                    if ring is not None:
+                        ring.close()
+                frameName, imageName, slotBytes, slots = args
+                frames = SharedFrameRing(slotBytes, slots, frameName)
+                images = SharedFrameRing(slotBytes, slots, imageName)
+
+            if kind == 'process':
+                number, gameState, stages = args
+                frame, _ = frames.read(number)
+                if frame is None:
+                    raise RuntimeError('frame '+str(number)+' is not in shared ring')
+
+                # stage timings of the model measured during this frame are sent back with the result
+                counts = {name: histogram.getCount() for name, histogram in defaultRegistry.getHistograms().items()}
+                start = perf_counter()
+                image, dist = vision.process(frame, gameState, stages)
+                timings = {name: histogram.getLast() for name, histogram in defaultRegistry.getHistograms().items()
+                           if histogram.getCount() != counts.get(name, 0)}
+                timings['worker_process_seconds'] = perf_counter()-start
+
+                # image which doesn't fit in the ring is pickled
+                if image is not None and images.fits(image):
+                    image = images.write(image)
+                reply.update(image=image, dist=dist, ellipse=vision.getEllipse(), timings=timings)
+
+            if kind == 'detect':
+                frame, _ = frames.read(args[0])
+                reply['ellipse'] = vision.detectTarget(frame)
+
+            if kind == 'mark':
+                reply['ellipse'] = vision.markTarget(args[0])
+
+            if kind == 'stopMarking':
+                vision.stopMarking()
+
+            if kind == 'reset':
+                vision.resetTarget()
+                reply['ellipse'] = None
+
+            if kind == 'scoring':
+                vision.setScoring(args[0])
+        except Exception:
+            reply['error'] = traceback.format_exc()
+        results.put(reply)
+
+    for ring in (frames, images):
+        if ring is not None:
+            ring.close()
+
+
+class VisionWorker():
+    # LaneVision of one lane in its own process, so vision work doesn't hold the GIL of the GUI process
+    # camera frames and display images go through shared memory rings, commands and small results
+    # (ellipse, hit distance, stage timings) through queues, every call waits for its reply
+
+    def __init__(self, targetType: TargetType, frameWindow: int = 3, hitDetectionRate: float = 30, slots: int = 2,\
+                 timeout: float = 30.0):
+        self.__args = (targetType, frameWindow, hitDetectionRate)
+        self.__slots = slots
+        self.__timeout = timeout
+        self.__process = None
+        self.__commands = None
+        self.__results = None
+        self.__callId = 0
+        self.__frames = None
+        self.__images = None
+        self.__ellipse = None
+
+    def start(self):
+        # spawned process doesn't inherit threads and Qt state of the GUI process
+        if self.__process is None:
+            context = multiprocessing.get_context('spawn')
+            self.__commands = context.Queue()
+            self.__results = context.Queue()
+            self.__process = context.Process(target=runVisionWorker, daemon=True,\
+                                             args=(self.__commands, self.__results)+self.__args+(defaultRegistry.isEnabled(),))
+            self.__process.start()
+        return self
+
+    def stop(self):
+        if self.__process is not None:
+            self.__commands.put((-1, 'stop', ()))
+            self.__process.join(timeout=2)
+            if self.__process.is_alive():
+                self.__process.terminate()
+                self.__process.join()
+            self.__process = None
+        self.__closeRings()
+
+    def isAlive(self) -> bool:
+        return self.__process is not None and self.__process.is_alive()
+
+    def __call(self, kind: str, *args) -> dict:
+        # replies of calls which timed out earlier are skipped
+        self.__callId += 1
+        self.__commands.put((self.__callId, kind, args))
+        while True:
+            try:
+                reply = self.__results.get(timeout=self.__timeout)
+            except queue.Empty:
+                raise RuntimeError('vision worker did not answer '+kind)
+            if reply['id'] == self.__callId:
+                break
+        if 'error' in reply:
+            raise RuntimeError('vision worker failed on '+kind+'\n'+reply['error'])
+        return reply
+
+    def __writeFrame(self, frame: np.ndarray) -> int:
+        # rings are created for the first frame and again when the camera resolution grows
+        if self.__frames is None or not self.__frames.fits(frame):
+            self.__closeRings()
+            self.__frames = SharedFrameRing(frame.nbytes, self.__slots)
+            self.__images = SharedFrameRing(frame.nbytes, self.__slots)
+            self.__call('rings', self.__frames.getName(), self.__images.getName(), frame.nbytes, self.__slots)
+        return self.__frames.write(frame)
+
+    def __closeRings(self):
+        for ring in (self.__frames, self.__images):
+            if ring is not None:
+                ring.close()
+        self.__frames = None
+        self.__images = None
+
+    def getRingNames(self) -> List[str]:
+        # shared memory names of the frame and image rings, empty until the first frame is sent
+        return [ring.getName() for ring in (self.__frames, self.__images) if ring is not None]
+
+    def getEllipse(self):
+        return self.__ellipse
+
+    def detectTarget(self, frame: np.ndarray):
+        self.__ellipse = self.__call('detect', self.__writeFrame(frame))['ellipse']
+        return self.__ellipse
+
+    def markTarget(self, points: List[Tuple[int, int]]):
+        self.__ellipse = self.__call('mark', list(points))['ellipse']
+        return self.__ellipse
+
+    def stopMarking(self):
+        self.__call('stopMarking')
+
+    def resetTarget(self):
+        self.__ellipse = self.__call('reset')['ellipse']
+
+    def setScoring(self, scoring: bool):
+        self.__call('scoring', scoring)
+
+    def process(self, frame: np.ndarray, gameState: GameState, stages: FrozenSet[ProcessingStage] = None)\
+            -> Tuple[np.ndarray, float]:
+        with timed('worker_roundtrip_seconds', 'frame sent to vision worker until its result came back'):
+            reply = self.__call('process', self.__writeFrame(frame), gameState, stages)
+            self.__ellipse = reply['ellipse']
+            for name, value in reply['timings'].items():
+                defaultRegistry.observe(name, value, 'measured in vision worker')
+
+            image = reply['image']
+            if isinstance(image, int):
+                image, _ = self.__images.read(image)
+        return image, reply['dist']
+
+
+if __name__ == '__main__':
+    # scores recorded footage through a vision worker (or in process) and reports hits and per frame latency
+    parser = argparse.ArgumentParser(description='Vision worker smoke run on recorded footage')
+    parser.add_argument('source', help='video file or directory of frames')
+    parser.add_argument('--target', default=TargetType.REGULAR_1_10.name, choices=[t.name for t in TargetType])
+    parser.add_argument('--fps', type=float, default=0, help='pacing of the frame source, 0 reads as fast as possible')
+    parser.add_argument('--in-process', action='store_true', help='run LaneVision in this process for comparison')
+    args = parser.parse_args()
+
+    defaultRegistry.enable()
+    source = FileFrameSource(args.source, args.fps)
+    ret, frame = source.read()
+    if not ret:
+        raise SystemExit('no frames in '+args.source)
+
+    # every frame window is checked for hit, results don't depend on how fast frames are read
+    if args.in_process:
+        vision = LaneVision(TargetType[args.target], hitDetectionRate=0)
+    else:
+        vision = VisionWorker(TargetType[args.target], hitDetectionRate=0).start()
+
+    try:
+        if vision.detectTarget(frame) is None:
+            raise SystemExit('target not found')
+        vision.setScoring(True)
+
+        frameIdx = 0
+        frameTimes = []
+        while True:
+            ret, frame = source.read()
+            if not ret:
+                break
+            frameIdx += 1
+            start = perf_counter()
+            image, dist = vision.process(frame, GameState.ROUND)
+            frameTimes.append(perf_counter()-start)
+            if dist is not None:
+                print(f"frame {frameIdx:<6}distance {dist:.3f}")
+    finally:
+        if not args.in_process:
+            vision.stop()
+        source.release()
+
+    print(f"frames {len(frameTimes)}, median {1000*np.median(frameTimes):.2f} ms, max {1000*np.max(frameTimes):.2f} ms")
+    for name in ['worker_process_seconds', 'model_warp_seconds', 'model_hit_classify_seconds', 'model_lines_seconds']:
+        histogram = defaultRegistry.get(name)
+        if histogram is not None and histogram.getCount():
+            print(f"{name:<30}{1000*histogram.getSum()/histogram.getCount():.2f} ms mean")